@@ -0,0 +1,120 @@
+import heapq
+import time
+from threading import Lock
+
+from back.database import *
+
+from massage_varibles import *
+from varibles import *
+
+class AssignmentEngine:
+    """Выбор исполнителя для /fair с учетом нагрузки.
+
+    Кандидаты лежат в куче по ключу (число открытых задач, время последнего назначения):
+    первым идет наименее загруженный, при равной нагрузке - тот, кому назначали раньше всех.
+    Нагрузка исполнителя перечитывается из tasks при взятии, возврате и закрытии его задачи;
+    устаревшие записи кучи пропускаются при выборе, поэтому выбор и обновление стоят O(log n).
+    """
+    def __init__(self, db: Database, position: str = FAIR_POSITION):
+        self.db = db
+        self.position = position
+        # user_id -> {'first_name', 'last_name', 'email', 'id_tg', 'username_tg', 'open_tasks', 'last_assigned', 'version'}
+        self._candidates = {}
+        # id_tg -> user_id, задачи в tasks привязаны к Telegram ID
+        self._by_tg = {}
+        self._heap = []
+        self._loaded_at = 0
+        self._lock = Lock()
+        # Статистика
+        self.picks = 0
+        self.refreshes = 0
+        self.reloads = 0
+
+    def load(self):
+        """Строит кучу кандидатов по users и tasks (при запуске и раз в ASSIGNMENT_RELOAD_INTERVAL)"""
+        rows = self.db.get_assignment_candidates(self.position)
+        if rows is None:
+            return
+        with self._lock:
+            previous = self._candidates
+            self._candidates, self._by_tg, self._heap = {}, {}, []
+            for user_id, first_name, last_name, email, id_tg, username_tg, open_tasks, last_taken in rows:
+                # Назначения через /fair не пишутся в БД - сохраняем их между перезагрузками
+                last_assigned = max(last_taken, previous.get(user_id, {}).get('last_assigned', 0))
+                self._candidates[user_id] = {
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'email': email,
+                    'id_tg': id_tg,
+                    'username_tg': username_tg,
+                    'open_tasks': open_tasks,
+                    'last_assigned': last_assigned,
+                    'version': 0
+                }
+                if id_tg is not None:
+                    self._by_tg[str(id_tg)] = user_id
+                self._heap.append((open_tasks, last_assigned, user_id, 0))
+            heapq.heapify(self._heap)
+            self._loaded_at = time.time()
+            self.reloads += 1
+        LOGGER.info(f"Кандидаты для /fair загружены: {len(rows)}")
+
+    def refresh(self, id_tg):
+        """Перечитывает нагрузку исполнителя из tasks после создания, возврата или закрытия задачи"""
+        with self._lock:
+            user_id = self._by_tg.get(str(id_tg))
+        if user_id is None:
+            return
+        state = self.db.get_open_task_state(id_tg)
+        if state is None:
+            return
+        open_tasks, last_taken = state
+        with self._lock:
+            candidate = self._candidates.get(user_id)
+            if candidate is None:
+                return
+            candidate['open_tasks'] = open_tasks
+            candidate['last_assigned'] = max(candidate['last_assigned'], last_taken)
+            self._push_locked(user_id, candidate)
+            self.refreshes += 1
+
+    def pick(self) -> dict:
+        """Возвращает наименее загруженного кандидата и переносит его в конец очереди равных"""
+        if time.time() - self._loaded_at >= ASSIGNMENT_RELOAD_INTERVAL:
+            # Подхватываем новых специалистов и смену должностей из users
+            self.load()
+        with self._lock:
+            while self._heap:
+                open_tasks, last_assigned, user_id, version = self._heap[0]
+                candidate = self._candidates.get(user_id)
+                if candidate is not None and candidate['version'] == version:
+                    break
+                heapq.heappop(self._heap)
+            else:
+                return None
+            candidate['last_assigned'] = time.time()
+            self._push_locked(user_id, candidate)
+            self.picks += 1
+            return dict(candidate, user_id=user_id)
+
+    def _push_locked(self, user_id: str, candidate: dict):
+        """Добавляет актуальную запись кандидата; прежние записи становятся устаревшими"""
+        candidate['version'] += 1
+        heapq.heappush(self._heap, (candidate['open_tasks'], candidate['last_assigned'], user_id, candidate['version']))
+        if len(self._heap) > 2 * len(self._candidates) + ASSIGNMENT_HEAP_SLACK:
+            self._heap = [
+                (entry['open_tasks'], entry['last_assigned'], key, entry['version'])
+                for key, entry in self._candidates.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def get_statistics(self):
+        """Возвращает размер кучи и счетчики выборов и обновлений"""
+        with self._lock:
+            return {
+                'candidates': len(self._candidates),
+                'heap': len(self._heap),
+                'picks': self.picks,
+                'refreshes': self.refreshes,
+                'reloads': self.reloads
+            }
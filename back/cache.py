@@ -0,0 +1,133 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from back.logger import *
+
+from massage_varibles import *
+from varibles import *
+
+class LRUCache:
+    """Потокобезопасный LRU-кеш, ограниченный по размеру и времени жизни записей.
+
+    _data упорядочен по давности использования (для вытеснения по размеру), _expiry - по времени
+    записи: TTL у всех записей один, поэтому в его начале всегда лежат те, что устареют первыми.
+    """
+    def __init__(self, max_size: int, ttl: float = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # key -> expires_at в порядке записи
+        self._expiry = OrderedDict()
+        self._lock = Lock()
+        # Статистика кеша
+        self.hits = 0
+        self.misses = 0
+        self.size_evictions = 0
+        self.ttl_evictions = 0
+
+    def get(self, key, default=None):
+        """Возвращает значение по ключу и отмечает запись как недавно использованную"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                self._delete_locked(key)
+                self.ttl_evictions += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def put(self, key, value=True):
+        """Добавляет или обновляет запись"""
+        with self._lock:
+            self._put_locked(key, value)
+
+    def add_if_absent(self, key, value=True) -> bool:
+        """Атомарно добавляет запись, если ее нет; возвращает True при добавлении"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and (item[1] is None or item[1] > time.time()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._put_locked(key, value)
+            return True
+
+    def pop(self, key, default=None):
+        """Удаляет запись и возвращает ее значение"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._delete_locked(key)
+            return item[0]
+
+    def clear(self):
+        """Очищает кеш"""
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+
+    def purge_expired(self) -> int:
+        """Удаляет устаревшие записи"""
+        with self._lock:
+            return self._purge_expired_locked()
+
+    def get_statistics(self):
+        """Возвращает размер кеша, попадания и вытеснения"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) * 100 if lookups > 0 else 0,
+            'size_evictions': self.size_evictions,
+            'ttl_evictions': self.ttl_evictions
+        }
+
+    def _put_locked(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        if expires_at is not None:
+            self._expiry[key] = expires_at
+            self._expiry.move_to_end(key)
+        self._purge_expired_locked()
+        while len(self._data) > self.max_size:
+            key, _ = self._data.popitem(last=False)
+            self._expiry.pop(key, None)
+            self.size_evictions += 1
+
+    def _delete_locked(self, key):
+        del self._data[key]
+        self._expiry.pop(key, None)
+
+    def _purge_expired_locked(self) -> int:
+        if self.ttl is None:
+            return 0
+        now = time.time()
+        purged = 0
+        while self._expiry:
+            key, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now:
+                break
+            self._delete_locked(key)
+            purged += 1
+        self.ttl_evictions += purged
+        return purged
+
+_MISSING = object()
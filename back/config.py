@@ -11,15 +11,30 @@ class Config:
         envparse.env.read_envfile()
         # Mattermost
         self.mattermost_server_url = envparse.env.str("MATTERMOST_SERVER_URL")
-        self.channel_id = envparse.env.str("MATTERMOST_CHANNEL_ID")
+        # Список каналов через запятую; для совместимости поддерживается один MATTERMOST_CHANNEL_ID
+        self.channel_ids = envparse.env.list("MATTERMOST_CHANNEL_IDS", default=[]) or [
+            envparse.env.str("MATTERMOST_CHANNEL_ID")
+        ]
+        self.channel_id = self.channel_ids[0]
         self.mattermost_bearer_token = envparse.env.str("MATTERMOST_BEARER_TOKEN")
         self.bot_user_id = envparse.env.str("MATTERMOST_BOT_USER_ID")
+        # Режим получения сообщений: poll (since-запросы) или websocket (события posted)
+        self.mattermost_ingest_mode = envparse.env.str("MATTERMOST_INGEST_MODE", default=INGEST_MODE_POLL)
         
         # Telegram
         self.telegram_bot_token = envparse.env.str("TELEGRAM_BOT_TOKEN")
         self.telegram_chat_id = envparse.env.str("TELEGRAM_CHAT_ID")
         self.manager_chat_id = envparse.env.str("MANAGER_CHAT_ID")
         
+        # Порт HTTP-сервера метрик Prometheus (/metrics)
+        self.metrics_port = envparse.env.int("METRICS_PORT", default=METRICS_PORT)
+        
+        # Хранение истории: сообщения старше retention_days переносятся в сжатый архив
+        self.retention_days = envparse.env.int("RETENTION_DAYS", default=RETENTION_DAYS)
+        self.archive_dir = envparse.env.str("ARCHIVE_DIR", default=ARCHIVE_DIR)
+        # Однократный перевод старой базы в auto_vacuum = INCREMENTAL при запуске (полный VACUUM)
+        self.convert_auto_vacuum = envparse.env.bool("DB_CONVERT_AUTO_VACUUM", default=False)
+        
         # Временные зоны
         self.ekb_tz = pytz.timezone('Asia/Yekaterinburg')
         self.msk_tz = pytz.timezone('Europe/Moscow')
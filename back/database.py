@@ -1,98 +1,121 @@
-from threading import Lock
+from threading import Condition, Event, Lock, local
+from contextlib import contextmanager
+import os
+import shutil
 import sqlite3
+import tempfile
+import time
 from sqlite3 import Error
-import random
+from bisect import bisect_left
+from datetime import datetime
 
 from back.logger import *
+from back.migrations import *
+from back.metrics import *
 
 from massage_varibles import *
 from varibles import *
 
 class Database:
-    """Класс для работы с базой данных SQLite"""
-    def __init__(self, db_file="messages.db"):
+    """Класс для работы с базой данных SQLite (WAL: один писатель, читатели на потоках)"""
+    def __init__(self, db_file="messages.db", synchronous: str = DB_SYNCHRONOUS,
+                 cache_size: int = DB_CACHE_SIZE, mmap_size: int = DB_MMAP_SIZE,
+                 busy_timeout: int = DB_BUSY_TIMEOUT):
         self.db_file = db_file
+        self.pragmas = {
+            'synchronous': synchronous,
+            'cache_size': cache_size,
+            'mmap_size': mmap_size,
+            'busy_timeout': busy_timeout
+        }
+        # Соединение писателя и блокировка записи
         self.conn = None
         self.lock = Lock()
+        # Соединения читателей: по одному на поток
+        self._readers = local()
+        self._reader_conns = []
+        self._readers_lock = Lock()
+        # Статистика ожидания блокировки записи
+        self.lock_waits = 0
+        self.lock_wait_total = 0.0
+        self.lock_wait_max = 0.0
+        self.reads = 0
         self._initialize_db()
         LOGGER.info(f"Инициализация базы данных: {db_file}")
 
+    def _connect(self):
+        """Открывает соединение с настроенными PRAGMA"""
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=self.pragmas['busy_timeout'] / 1000)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    @contextmanager
+    def _writer(self):
+        """Выдает соединение писателя под блокировкой записи, учитывая время ожидания"""
+        started = time.perf_counter()
+        with self.lock:
+            waited = time.perf_counter() - started
+            self.lock_waits += 1
+            self.lock_wait_total += waited
+            if waited > self.lock_wait_max:
+                self.lock_wait_max = waited
+            DB_LOCK_WAIT.observe(waited)
+            yield self.conn
+
+    @contextmanager
+    def _reader(self):
+        """Выдает соединение читателя текущего потока (без общей блокировки)"""
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._readers.conn = conn
+            with self._readers_lock:
+                self._reader_conns.append(conn)
+            LOGGER.debug(f"Открыто соединение читателя, всего: {len(self._reader_conns)}")
+        self.reads += 1
+        yield conn
+
+    def get_lock_statistics(self):
+        """Возвращает статистику ожидания блокировки записи и число читателей"""
+        return {
+            'writes': self.lock_waits,
+            'reads': self.reads,
+            'readers': len(self._reader_conns),
+            'lock_wait_total': self.lock_wait_total,
+            'lock_wait_avg': self.lock_wait_total / self.lock_waits if self.lock_waits > 0 else 0,
+            'lock_wait_max': self.lock_wait_max
+        }
+
     def _initialize_db(self):
         """Инициализация базы данных и создание таблиц"""
         try:
             LOGGER.info("Создание/проверка таблиц в базе данных")
-            self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
-            cursor = self.conn.cursor()
-            
-            # Таблица для сообщений
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    message_hash TEXT UNIQUE NOT NULL,
-                    message_text TEXT NOT NULL,
-                    channel_id TEXT NOT NULL,
-                    post_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    timestamp REAL NOT NULL,
-                    is_processed INTEGER DEFAULT 0,
-                    is_responded INTEGER DEFAULT 0,
-                    response_text TEXT,
-                    response_time REAL,
-                    responder_id TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Таблица для пользователей
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT UNIQUE NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    position TEXT,
-                    email TEXT,
-                    id_tg TEXT,
-                    username_tg TEXT,
-                    time_zone TEXT,
-                    last_seen TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Таблица для задач
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    message_id INTEGER NOT NULL,
-                    assigned_to TEXT NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    taken_at TIMESTAMP,
-                    completed_at TIMESTAMP,
-                    FOREIGN KEY (message_id) REFERENCES messages (id)
-                )
-            """)
-            
-            self.conn.commit()
-            LOGGER.info("Таблицы в базе данных успешно созданы/проверены")
+            self.conn = self._connect()
+            # Новая база создается с постраничным освобождением места (PRAGMA incremental_vacuum)
+            if not self.conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+                self.conn.execute(f"PRAGMA auto_vacuum = {DB_AUTO_VACUUM_INCREMENTAL}")
+            journal_mode = self.conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}").fetchone()[0]
+            LOGGER.info(f"Режим журнала SQLite: {journal_mode}, PRAGMA: {self.pragmas}")
+            version = apply_migrations(self.conn)
+            LOGGER.info(f"Таблицы в базе данных успешно созданы/проверены, версия схемы: {version}")
         except Error as e:
             error=str(e)
-            LOGGER.error(DB_INIT_ERROR).format(error=error)
+            LOGGER.error(DB_INIT_ERROR.format(error=error))
             raise
 
     def add_message(self, message_hash: str, message_text: str, channel_id: str, 
                    post_id: str, user_id: str, timestamp: float):
         """Добавляет сообщение в базу данных"""
-        with self.lock:
+        with self._writer() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     INSERT OR IGNORE INTO messages 
                     (message_hash, message_text, channel_id, post_id, user_id, timestamp)
                     VALUES (?, ?, ?, ?, ?, ?)
                 """, (message_hash, message_text, channel_id, post_id, user_id, timestamp))
-                self.conn.commit()
+                conn.commit()
                 if cursor.rowcount > 0:
                     LOGGER.debug(f"Сообщение добавлено в БД: {message_hash}")
                 else:
@@ -100,66 +123,704 @@ class Database:
                 return cursor.lastrowid
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_ADD_MESSAGE_ERROR).format(error=error)
+                LOGGER.error(DB_ADD_MESSAGE_ERROR.format(error=error))
+                return None
+    def store_messages(self, messages: list, enqueued_at: float, cursors: dict = None):
+        """Записывает пачку сообщений и их постановку в очередь (или откладывание) одной транзакцией.
+
+        messages - словари сообщений с message_hash и timestamp; сообщение с release_at откладывается
+        до этого времени, остальные сразу ставятся в ingest_queue. Уже обработанные сообщения пропускаются.
+        cursors - {channel_id: (last_create_at, seen_post_ids)}: курсоры поллинга, сдвигаемые вместе с пачкой.
+        Возвращает хеши новых сообщений или None при ошибке (тогда не записано ничего).
+        """
+        if not messages and not cursors:
+            return []
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                processed = set()
+                for chunk in _chunks([message['message_hash'] for message in messages], DB_MAX_VARIABLES):
+                    cursor.execute(f"""
+                        SELECT message_hash FROM messages
+                        WHERE is_processed = 1 AND message_hash IN ({','.join('?' * len(chunk))})
+                    """, chunk)
+                    processed.update(row[0] for row in cursor.fetchall())
+                new_messages = [message for message in messages if message['message_hash'] not in processed]
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO messages 
+                    (message_hash, message_text, channel_id, post_id, user_id, timestamp, is_processed)
+                    VALUES (?, ?, ?, ?, ?, ?, 1)
+                """, [
+                    (message['message_hash'], message['message'], message['channel_id'], message['post_id'],
+                     message['user_id'], message['timestamp'])
+                    for message in new_messages
+                ])
+                # Сообщения, записанные ранее без отметки об обработке
+                cursor.executemany("""
+                    UPDATE messages SET is_processed = 1 WHERE message_hash = ? AND is_processed = 0
+                """, [(message['message_hash'],) for message in new_messages])
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO ingest_queue
+                    (message_hash, message_text, channel_id, post_id, user_id, root_id, create_at, timestamp,
+                     enqueued_at, available_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (message['message_hash'], message['message'], message['channel_id'], message['post_id'],
+                     message['user_id'], message.get('root_id'), message.get('create_at'), message['timestamp'],
+                     enqueued_at, enqueued_at)
+                    for message in new_messages if message.get('release_at') is None
+                ])
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO deferred_messages
+                    (message_hash, message_text, channel_id, post_id, user_id, root_id, timestamp, release_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (message['message_hash'], message['message'], message['channel_id'], message['post_id'],
+                     message['user_id'], message.get('root_id'), message['timestamp'], message['release_at'])
+                    for message in new_messages if message.get('release_at') is not None
+                ])
+                for channel_id, (last_create_at, seen_post_ids) in (cursors or {}).items():
+                    self._save_poll_cursor(cursor, channel_id, last_create_at, seen_post_ids)
+                conn.commit()
+                LOGGER.debug(f"Пачка сообщений записана в БД: {len(new_messages)} новых из {len(messages)}")
+                return [message['message_hash'] for message in new_messages]
+            except Error as e:
+                conn.rollback()
+                error=str(e)
+                LOGGER.error(DB_ADD_MESSAGE_ERROR.format(error=error))
                 return None
+
+    def get_processed_hashes(self, hashes: list) -> set:
+        """Возвращает хеши из списка, которые уже отмечены обработанными"""
+        processed = set()
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                for chunk in _chunks(hashes, DB_MAX_VARIABLES):
+                    cursor.execute(f"""
+                        SELECT message_hash FROM messages
+                        WHERE is_processed = 1 AND message_hash IN ({','.join('?' * len(chunk))})
+                    """, chunk)
+                    processed.update(row[0] for row in cursor.fetchall())
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_GET_MESSAGE_ERROR.format(error=error))
+        return processed
+
     def get_message_by_hash(self, message_hash: str):
         """Получает сообщение по хешу"""
-        with self.lock:
+        with self._reader() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     SELECT * FROM messages WHERE message_hash = ?
                 """, (message_hash,))
                 return cursor.fetchone()
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_GET_MESSAGE_ERROR).format(error=error)
+                LOGGER.error(DB_GET_MESSAGE_ERROR.format(error=error))
+                return None
+
+    def get_message_state(self, message_hash: str):
+        """Возвращает (id, is_processed, is_responded) сообщения без чтения текстов"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, is_processed, is_responded FROM messages WHERE message_hash = ?
+                """, (message_hash,))
+                return cursor.fetchone()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_GET_MESSAGE_ERROR.format(error=error))
                 return None
 
+    def get_recent_message_keys(self, since: float, limit: int) -> list:
+        """Возвращает (channel_id, post_id) обработанных после since сообщений, от новых к старым"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT channel_id, post_id FROM messages
+                    WHERE timestamp >= ? AND is_processed = 1
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                """, (since, limit))
+                return cursor.fetchall()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_GET_MESSAGE_ERROR.format(error=error))
+                return []
+
+    def iter_messages(self, since: float = None, until: float = None, batch_size: int = REPLAY_BATCH_SIZE):
+        """Выдает сообщения в порядке времени страницами по batch_size, не держа курсор между страницами.
+
+        Строки: (id, message_text, channel_id, post_id, user_id, timestamp).
+        """
+        last_timestamp, last_id = (since if since is not None else float('-inf')), -1
+        until = until if until is not None else float('inf')
+        while True:
+            with self._reader() as conn:
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute("""
+                        SELECT id, message_text, channel_id, post_id, user_id, timestamp FROM messages
+                        WHERE (timestamp > ? OR (timestamp = ? AND id > ?)) AND timestamp < ?
+                        ORDER BY timestamp, id LIMIT ?
+                    """, (last_timestamp, last_timestamp, last_id, until, batch_size))
+                    rows = cursor.fetchall()
+                except Error as e:
+                    error=str(e)
+                    LOGGER.error(DB_GET_MESSAGE_ERROR.format(error=error))
+                    return
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id, last_timestamp = rows[-1][0], rows[-1][5]
+
+    def mark_message_processed(self, message_hash: str):
+        """Отмечает сообщение как обработанное"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE messages SET is_processed = 1 WHERE message_hash = ?
+                """, (message_hash,))
+                conn.commit()
+                return cursor.rowcount > 0
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_GET_MESSAGE_ERROR.format(error=error))
+                return False
+
     def update_message_response(self, message_hash: str, response_text: str, 
-                              responder_id: str, response_time: float):
-        """Обновляет информацию об ответе на сообщение"""
-        with self.lock:
+                              responder_id: str, response_time: float, is_actual: bool = None,
+                              record_response: bool = False):
+        """Обновляет информацию об ответе на сообщение и снимает таймеры ожидающей задачи.
+
+        record_response - это настоящий ответ в треде (а не взятие в работу), его время попадает в агрегаты.
+        """
+        with self._writer() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT timestamp, is_responded, response_text FROM messages WHERE message_hash = ?
+                """, (message_hash,))
+                previous = cursor.fetchone()
                 cursor.execute("""
                     UPDATE messages 
                     SET is_responded = 1, response_text = ?, 
                         responder_id = ?, response_time = ?
                     WHERE message_hash = ?
                 """, (response_text, responder_id, response_time, message_hash))
-                self.conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                # В агрегаты попадает только первый ответ на сообщение; взятие в работу ответом не считается
+                first_response = previous and (
+                    not previous[1] or (previous[2] or '').startswith(TASK_TAKEN_RESPONSE_PREFIX)
+                )
+                if record_response and first_response and responder_id:
+                    self._add_responder_stat(cursor, responder_id, STATS_KIND_RESPONSE,
+                                             response_time - previous[0], response_time)
+                # В той же транзакции: на задачу ответили - напоминания и эскалация больше не нужны
+                cursor.execute("""
+                    UPDATE pending_tasks
+                    SET is_actual = COALESCE(?, is_actual),
+                        next_reminder_at = NULL, escalate_at = NULL
+                    WHERE message_hash = ?
+                """, (None if is_actual is None else int(is_actual), message_hash))
+                conn.commit()
+                return updated
             except Error as e:
+                conn.rollback()
                 error=str(e)
-                LOGGER.error(DB_UPDATE_RESPONSE_ERROR).format(error=error)
+                LOGGER.error(DB_UPDATE_RESPONSE_ERROR.format(error=error))
                 return False
     
     def reset_message_response(self, message_hash: str):
-        """Сбрасывает статус ответа на сообщение"""
-        with self.lock:
+        """Сбрасывает статус ответа на сообщение и возвращает задачу в ожидание"""
+        with self._writer() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     UPDATE messages 
                     SET is_responded = 0, response_text = NULL, 
                         responder_id = NULL, response_time = NULL
                     WHERE message_hash = ?
                 """, (message_hash,))
-                self.conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                cursor.execute("""
+                    UPDATE pending_tasks SET is_actual = 1, task_id = NULL
+                    WHERE message_hash = ?
+                """, (message_hash,))
+                conn.commit()
+                return updated
             except Error as e:
+                conn.rollback()
                 error = str(e)
-                LOGGER.error(DB_UPDATE_RESPONSE_ERROR).format(error=error)
+                LOGGER.error(DB_UPDATE_RESPONSE_ERROR.format(error=error))
                 return False
 
+    def add_pending_task(self, chat_id: str, telegram_message_id: int, message_data: dict,
+                         escalate_at: float = None):
+        """Сохраняет ожидающую ответа задачу (сообщение в Telegram с кнопкой)"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT OR REPLACE INTO pending_tasks
+                    (chat_id, telegram_message_id, message_hash, message_text, channel_id,
+                     post_id, user_id, timestamp, is_actual, escalate_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (str(chat_id), telegram_message_id, message_data['message_hash'],
+                      message_data['message'], message_data['channel_id'], message_data['post_id'],
+                      message_data['user_id'], message_data.get('timestamp', time.time()),
+                      int(message_data.get('is_actual', True)), escalate_at))
+                conn.commit()
+                return True
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_PENDING_TASK_ERROR.format(error=error))
+                return False
+
+    def record_message_stages(self, records: list) -> bool:
+        """Сохраняет отметки стадий: records - кортежи (message_hash, стадия, время)"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                for message_hash, stage, timestamp in records:
+                    if stage not in MESSAGE_STAGES:
+                        continue
+                    cursor.execute("""
+                        INSERT OR IGNORE INTO message_stages (message_id)
+                        SELECT id FROM messages WHERE message_hash = ?
+                    """, (message_hash,))
+                    # Имя столбца берется только из MESSAGE_STAGES; первая отметка стадии сохраняется
+                    cursor.execute(f"""
+                        UPDATE message_stages SET {stage}_at = COALESCE({stage}_at, ?)
+                        WHERE message_id = (SELECT id FROM messages WHERE message_hash = ?)
+                    """, (timestamp, message_hash))
+                conn.commit()
+                return True
+            except Error as e:
+                conn.rollback()
+                error=str(e)
+                LOGGER.error(DB_MESSAGE_STAGES_ERROR.format(error=error))
+                return False
+
+    def get_message_stages(self, since: float) -> list:
+        """Возвращает отметки стадий (в порядке MESSAGE_STAGES) сообщений, замеченных после since"""
+        columns = ', '.join(f"{stage}_at" for stage in MESSAGE_STAGES)
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT {columns} FROM message_stages WHERE seen_at >= ?", (since,))
+                return cursor.fetchall()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_MESSAGE_STAGES_ERROR.format(error=error))
+                return []
+
+    def release_deferred_messages(self, released_before: float, limit: int, enqueued_at: float):
+        """Переносит до limit отложенных сообщений, время выпуска которых наступило, в ingest_queue.
+
+        Перенос и удаление из deferred_messages идут одной транзакцией.
+        Возвращает хеши выпущенных сообщений в порядке поступления или None при ошибке.
+        """
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT message_hash FROM deferred_messages
+                    WHERE release_at <= ?
+                    ORDER BY release_at, timestamp
+                    LIMIT ?
+                """, (released_before, limit))
+                message_hashes = [row[0] for row in cursor.fetchall()]
+                for chunk in _chunks(message_hashes, DB_MAX_VARIABLES):
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f"""
+                        INSERT OR IGNORE INTO ingest_queue
+                        (message_hash, message_text, channel_id, post_id, user_id, root_id, timestamp,
+                         enqueued_at, available_at)
+                        SELECT message_hash, message_text, channel_id, post_id, user_id, root_id, timestamp, ?, ?
+                        FROM deferred_messages
+                        WHERE message_hash IN ({placeholders})
+                        ORDER BY release_at, timestamp
+                    """, [enqueued_at, enqueued_at, *chunk])
+                    cursor.execute(f"""
+                        DELETE FROM deferred_messages WHERE message_hash IN ({placeholders})
+                    """, chunk)
+                conn.commit()
+                return message_hashes
+            except Error as e:
+                conn.rollback()
+                error=str(e)
+                LOGGER.error(DB_DEFERRED_ERROR.format(error=error))
+                return None
+
+    def get_next_deferred_release(self):
+        """Возвращает ближайшее время выпуска отложенных сообщений или None"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT MIN(release_at) FROM deferred_messages")
+                return cursor.fetchone()[0]
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_DEFERRED_ERROR.format(error=error))
+                return None
+
+    def enqueue_messages(self, messages: list, enqueued_at: float):
+        """Ставит сообщения в долговечную очередь на пересылку (повторная постановка игнорируется).
+
+        Возвращает число поставленных сообщений или None при ошибке.
+        """
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO ingest_queue
+                    (message_hash, message_text, channel_id, post_id, user_id, root_id, create_at, timestamp,
+                     enqueued_at, available_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (message['message_hash'], message['message'], message['channel_id'], message['post_id'],
+                     message['user_id'], message.get('root_id'), message.get('create_at'), message['timestamp'],
+                     enqueued_at, enqueued_at)
+                    for message in messages
+                ])
+                conn.commit()
+                return cursor.rowcount
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_INGEST_QUEUE_ERROR.format(error=error))
+                return None
+
+    def claim_queued_messages(self, limit: int, visibility_timeout: float, exclude: list = ()) -> list:
+        """Забирает до limit доступных сообщений в порядке постановки и скрывает их на visibility_timeout.
+
+        Строки: (message_hash, message_text, channel_id, post_id, user_id, root_id, create_at, timestamp, attempts).
+        """
+        now = time.time()
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT message_hash, message_text, channel_id, post_id, user_id, root_id, create_at, timestamp,
+                           attempts + 1
+                    FROM ingest_queue
+                    WHERE available_at <= ? AND message_hash NOT IN ({','.join('?' * len(exclude))})
+                    ORDER BY rowid
+                    LIMIT ?
+                """, (now, *exclude, limit))
+                rows = cursor.fetchall()
+                cursor.executemany("""
+                    UPDATE ingest_queue SET available_at = ?, attempts = attempts + 1 WHERE message_hash = ?
+                """, [(now + visibility_timeout, row[0]) for row in rows])
+                conn.commit()
+                return rows
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_INGEST_QUEUE_ERROR.format(error=error))
+                return []
+
+    def ack_queued_messages(self, message_hashes: list) -> int:
+        """Удаляет из очереди обработанные сообщения"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                deleted = 0
+                for chunk in _chunks(list(message_hashes), DB_MAX_VARIABLES):
+                    cursor.execute(f"""
+                        DELETE FROM ingest_queue WHERE message_hash IN ({','.join('?' * len(chunk))})
+                    """, chunk)
+                    deleted += cursor.rowcount
+                conn.commit()
+                return deleted
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_INGEST_QUEUE_ERROR.format(error=error))
+                return 0
+
+    def release_queued_messages(self) -> int:
+        """Возвращает в очередь все забранные сообщения (после перезапуска у них нет обработчика)"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE ingest_queue SET available_at = enqueued_at WHERE available_at > enqueued_at")
+                conn.commit()
+                return cursor.rowcount
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_INGEST_QUEUE_ERROR.format(error=error))
+                return 0
+
+    def get_ingest_queue_state(self):
+        """Возвращает глубину очереди и время постановки самого старого сообщения (None, если пусто)"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*), MIN(enqueued_at) FROM ingest_queue")
+                return cursor.fetchone()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_INGEST_QUEUE_ERROR.format(error=error))
+                return 0, None
+
+    def get_expired_messages(self, before: float, limit: int) -> list:
+        """Возвращает до limit сообщений старше before (столбцы ARCHIVE_MESSAGE_COLUMNS), от старых к новым.
+
+        Сообщения, которые еще ждут ответа, доставки или выпуска из отложенных, не возвращаются.
+        """
+        columns = ', '.join(f"m.{column}" for column in ARCHIVE_MESSAGE_COLUMNS)
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT {columns} FROM messages m
+                    WHERE m.timestamp < ?
+                      AND NOT EXISTS (SELECT 1 FROM pending_tasks p WHERE p.message_hash = m.message_hash)
+                      AND NOT EXISTS (SELECT 1 FROM ingest_queue q WHERE q.message_hash = m.message_hash)
+                      AND NOT EXISTS (SELECT 1 FROM deferred_messages d WHERE d.message_hash = m.message_hash)
+                    ORDER BY m.timestamp, m.id
+                    LIMIT ?
+                """, (before, limit))
+                return cursor.fetchall()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_RETENTION_ERROR.format(error=error))
+                return []
+
+    def get_tasks_by_message_ids(self, message_ids: list) -> list:
+        """Возвращает задачи сообщений (столбцы ARCHIVE_TASK_COLUMNS)"""
+        columns = ', '.join(ARCHIVE_TASK_COLUMNS)
+        tasks = []
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                for chunk in _chunks(list(message_ids), DB_MAX_VARIABLES):
+                    cursor.execute(f"""
+                        SELECT {columns} FROM tasks WHERE message_id IN ({','.join('?' * len(chunk))})
+                    """, chunk)
+                    tasks.extend(cursor.fetchall())
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_RETENTION_ERROR.format(error=error))
+        return tasks
+
+    def delete_archived_messages(self, message_ids: list) -> int:
+        """Удаляет заархивированные сообщения вместе с их задачами и отметками стадий"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                deleted = 0
+                for chunk in _chunks(list(message_ids), DB_MAX_VARIABLES):
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f"DELETE FROM tasks WHERE message_id IN ({placeholders})", chunk)
+                    cursor.execute(f"DELETE FROM message_stages WHERE message_id IN ({placeholders})", chunk)
+                    cursor.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", chunk)
+                    deleted += cursor.rowcount
+                conn.commit()
+                return deleted
+            except Error as e:
+                conn.rollback()
+                error=str(e)
+                LOGGER.error(DB_RETENTION_ERROR.format(error=error))
+                return 0
+
+    def get_vacuum_state(self) -> dict:
+        """Возвращает режим auto_vacuum, число свободных страниц и размер файла базы"""
+        with self._reader() as conn:
+            try:
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+                return {
+                    'auto_vacuum': conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+                    'freelist_count': conn.execute("PRAGMA freelist_count").fetchone()[0],
+                    'page_count': page_count,
+                    'size_bytes': page_count * page_size
+                }
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_RETENTION_ERROR.format(error=error))
+                return None
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """Возвращает файловой системе до pages свободных страниц; держит запись только на этот шаг"""
+        with self._writer() as conn:
+            try:
+                before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                # executescript доводит прагму до конца: через execute освобождается одна страница за вызов
+                conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+                return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_RETENTION_ERROR.format(error=error))
+                return 0
+
+    def enable_incremental_vacuum(self) -> bool:
+        """Переводит существующую базу в auto_vacuum = INCREMENTAL полным VACUUM.
+
+        Держит блокировку записи на все время перестроения, поэтому вызывается только при запуске,
+        до старта обработчиков (DB_CONVERT_AUTO_VACUUM), и только при достаточном месте на диске.
+        """
+        state = self.get_vacuum_state()
+        if state is None:
+            return False
+        if state['auto_vacuum'] == DB_AUTO_VACUUM_INCREMENTAL:
+            return True
+        required = state['size_bytes'] * VACUUM_FREE_SPACE_FACTOR
+        for path in {os.path.dirname(os.path.abspath(self.db_file)), tempfile.gettempdir()}:
+            free = shutil.disk_usage(path).free
+            if free < required:
+                LOGGER.error(DB_VACUUM_SPACE_ERROR.format(required=required, free=free, path=path))
+                return False
+        with self._writer() as conn:
+            try:
+                conn.commit()
+                conn.execute(f"PRAGMA auto_vacuum = {DB_AUTO_VACUUM_INCREMENTAL}")
+                conn.execute("VACUUM")
+                return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == DB_AUTO_VACUUM_INCREMENTAL
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_RETENTION_ERROR.format(error=error))
+                return False
+
+    def set_pending_reminder(self, message_hash: str, reminder_number: int, next_reminder_at: float = None):
+        """Сохраняет номер и время следующего напоминания по задаче"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE pending_tasks SET reminder_number = ?, next_reminder_at = ?
+                    WHERE message_hash = ?
+                """, (reminder_number, next_reminder_at, message_hash))
+                conn.commit()
+                return cursor.rowcount > 0
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_PENDING_TASK_ERROR.format(error=error))
+                return False
+
+    def clear_pending_escalation(self, message_hash: str):
+        """Снимает отметку об ожидающей эскалации по задаче"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE pending_tasks SET escalate_at = NULL WHERE message_hash = ?
+                """, (message_hash,))
+                conn.commit()
+                return cursor.rowcount > 0
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_PENDING_TASK_ERROR.format(error=error))
+                return False
+
+    PENDING_TASK_COLUMNS = """
+        p.chat_id, p.telegram_message_id, p.message_hash, p.message_text,
+        p.channel_id, p.post_id, p.user_id, p.timestamp, p.is_actual,
+        p.reminder_number, p.next_reminder_at, p.escalate_at,
+        COALESCE(m.is_responded, 0)
+    """
+
+    def get_pending_tasks(self):
+        """Получает все ожидающие задачи вместе со статусом ответа одним запросом"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT {self.PENDING_TASK_COLUMNS}
+                    FROM pending_tasks p
+                    LEFT JOIN messages m ON m.message_hash = p.message_hash
+                """)
+                return cursor.fetchall()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_PENDING_TASK_ERROR.format(error=error))
+                return []
+
+    def get_pending_task(self, chat_id: str, telegram_message_id: int):
+        """Получает ожидающую задачу по сообщению в Telegram (для вытесненных из памяти)"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT {self.PENDING_TASK_COLUMNS}
+                    FROM pending_tasks p
+                    LEFT JOIN messages m ON m.message_hash = p.message_hash
+                    WHERE p.chat_id = ? AND p.telegram_message_id = ?
+                """, (str(chat_id), telegram_message_id))
+                return cursor.fetchone()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_PENDING_TASK_ERROR.format(error=error))
+                return None
+
+    def delete_pending_tasks_before(self, timestamp: float):
+        """Удаляет ожидающие задачи, созданные раньше указанного времени"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM pending_tasks WHERE timestamp < ?
+                """, (timestamp,))
+                conn.commit()
+                return cursor.rowcount
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_PENDING_TASK_ERROR.format(error=error))
+                return 0
+
+    def get_poll_cursor(self, channel_id: str):
+        """Получает курсор поллинга канала: (create_at последнего поста, ID постов с этим create_at)"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT last_create_at, seen_post_ids FROM poll_cursors WHERE channel_id = ?
+                """, (channel_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                return row[0], set(filter(None, row[1].split(',')))
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_POLL_CURSOR_ERROR.format(error=error))
+                return None
+
+    def save_poll_cursor(self, channel_id: str, last_create_at: int, seen_post_ids: set):
+        """Сохраняет курсор поллинга канала"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                self._save_poll_cursor(cursor, channel_id, last_create_at, seen_post_ids)
+                conn.commit()
+                return True
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_POLL_CURSOR_ERROR.format(error=error))
+                return False
+
+    @staticmethod
+    def _save_poll_cursor(cursor, channel_id: str, last_create_at: int, seen_post_ids: set):
+        """Записывает курсор поллинга канала (в транзакции вызывающего)"""
+        cursor.execute("""
+            INSERT INTO poll_cursors (channel_id, last_create_at, seen_post_ids, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                last_create_at = excluded.last_create_at,
+                seen_post_ids = excluded.seen_post_ids,
+                updated_at = excluded.updated_at
+        """, (channel_id, last_create_at, ','.join(sorted(seen_post_ids)), time.time()))
+
     def add_or_update_user(self, user_id: str, username: str = None, 
                             first_name: str = None, last_name: str = None, 
                             position: str = None, email: str = None, id_tg: str = None, username_tg: str = None, time_zone: str = None):
         """Добавляет или обновляет информацию о пользователе"""
-        with self.lock:
+        with self._writer() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     INSERT INTO users 
                     (user_id, username, first_name, last_name, position, email, id_tg, username_tg, time_zone, last_seen)
@@ -176,61 +837,77 @@ class Database:
                         time_zone = COALESCE(excluded.time_zone, time_zone),
                         last_seen = CURRENT_TIMESTAMP
                 """, (user_id, username, first_name, last_name, position, email, id_tg, username_tg, time_zone))
-                self.conn.commit()
+                conn.commit()
                 LOGGER.debug(f"Пользователь обновлен/добавлен в БД: {user_id}")
                 return True
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_USER_UPDATE_ERROR).format(error=error)
+                LOGGER.error(DB_USER_UPDATE_ERROR.format(error=error))
                 return False
 
     def get_user_info(self, user_id: str):
         """Получает информацию о пользователе"""
-        with self.lock:
+        with self._reader() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     SELECT * FROM users WHERE user_id = ?
                 """, (user_id,))
                 return cursor.fetchone()
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_GET_USER_ERROR).format(error=error)
+                LOGGER.error(DB_GET_USER_ERROR.format(error=error))
                 return None
-    
+
+    def get_users_info(self, user_ids: list) -> dict:
+        """Получает информацию о нескольких пользователях: user_id -> строка users"""
+        users = {}
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                for chunk in _chunks(list(user_ids), DB_MAX_VARIABLES):
+                    cursor.execute(f"""
+                        SELECT * FROM users WHERE user_id IN ({','.join('?' * len(chunk))})
+                    """, chunk)
+                    users.update((row[1], row) for row in cursor.fetchall())
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_GET_USER_ERROR.format(error=error))
+        return users
+
     def get_user_info_tg(self, user_id: str):
         """Получает информацию о пользователе"""
-        with self.lock:
+        with self._reader() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     SELECT * FROM users WHERE id_tg = ?
                 """, (user_id,))
                 return cursor.fetchone()
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_GET_USER_ERROR).format(error=error)
+                LOGGER.error(DB_GET_USER_ERROR.format(error=error))
                 return None
             
     def get_user_email(self, user_email: str):
         """Получает информацию о пользователе"""
-        with self.lock:
+        with self._reader() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     SELECT * FROM users WHERE email = ?
                 """, (user_email,))
                 return cursor.fetchone()
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_GET_USER_ERROR).format(error=error)
+                LOGGER.error(DB_GET_USER_ERROR.format(error=error))
                 return None
 
     def get_users_with_time_zone(self):
         """Получает всех пользователей с их часовыми поясами из базы данных."""
-        with self.lock:
+        with self._reader() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     SELECT id_tg, username_tg, position, time_zone
                     FROM users
@@ -239,50 +916,79 @@ class Database:
                 return users  # Возвращаем список кортежей с данными пользователей
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_GET_USERS_TZ_ERROR).format(error=error)
+                LOGGER.error(DB_GET_USERS_TZ_ERROR.format(error=error))
                 return []
 
-    def get_random_user_by_position(self, position: str):
-        """Получает случайного пользователя с указанной позицией"""
-        with self.lock:
+    def get_assignment_candidates(self, position: str):
+        """Получает пользователей с указанной позицией, число их открытых задач и время последнего взятия"""
+        with self._reader() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
-                    SELECT * FROM users WHERE position = ?
-                """, (position,))
-                users = cursor.fetchall()
-                if users:
-                    return random.choice(users)  # Возвращаем случайного пользователя
-                else:
-                    return None  # Если нет пользователей с такой позицией
+                    SELECT u.user_id, u.first_name, u.last_name, u.email, u.id_tg, u.username_tg,
+                           COUNT(CASE WHEN t.status = ? AND t.taken_at >= datetime(?, 'unixepoch') THEN 1 END),
+                           COALESCE(MAX(CAST(strftime('%s', t.taken_at) AS INTEGER)), 0)
+                    FROM users u
+                    LEFT JOIN tasks t ON t.assigned_to = CAST(u.id_tg AS TEXT)
+                    WHERE u.position = ?
+                    GROUP BY u.id
+                """, (TASK_STATUS_PENDING, int(time.time() - ASSIGNMENT_OPEN_TASK_TTL), position))
+                return cursor.fetchall()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_ASSIGNMENT_ERROR.format(error=error))
+                return None
+
+    def get_open_task_state(self, assigned_to: str):
+        """Возвращает число открытых задач исполнителя и время последнего взятия задачи"""
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT COUNT(CASE WHEN status = ? AND taken_at >= datetime(?, 'unixepoch') THEN 1 END),
+                           COALESCE(MAX(CAST(strftime('%s', taken_at) AS INTEGER)), 0)
+                    FROM tasks WHERE assigned_to = ?
+                """, (TASK_STATUS_PENDING, int(time.time() - ASSIGNMENT_OPEN_TASK_TTL), str(assigned_to)))
+                return cursor.fetchone()
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_RANDOM_USER_ERROR).format(error=error)
+                LOGGER.error(DB_ASSIGNMENT_ERROR.format(error=error))
                 return None
 
     def create_task(self, message_id: int, assigned_to: str):
-        """Создает новую задачу"""
-        with self.lock:
+        """Создает новую задачу и привязывает ее к ожидающей задаче"""
+        with self._writer() as conn:
             try:
-                cursor = self.conn.cursor()
+                cursor = conn.cursor()
                 cursor.execute("""
                     INSERT INTO tasks 
                     (message_id, assigned_to, status, taken_at)
-                    VALUES (?, ?, 'pending', CURRENT_TIMESTAMP)
-                """, (message_id, assigned_to))
-                self.conn.commit()
-                return cursor.lastrowid
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                """, (message_id, assigned_to, TASK_STATUS_PENDING))
+                task_id = cursor.lastrowid
+                cursor.execute("SELECT timestamp FROM messages WHERE id = ?", (message_id,))
+                message = cursor.fetchone()
+                if message:
+                    now = time.time()
+                    self._add_responder_stat(cursor, assigned_to, STATS_KIND_TAKEN, now - message[0], now)
+                cursor.execute("""
+                    UPDATE pending_tasks SET task_id = ?
+                    WHERE message_hash = (SELECT message_hash FROM messages WHERE id = ?)
+                """, (task_id, message_id))
+                conn.commit()
+                return task_id
             except Error as e:
+                conn.rollback()
                 error=str(e)
-                LOGGER.error(DB_CREATE_TASK_ERROR).format(error=error)
+                LOGGER.error(DB_CREATE_TASK_ERROR.format(error=error))
                 return None
 
     def update_task_status(self, task_id: int, status: str):
         """Обновляет статус задачи"""
-        with self.lock:
+        with self._writer() as conn:
             try:
-                cursor = self.conn.cursor()
-                if status == 'completed':
+                cursor = conn.cursor()
+                if status == TASK_STATUS_COMPLETED:
                     cursor.execute("""
                         UPDATE tasks 
                         SET status = ?, completed_at = CURRENT_TIMESTAMP
@@ -294,26 +1000,187 @@ class Database:
                         SET status = ?
                         WHERE id = ?
                     """, (status, task_id))
-                self.conn.commit()
+                conn.commit()
                 return cursor.rowcount > 0
             except Error as e:
                 error=str(e)
-                LOGGER.error(DB_UPDATE_TASK_ERROR).format(error=error)
+                LOGGER.error(DB_UPDATE_TASK_ERROR.format(error=error))
                 return False
+
+    def close_message_tasks(self, message_hash: str, status: str = TASK_STATUS_COMPLETED):
+        """Закрывает открытые задачи по сообщению (ответ или возврат) и возвращает их исполнителей"""
+        with self._writer() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id FROM messages WHERE message_hash = ?
+                """, (message_hash,))
+                message = cursor.fetchone()
+                if message is None:
+                    return []
+                cursor.execute("""
+                    SELECT DISTINCT assigned_to FROM tasks WHERE message_id = ? AND status = ?
+                """, (message[0], TASK_STATUS_PENDING))
+                assignees = [row[0] for row in cursor.fetchall()]
+                cursor.execute("""
+                    UPDATE tasks
+                    SET status = ?,
+                        completed_at = CASE WHEN ? = ? THEN CURRENT_TIMESTAMP ELSE completed_at END
+                    WHERE message_id = ? AND status = ?
+                """, (status, status, TASK_STATUS_COMPLETED, message[0], TASK_STATUS_PENDING))
+                conn.commit()
+                return assignees
+            except Error as e:
+                conn.rollback()
+                error=str(e)
+                LOGGER.error(DB_UPDATE_TASK_ERROR.format(error=error))
+                return []
     
+    @staticmethod
+    def _add_responder_stat(cursor, responder_id: str, kind: str, seconds: float, at: float):
+        """Добавляет событие в дневные агрегаты ответственного (в транзакции вызывающего)"""
+        seconds = max(seconds, 0)
+        day = datetime.fromtimestamp(at).strftime('%Y-%m-%d')
+        cursor.execute("""
+            INSERT INTO responder_stats (day, responder_id, kind, count, total_seconds, max_seconds)
+            VALUES (?, ?, ?, 1, ?, ?)
+            ON CONFLICT (day, responder_id, kind) DO UPDATE SET
+                count = count + 1,
+                total_seconds = total_seconds + excluded.total_seconds,
+                max_seconds = MAX(max_seconds, excluded.max_seconds)
+        """, (day, responder_id, kind, seconds, seconds))
+        cursor.execute("""
+            INSERT INTO responder_stats_histogram (day, responder_id, kind, bucket, count)
+            VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (day, responder_id, kind, bucket) DO UPDATE SET count = count + 1
+        """, (day, responder_id, kind, bisect_left(STATS_DURATION_BUCKETS, seconds)))
+
+    def get_responder_stats(self, since_day: str):
+        """Возвращает агрегаты с дня since_day (YYYY-MM-DD) по ответственным.
+
+        Первый список: (responder_id, имя, kind, count, total_seconds, max_seconds),
+        второй: (responder_id, kind, bucket, count) для оценки перцентилей.
+        """
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT s.responder_id,
+                           COALESCE(NULLIF(TRIM(COALESCE(u.first_name, '') || ' ' || COALESCE(u.last_name, '')), ''),
+                                    u.username_tg, s.responder_id),
+                           s.kind, s.count, s.total_seconds, s.max_seconds
+                    FROM (
+                        SELECT responder_id, kind, SUM(count) AS count, SUM(total_seconds) AS total_seconds,
+                               MAX(max_seconds) AS max_seconds
+                        FROM responder_stats WHERE day >= ?
+                        GROUP BY responder_id, kind
+                    ) s
+                    LEFT JOIN users u ON u.id = (SELECT MIN(id) FROM users WHERE id_tg = s.responder_id)
+                """, (since_day,))
+                totals = cursor.fetchall()
+                cursor.execute("""
+                    SELECT responder_id, kind, bucket, SUM(count) FROM responder_stats_histogram
+                    WHERE day >= ?
+                    GROUP BY responder_id, kind, bucket
+                """, (since_day,))
+                return totals, cursor.fetchall()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_STATS_ERROR.format(error=error))
+                return [], []
+
     def get_user_by_email(self, email: str):
         """Проверяет, существует ли пользователь с таким email"""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT user_id, username, first_name, last_name, position, time_zone FROM users WHERE email = ?", (email,))
-            return cursor.fetchone()
-        except Error as e:
-            error=str(e)
-            LOGGER.error(DB_GET_USER_EMAIL_ERROR).format(error=error)
-            return None
+        with self._reader() as conn:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT user_id, username, first_name, last_name, position, time_zone FROM users WHERE email = ?", (email,))
+                return cursor.fetchone()
+            except Error as e:
+                error=str(e)
+                LOGGER.error(DB_GET_USER_EMAIL_ERROR.format(error=error))
+                return None
 
     def close(self):
-        """Закрывает соединение с базой данных"""
+        """Закрывает соединения с базой данных"""
+        with self._readers_lock:
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns.clear()
         if self.conn:
             self.conn.close()
             LOGGER.info("Соединение с базой данных закрыто")
+
+def _chunks(items: list, size: int):
+    """Разбивает список на части не длиннее size (лимит параметров SQLite)"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class WriteBehindBuffer:
+    """Буфер отложенной записи сообщений: сбрасывается пачкой по размеру или по времени.
+
+    Сообщения и их постановка в очередь записываются одной транзакцией (Database.store_messages);
+    on_flush вызывается только после записи, поэтому дальше по конвейеру сообщения идут уже с
+    строкой в messages. При ошибке записи пачка остается в буфере до следующего сброса.
+    """
+    def __init__(self, db: Database, max_size: int = WRITE_BEHIND_MAX_SIZE,
+                 max_delay: float = WRITE_BEHIND_MAX_DELAY, on_flush=None):
+        self.db = db
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self._rows = []
+        # Курсоры поллинга записываются вместе с сообщениями, прочитанными до них
+        self._cursors = {}
+        self._condition = Condition()
+        self._flush_lock = Lock()
+        self.flush_count = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+
+    def add(self, messages: list, cursors: dict = None):
+        """Добавляет сообщения (и сдвинутые курсоры каналов) в буфер; при переполнении сбрасывает его сразу"""
+        if not messages and not cursors:
+            return
+        with self._condition:
+            self._rows.extend(messages)
+            self._cursors.update(cursors or {})
+            full = len(self._rows) >= self.max_size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Записывает накопленные сообщения одной транзакцией"""
+        # Сбросы по размеру и по времени не должны обгонять друг друга
+        with self._flush_lock:
+            with self._condition:
+                rows, self._rows = self._rows, []
+                cursors, self._cursors = self._cursors, {}
+            if not rows and not cursors:
+                return 0
+            new_hashes = self.db.store_messages(rows, time.time(), cursors)
+            if new_hashes is None:
+                with self._condition:
+                    self._rows[:0] = rows
+                    # Более новые курсоры, добавленные во время записи, важнее возвращаемых
+                    self._cursors = {**cursors, **self._cursors}
+                self.failed_flushes += 1
+                return 0
+            self.flush_count += 1
+            self.flushed_rows += len(rows)
+        if self.on_flush is not None:
+            self.on_flush(rows, new_hashes)
+        return len(rows)
+
+    def pending_count(self) -> int:
+        """Возвращает количество строк, ожидающих записи"""
+        with self._condition:
+            return len(self._rows)
+
+    def run(self, stop_event: Event):
+        """Периодически сбрасывает буфер, пока не установлен stop_event"""
+        LOGGER.info("Запуск буфера отложенной записи")
+        while not stop_event.wait(self.max_delay):
+            self.flush()
+        self.flush()
+        LOGGER.info(f"Буфер отложенной записи остановлен, сбросов: {self.flush_count}, строк: {self.flushed_rows}")
@@ -0,0 +1,126 @@
+import time
+from datetime import datetime, timedelta
+from threading import Lock
+
+import pytz
+
+from back.database import *
+
+from massage_varibles import *
+from varibles import *
+
+class OnDutyIndex:
+    """Индекс дежурных: пользователи сгруппированы по часовым поясам.
+
+    Для каждого пояса хранится, находится ли он сейчас вне рабочего времени, и момент
+    следующей смены этого состояния. Список упоминаний пересобирается только при смене
+    состояния пояса или изменении часового пояса пользователя.
+    """
+    def __init__(self, db: Database):
+        self.db = db
+        # Пояс -> {'tz', 'members': {id_tg: username_tg}, 'on_duty', 'next_transition'}
+        self._buckets = {}
+        # id_tg -> имя пояса, в котором состоит пользователь
+        self._user_zones = {}
+        self._on_duty = ()
+        self._dirty = True
+        self._lock = Lock()
+        # Статистика индекса
+        self.rebuilds = 0
+        self.transitions = 0
+
+    def load(self):
+        """Строит индекс по таблице users (один проход при запуске)"""
+        users = self.db.get_users_with_time_zone() or []
+        with self._lock:
+            self._buckets.clear()
+            self._user_zones.clear()
+            for id_tg, username_tg, _, time_zone in users:
+                self._add_locked(id_tg, username_tg, time_zone)
+            self._dirty = True
+        LOGGER.info(f"Индекс дежурных построен: пользователей {len(self._user_zones)}, поясов {len(self._buckets)}")
+
+    def update_user(self, id_tg, username_tg: str, time_zone: str):
+        """Переносит пользователя в пояс после изменения его часового пояса"""
+        with self._lock:
+            self._remove_locked(id_tg)
+            self._add_locked(id_tg, username_tg, time_zone)
+            self._dirty = True
+
+    def get_on_duty_usernames(self, now: float = None) -> tuple:
+        """Возвращает Telegram-ники пользователей, у которых сейчас нерабочее время"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for bucket in self._buckets.values():
+                if now >= bucket['next_transition']:
+                    self._refresh_bucket(bucket, now)
+                    self.transitions += 1
+                    self._dirty = True
+            if self._dirty:
+                self._on_duty = tuple(
+                    username_tg
+                    for bucket in self._buckets.values() if bucket['on_duty']
+                    for username_tg in bucket['members'].values()
+                )
+                self._dirty = False
+                self.rebuilds += 1
+            return self._on_duty
+
+    def get_statistics(self):
+        """Возвращает размеры индекса и число пересборок"""
+        with self._lock:
+            return {
+                'users': len(self._user_zones),
+                'zones': len(self._buckets),
+                'on_duty': len(self._on_duty),
+                'rebuilds': self.rebuilds,
+                'transitions': self.transitions
+            }
+
+    @staticmethod
+    def resolve_zone(time_zone: str):
+        """Возвращает часовой пояс по сокращению (Мск/Екб) или имени IANA, иначе None"""
+        if not time_zone:
+            return None
+        name = TIMEZONE_ALIASES.get(time_zone.strip().lower(), time_zone.strip())
+        try:
+            return pytz.timezone(name)
+        except pytz.UnknownTimeZoneError:
+            return None
+
+    def _add_locked(self, id_tg, username_tg: str, time_zone: str):
+        tz = self.resolve_zone(time_zone)
+        if id_tg is None or username_tg is None or tz is None:
+            # Если временная зона не указана или неизвестна, пользователь не упоминается
+            return
+        bucket = self._buckets.get(tz.zone)
+        if bucket is None:
+            bucket = {'tz': tz, 'members': {}, 'on_duty': False, 'next_transition': 0}
+            self._buckets[tz.zone] = bucket
+        bucket['members'][str(id_tg)] = username_tg
+        self._user_zones[str(id_tg)] = tz.zone
+
+    def _remove_locked(self, id_tg):
+        zone = self._user_zones.pop(str(id_tg), None)
+        if zone is None:
+            return
+        bucket = self._buckets[zone]
+        bucket['members'].pop(str(id_tg), None)
+        if not bucket['members']:
+            del self._buckets[zone]
+
+    @staticmethod
+    def _refresh_bucket(bucket: dict, now: float):
+        """Определяет состояние пояса и момент его следующей смены по границам WORK_TIME"""
+        tz = bucket['tz']
+        local_now = datetime.fromtimestamp(now, tz)
+        start, end = WORK_TIME['start'], WORK_TIME['end']
+        bucket['on_duty'] = not (start <= local_now.hour < end)
+        if local_now.hour < start:
+            boundary_day, boundary_hour = local_now.date(), start
+        elif local_now.hour < end:
+            boundary_day, boundary_hour = local_now.date(), end
+        else:
+            boundary_day, boundary_hour = local_now.date() + timedelta(days=1), start
+        boundary = tz.localize(datetime(boundary_day.year, boundary_day.month, boundary_day.day, boundary_hour))
+        bucket['next_transition'] = boundary.timestamp()
@@ -0,0 +1,178 @@
+import time
+from threading import Condition, Event, Lock
+
+from back.database import *
+
+from massage_varibles import *
+from varibles import *
+
+class IngestQueue:
+    """Долговечная очередь сообщений на пересылку в Telegram поверх таблицы ingest_queue.
+
+    Постановка не блокируется при медленной доставке: сообщения лежат в SQLite и переживают
+    перезапуск. Обработчик забирает их пачками (claim) и подтверждает после отправки (ack);
+    неподтвержденное сообщение снова становится доступным через visibility_timeout.
+    Глубина и возраст очереди служат сигналом для замедления поллинга.
+    """
+    def __init__(self, db: Database, visibility_timeout: float = INGEST_VISIBILITY_TIMEOUT,
+                 max_attempts: int = INGEST_MAX_ATTEMPTS, high_watermark: int = INGEST_QUEUE_HIGH_WATERMARK,
+                 max_age: float = INGEST_QUEUE_MAX_AGE):
+        self.db = db
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.high_watermark = high_watermark
+        self.max_age = max_age
+        # Забранные, но еще не подтвержденные сообщения этого процесса
+        self._in_flight = set()
+        self._lock = Lock()
+        # Сигнал об освобождении места: подтверждение или отказ от забранного сообщения
+        self._capacity = Condition(self._lock)
+        self._available = Event()
+        self._state = (0, None)
+        self._state_at = 0
+        # Статистика очереди
+        self.enqueued = 0
+        self.claimed = 0
+        self.acked = 0
+        self.redelivered = 0
+        self.released = 0
+        self.dropped = 0
+        # Один процесс - один потребитель: забранное до перезапуска возвращаем сразу, не дожидаясь таймаута
+        released = self.db.release_queued_messages()
+        if released:
+            LOGGER.info(f"Возвращено в очередь неподтвержденных сообщений: {released}")
+        self._available.set()
+
+    def put_many(self, messages: list) -> bool:
+        """Ставит сообщения в очередь одной транзакцией"""
+        if not messages:
+            return True
+        enqueued = self.db.enqueue_messages(messages, time.time())
+        if enqueued is None:
+            return False
+        self.notify_enqueued(enqueued)
+        return True
+
+    def notify_enqueued(self, count: int):
+        """Сообщает о сообщениях, поставленных в ingest_queue в чужой транзакции, и будит обработчик"""
+        with self._lock:
+            self.enqueued += count
+            self._state_at = 0
+        self._available.set()
+
+    def put(self, message: dict) -> bool:
+        return self.put_many([message])
+
+    def claim(self, limit: int) -> list:
+        """Забирает до limit сообщений, которые сейчас не обрабатываются этим процессом"""
+        if limit <= 0:
+            return []
+        with self._lock:
+            in_flight = list(self._in_flight)
+            # Сбрасываем до чтения, чтобы не потерять постановку, случившуюся во время запроса
+            self._available.clear()
+        rows = self.db.claim_queued_messages(limit, self.visibility_timeout, in_flight)
+        messages, dropped = [], []
+        for message_hash, message_text, channel_id, post_id, user_id, root_id, create_at, timestamp, attempts in rows:
+            if attempts > self.max_attempts:
+                LOGGER.error(INGEST_DROPPED_ERROR.format(message_hash=message_hash, attempts=attempts - 1))
+                dropped.append(message_hash)
+                continue
+            messages.append({
+                'message': message_text,
+                'channel_id': channel_id,
+                'post_id': post_id,
+                'user_id': user_id,
+                'root_id': root_id,
+                'create_at': create_at,
+                'message_hash': message_hash,
+                'timestamp': timestamp,
+                'attempts': attempts
+            })
+        if dropped:
+            self.db.ack_queued_messages(dropped)
+        with self._lock:
+            self._in_flight.update(message['message_hash'] for message in messages)
+            self.claimed += len(messages)
+            self.redelivered += sum(message['attempts'] > 1 for message in messages)
+            self.dropped += len(dropped)
+        # Пачка заполнена целиком - в очереди, скорее всего, остались сообщения
+        if len(rows) == limit:
+            self._available.set()
+        return messages
+
+    def ack(self, message_hash: str):
+        """Подтверждает обработку: сообщение удаляется из очереди"""
+        self.db.ack_queued_messages([message_hash])
+        with self._lock:
+            self._in_flight.discard(message_hash)
+            self.acked += 1
+            self._state_at = 0
+            self._capacity.notify_all()
+
+    def release(self, message_hash: str):
+        """Отказ от обработки: сообщение будет выдано повторно после visibility_timeout"""
+        with self._lock:
+            self._in_flight.discard(message_hash)
+            self.released += 1
+            self._capacity.notify_all()
+
+    def wait(self, timeout: float = INGEST_IDLE_WAIT) -> bool:
+        """Ждет постановки новых сообщений (или истечения таймаута, чтобы подобрать повторные)"""
+        return self._available.wait(timeout)
+
+    def wait_capacity(self, limit: int, timeout: float = INGEST_IDLE_WAIT) -> bool:
+        """Ждет, пока число забранных и неподтвержденных сообщений станет меньше limit"""
+        with self._capacity:
+            return self._capacity.wait_for(lambda: len(self._in_flight) < limit, timeout)
+
+    def in_flight_count(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+    def _get_state(self):
+        """Глубина и время самого старого сообщения; из БД не чаще раза в INGEST_STATE_TTL"""
+        now = time.time()
+        with self._lock:
+            if now - self._state_at < INGEST_STATE_TTL:
+                return self._state
+        state = self.db.get_ingest_queue_state() or (0, None)
+        with self._lock:
+            self._state, self._state_at = state, now
+        return state
+
+    def qsize(self) -> int:
+        """Количество сообщений в очереди, включая забранные и неподтвержденные"""
+        return self._get_state()[0]
+
+    def oldest_age(self) -> float:
+        """Сколько секунд ждет самое старое сообщение очереди"""
+        oldest = self._get_state()[1]
+        return 0.0 if oldest is None else max(time.time() - oldest, 0.0)
+
+    def pressure(self) -> float:
+        """Загрузка очереди: 1.0 и выше означает, что достигнут порог глубины или возраста"""
+        return max(self.qsize() / self.high_watermark, self.oldest_age() / self.max_age)
+
+    def backpressure_delay(self, base_interval: float = POLLING_INTERVAL) -> float:
+        """Дополнительная пауза для источника сообщений, растущая с перегрузкой очереди"""
+        pressure = self.pressure()
+        if pressure < 1:
+            return 0.0
+        return min(base_interval * pressure, INGEST_BACKPRESSURE_MAX_DELAY)
+
+    def get_statistics(self):
+        """Возвращает глубину, возраст и счетчики очереди"""
+        depth, age = self.qsize(), self.oldest_age()
+        with self._lock:
+            return {
+                'depth': depth,
+                'oldest_age': age,
+                'in_flight': len(self._in_flight),
+                'enqueued': self.enqueued,
+                'claimed': self.claimed,
+                'acked': self.acked,
+                'redelivered': self.redelivered,
+                'released': self.released,
+                'dropped': self.dropped
+            }
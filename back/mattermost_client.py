@@ -0,0 +1,82 @@
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from back.logger import *
+from back.metrics import *
+
+from massage_varibles import *
+from varibles import *
+
+class MattermostClient:
+    """Общий HTTP-клиент Mattermost: пул keep-alive соединений, готовая авторизация и замер задержек"""
+    def __init__(self, config, pool_size: int = MATTERMOST_POOL_SIZE):
+        self.base_url = f"{config.mattermost_server_url.rstrip('/')}/api/v4"
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f'Bearer {config.mattermost_bearer_token}',
+            'Content-Type': 'application/json'
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Статистика запросов по эндпоинтам: количество, ошибки, суммарная и максимальная задержка
+        self._stats = {}
+        self._stats_lock = Lock()
+
+    def get_channel_posts(self, channel_id: str, params: dict) -> requests.Response:
+        """Посты канала (since-запрос или страница)"""
+        return self.request('GET', 'channel_posts', f"/channels/{channel_id}/posts", params=params)
+
+    def get_user(self, user_id: str) -> requests.Response:
+        """Профиль пользователя по ID"""
+        return self.request('GET', 'user', f"/users/{user_id}")
+
+    def get_users_by_ids(self, user_ids: list) -> requests.Response:
+        """Профили нескольких пользователей одним запросом"""
+        return self.request('POST', 'users_by_ids', "/users/ids", json=list(user_ids))
+
+    def create_post(self, payload: dict) -> requests.Response:
+        """Создание поста (ответа в тред)"""
+        return self.request('POST', 'create_post', "/posts", json=payload)
+
+    def request(self, method: str, endpoint: str, path: str, **kwargs) -> requests.Response:
+        """Выполняет запрос к API через общий пул соединений с таймаутом эндпоинта"""
+        kwargs.setdefault('timeout', MATTERMOST_ENDPOINT_TIMEOUTS.get(endpoint, MATTERMOSTTIMEOUT))
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self._record(endpoint, time.perf_counter() - started, failed)
+
+    def _record(self, endpoint: str, elapsed: float, failed: bool):
+        MATTERMOST_LATENCY.labels(endpoint).observe(elapsed)
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {'requests': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0})
+            stats['requests'] += 1
+            stats['errors'] += int(failed)
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+        LOGGER.debug(f"Запрос к Mattermost {endpoint}: {elapsed * 1000:.1f} мс")
+
+    def get_statistics(self):
+        """Возвращает статистику задержек запросов по эндпоинтам (в миллисекундах)"""
+        with self._stats_lock:
+            return {
+                endpoint: {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'avg_ms': stats['total_time'] / stats['requests'] * 1000 if stats['requests'] else 0,
+                    'max_ms': stats['max_time'] * 1000
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+    def close(self):
+        """Закрывает соединения пула"""
+        self.session.close()
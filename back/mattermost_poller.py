@@ -1,27 +1,89 @@
-import requests
 import time
-from threading import Event
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Event, Lock
 from datetime import datetime, timedelta, timezone
 
 from back.database import *
 from back.config import *
 from back.message_processor import *
+from back.metrics import *
 
 from massage_varibles import *
 from varibles import *
 
+class ChannelState:
+    """Курсор и статистика поллинга одного канала Mattermost"""
+    def __init__(self, channel_id: str, last_create_at: int, seen_post_ids: set):
+        self.channel_id = channel_id
+        # Курсор поллинга: create_at последнего поста (мс) и ID постов с этим же create_at
+        self.last_create_at = last_create_at
+        self.seen_post_ids = seen_post_ids
+        self.lock = Lock()
+        # Адаптивный интервал: тихие каналы опрашиваются реже
+        self.interval = POLLING_INTERVAL
+        self.next_poll_at = 0
+        # Страница, с которой продолжится прерванная догрузка (0 - догрузка с самых новых постов),
+        # и курсор по самому новому посту, загруженному в начале прерванной догрузки
+        self.backfill_page = 0
+        self.backfill_top = None
+        # Статистика поллингов канала
+        self.poll_count = 0
+        self.successful_polls = 0
+        self.failed_polls = 0
+        self.new_posts = 0
+        self.backfilled_posts = 0
+
+    def schedule_next_poll(self, had_new_posts: bool):
+        """Сбрасывает интервал при активности, иначе удваивает его до CHANNEL_IDLE_MAX_INTERVAL"""
+        if had_new_posts:
+            self.interval = POLLING_INTERVAL
+        else:
+            self.interval = min(self.interval * 2, CHANNEL_IDLE_MAX_INTERVAL)
+        self.next_poll_at = time.time() + self.interval
+
+    def get_statistics(self):
+        """Возвращает статистику поллинга канала"""
+        return {
+            'polls': self.poll_count,
+            'successful_polls': self.successful_polls,
+            'failed_polls': self.failed_polls,
+            'new_posts': self.new_posts,
+            'backfilled_posts': self.backfilled_posts,
+            'interval': self.interval,
+            'last_create_at': self.last_create_at
+        }
+
 class MattermostPoller:
-    """Поллинг Mattermost на новые сообщения"""
+    """Поллинг Mattermost на новые сообщения (несколько каналов параллельно)"""
     def __init__(self, config: Config, processor: MessageProcessor):
         self.config = config
         self.processor = processor
-        self.last_post_time = datetime.now(timezone.utc) - timedelta(minutes=POLLING_INTERVAL)
+        self.channels = {}
+        for channel_id in self.config.channel_ids:
+            cursor = self.processor.db.get_poll_cursor(channel_id)
+            if cursor:
+                last_create_at, seen_post_ids = cursor
+                LOGGER.info(f"Курсор поллинга канала {channel_id} восстановлен: {last_create_at}")
+            else:
+                start_time = datetime.now(timezone.utc) - timedelta(minutes=POLLING_INTERVAL)
+                last_create_at, seen_post_ids = int(start_time.timestamp() * 1000), set()
+            self.channels[channel_id] = ChannelState(channel_id, last_create_at, seen_post_ids)
+        # HTTP-клиент с пулом соединений общий с обработчиком сообщений
+        self.client = self.processor.mattermost
+        # Общий лимит одновременных запросов к Mattermost для всех каналов и догрузки
+        self.request_slots = BoundedSemaphore(MATTERMOST_MAX_CONCURRENCY)
+        self.executor = ThreadPoolExecutor(max_workers=MATTERMOST_MAX_CONCURRENCY, thread_name_prefix="mm-poll")
+        self.page_executor = ThreadPoolExecutor(max_workers=BACKFILL_CONCURRENCY, thread_name_prefix="mm-page")
         # Статистика поллингов
         self.poll_count = 0
         self.successful_polls = 0
         self.failed_polls = 0
+        self.backfilled_posts = 0
+        self.throttled_polls = 0
+        self.stats_lock = Lock()
         self.last_statistics_time = time.time()
-    
+        self.last_statistics_polls = 0
+
     def get_current_statistics(self):
         """Возвращает текущую статистику поллингов"""
         success_rate = (self.successful_polls / self.poll_count) * 100 if self.poll_count > 0 else 0
@@ -29,56 +91,112 @@ class MattermostPoller:
             'total_polls': self.poll_count,
             'successful_polls': self.successful_polls,
             'failed_polls': self.failed_polls,
-            'success_rate': success_rate
+            'success_rate': success_rate,
+            'backfilled_posts': self.backfilled_posts,
+            'throttled_polls': self.throttled_polls,
+            'channels': {
+                channel_id: channel.get_statistics() for channel_id, channel in self.channels.items()
+            }
         }
-    
+
     def poll(self, stop_event: Event):
         """Основной цикл поллинга"""
-        LOGGER.info("Запуск поллинга Mattermost")
-        headers = {
-            'Authorization': f'Bearer {self.config.mattermost_bearer_token}',
-            'Content-Type': 'application/json'
-        }
-        
+        LOGGER.info(f"Запуск поллинга Mattermost, каналов: {len(self.channels)}")
+        # Сначала догоняем посты, написанные, пока бот был остановлен
+        try:
+            self.backfill()
+        except Exception as e:
+            error=str(e)
+            LOGGER.error(MM_POLL_EXCEPTION.format(error=error))
+
         while not stop_event.is_set():
             try:
-                LOGGER.debug("Выполнение запроса к Mattermost API")
-                self.poll_count += 1
-                
-                response = requests.get(
-                    f"{self.config.mattermost_server_url}/api/v4/channels/{self.config.channel_id}/posts",
-                    headers=headers,
-                    params={'since': int(self.last_post_time.timestamp() * 1000)},
-                    timeout=MATTERMOSTTIMEOUT
-                )
-                
-                if response.status_code == HTTP_SUCCESS:
-                    LOGGER.debug("Успешный ответ от Mattermost API")
-                    self.successful_polls += 1
-                    self._process_messages(response.json())
-                else:
-                    error=response.text
-                    LOGGER.error(MM_POLL_ERROR).format(error=error)
-                    self.failed_polls += 1
-                
+                self.poll_once(only_due=True)
+
                 # Вывод статистики каждые 10000 поллингов
-                if self.poll_count % 10000 == 0:
+                if self.poll_count - self.last_statistics_polls >= 10000:
                     self._print_statistics()
-                
-                time.sleep(POLLING_INTERVAL)
+
+                # Очередь на пересылку перегружена - реже забираем новые сообщения
+                delay = self.processor.message_queue.backpressure_delay()
+                if delay:
+                    self.throttled_polls += 1
+                    LOGGER.warning(f"Очередь на пересылку перегружена, поллинг замедлен на {delay:.0f} с")
+                time.sleep(POLLING_INTERVAL + delay)
             except Exception as e:
                 error=str(e)
-                LOGGER.error(MM_POLL_EXCEPTION)
-                self.failed_polls += 1
+                LOGGER.error(MM_POLL_EXCEPTION.format(error=error))
                 time.sleep(ERROR_RETRY_INTERVAL)
-    
+
+    def poll_once(self, only_due: bool = False) -> bool:
+        """Выполняет since-запросы ко всем каналам параллельно и обрабатывает новые сообщения"""
+        now = time.time()
+        channels = [
+            channel for channel in self.channels.values()
+            if not only_due or channel.next_poll_at <= now
+        ]
+        results = list(self.executor.map(self._poll_channel_safe, channels))
+        return all(results)
+
+    def _poll_channel_safe(self, channel: ChannelState) -> bool:
+        try:
+            with POLL_LATENCY.labels(channel.channel_id).time():
+                return self._poll_channel(channel)
+        except Exception as e:
+            error=str(e)
+            LOGGER.error(MM_POLL_EXCEPTION.format(error=error))
+            self._count_poll(channel, False)
+            channel.schedule_next_poll(False)
+            return False
+
+    def _poll_channel(self, channel: ChannelState) -> bool:
+        """Выполняет один since-запрос к каналу"""
+        LOGGER.debug(f"Выполнение запроса к Mattermost API, канал {channel.channel_id}")
+
+        response = self._get_posts(channel.channel_id, {'since': channel.last_create_at})
+
+        if response.status_code == HTTP_SUCCESS:
+            LOGGER.debug("Успешный ответ от Mattermost API")
+            self._count_poll(channel, True)
+            messages = response.json()
+            if len(messages.get('order', [])) >= MATTERMOST_SINCE_LIMIT:
+                # Ответ мог быть обрезан сервером - добираем остальное постранично
+                LOGGER.warning(f"Ответ since содержит {len(messages['order'])} постов, запуск догрузки")
+                new_posts = self._backfill_channel(channel, BACKFILL_TIME_BUDGET)
+            else:
+                new_posts = self._process_messages(messages, channel.channel_id)
+            channel.schedule_next_poll(bool(new_posts))
+            return new_posts is not None
+
+        error=response.text
+        LOGGER.error(MM_POLL_ERROR.format(error=error))
+        self._count_poll(channel, False)
+        channel.schedule_next_poll(False)
+        return False
+
+    def _get_posts(self, channel_id: str, params: dict):
+        """GET-запрос постов канала в пределах общего лимита параллельности"""
+        with self.request_slots:
+            return self.client.get_channel_posts(channel_id, params)
+
+    def _count_poll(self, channel: ChannelState, success: bool):
+        with self.stats_lock:
+            self.poll_count += 1
+            channel.poll_count += 1
+            if success:
+                self.successful_polls += 1
+                channel.successful_polls += 1
+            else:
+                self.failed_polls += 1
+                channel.failed_polls += 1
+
     def _print_statistics(self):
         """Вывод статистики поллингов"""
         success_rate = (self.successful_polls / self.poll_count) * 100 if self.poll_count > 0 else 0
         current_time = time.time()
         elapsed_time = current_time - self.last_statistics_time
-        polls_per_minute = (10000 / elapsed_time) * 60 if elapsed_time > 0 else 0
-        
+        polls_per_minute = ((self.poll_count - self.last_statistics_polls) / elapsed_time) * 60 if elapsed_time > 0 else 0
+
         LOGGER.info(
             "=== СТАТИСТИКА ПОЛЛИНГА ==="
         )
@@ -87,46 +205,184 @@ class MattermostPoller:
         LOGGER.info(f"Неуспешных: {self.failed_polls}")
         LOGGER.info(f"Успешность: {success_rate:.2f}%")
         LOGGER.info(f"Пропускная способность: {polls_per_minute:.2f} поллингов/мин")
+        LOGGER.info(f"Замедлено из-за перегрузки очереди: {self.throttled_polls}")
+        for channel_id, channel in self.channels.items():
+            LOGGER.info(f"Канал {channel_id}: {channel.get_statistics()}")
+        LOGGER.info(f"Запросы к Mattermost: {self.client.get_statistics()}")
+        LOGGER.info(f"Блокировка записи БД: {self.processor.db.get_lock_statistics()}")
+        LOGGER.info(f"Структуры в памяти: {self.processor.get_memory_statistics()}")
         LOGGER.info(
             "==========================="
         )
-        
+
         # Сбрасываем время для следующего интервала
         self.last_statistics_time = current_time
-    
-    def _process_messages(self, messages: dict):
-        """Обрабатывает полученные сообщения"""
-        LOGGER.debug(f"Начало обработки {len(messages.get('order', []))} сообщений")
-        processed_count = 0
-        
-        for post_id in messages.get('order', []):
-            post = messages['posts'][post_id]
-            
-            # Игнорируем сообщения от бота
-            if post['user_id'] == self.config.bot_user_id or '@taxmon-manager-assista' not in post['message']:
-                LOGGER.debug(f"Сообщение {post_id} пропущено (от бота или без упоминания)")
-                continue
-            
-            # Проверяем время создания сообщения
-            create_at = post.get('create_at', 0) / 1000  # Приводим к миллисекундам
-            message_time = datetime.fromtimestamp(create_at, timezone.utc)
-            # Игнорируем сообщения, отправленные до последнего времени обработки
-            if message_time <= self.last_post_time:
-                LOGGER.debug(f"Сообщение {post_id} пропущено (устаревшее)")
+        self.last_statistics_polls = self.poll_count
+
+    def backfill(self, time_budget: float = BACKFILL_TIME_BUDGET) -> int:
+        """Догружает посты всех каналов, созданные после их курсоров"""
+        started = time.time()
+        new_posts = 0
+        for channel in self.channels.values():
+            remaining = time_budget - (time.time() - started)
+            if remaining <= 0:
+                LOGGER.warning(f"Догрузка канала {channel.channel_id} пропущена: исчерпан бюджет времени")
                 continue
-            
-            # Обрабатываем сообщение
-            LOGGER.info(f"Обработка нового сообщения {post_id} от пользователя {post['user_id']}")
-            self.processor.process_message(
-                post['message'],
-                self.config.channel_id,
-                post_id,
-                post['user_id']
+            new_posts += self._backfill_channel(channel, remaining)
+        return new_posts
+
+    def _backfill_channel(self, channel: ChannelState, time_budget: float) -> int:
+        """Постранично догружает посты канала с ограничением параллельности и времени.
+
+        Курсор сдвигается, только когда догрузка дошла до него. Прерванная догрузка отправляет
+        загруженные посты, оставляет курсор на месте и в следующий раз продолжает с той же глубины:
+        новые посты сдвигают старые на дальние страницы, поэтому пропуска не будет. Когда продолжение
+        доходит до курсора, все посты до самого нового из первой части уже записаны, и курсор
+        переносится сразу к нему.
+        """
+        started = time.time()
+        posts = {}
+        first_page = page = channel.backfill_page
+        last_page = first_page + BACKFILL_MAX_PAGES
+        reached_cursor = failed = False
+        LOGGER.info(f"Догрузка постов канала {channel.channel_id} начиная с {channel.last_create_at}, страница {page}")
+
+        while not reached_cursor and not failed and page < last_page:
+            if time.time() - started > time_budget:
+                LOGGER.warning(f"Догрузка прервана по времени, загружено страниц: {page}")
+                break
+            # Страницы идут от новых постов к старым; грузим окно страниц параллельно
+            pages = range(page, min(page + BACKFILL_CONCURRENCY, last_page))
+            for result in self.page_executor.map(lambda number: self._fetch_page(channel, number), pages):
+                if result is None or failed:
+                    # Страница не загрузилась: дальше нее посты не проверены, курсор сдвигать нельзя
+                    failed = True
+                    continue
+                order = result.get('order', [])
+                posts.update(result.get('posts', {}))
+                if len(order) < BACKFILL_PAGE_SIZE or any(
+                    result['posts'][post_id].get('create_at', 0) < channel.last_create_at for post_id in order
+                ):
+                    reached_cursor = True
+            page += len(pages)
+        if failed:
+            reached_cursor = False
+            page = first_page
+
+        if page >= last_page and not reached_cursor:
+            LOGGER.warning(f"Догрузка остановлена на лимите страниц: {BACKFILL_MAX_PAGES}")
+
+        new_posts = self._process_messages(
+            {'order': list(posts), 'posts': posts}, channel.channel_id, advance_cursor=reached_cursor
+        )
+        if new_posts is None:
+            return 0
+        if reached_cursor:
+            if channel.backfill_top is not None and not self._advance_cursor(channel, *channel.backfill_top):
+                return new_posts
+            channel.backfill_page, channel.backfill_top = 0, None
+        else:
+            if first_page == 0 and posts:
+                top = max(post.get('create_at', 0) for post in posts.values())
+                channel.backfill_top = (
+                    top, {post_id for post_id, post in posts.items() if post.get('create_at', 0) == top}
+                )
+            LOGGER.warning(
+                f"Догрузка канала {channel.channel_id} не дошла до курсора, продолжится со страницы {page}"
             )
-            processed_count += 1
-            
-            # Обновляем время последнего сообщения
-            self.last_post_time = message_time
-        
-        if processed_count > 0:
-            LOGGER.info(f"Обработано {processed_count} новых сообщений")
+            channel.backfill_page = page
+        channel.backfilled_posts += new_posts
+        with self.stats_lock:
+            self.backfilled_posts += new_posts
+        LOGGER.info(f"Догрузка завершена: страниц {page - first_page}, новых постов {new_posts} за {time.time() - started:.2f} с")
+        return new_posts
+
+    def _advance_cursor(self, channel: ChannelState, last_create_at: int, seen_post_ids: set) -> bool:
+        """Сдвигает курсор канала вперед (без новых постов), сначала в БД, затем в памяти"""
+        with channel.lock:
+            if last_create_at < channel.last_create_at:
+                return True
+            if last_create_at == channel.last_create_at:
+                seen_post_ids = seen_post_ids | channel.seen_post_ids
+            if self.processor.process_messages([], {channel.channel_id: (last_create_at, seen_post_ids)}) is None:
+                return False
+            channel.last_create_at, channel.seen_post_ids = last_create_at, seen_post_ids
+            return True
+
+    def _fetch_page(self, channel: ChannelState, page: int) -> dict:
+        """Загружает одну страницу постов канала (новые посты первыми); None при ошибке"""
+        try:
+            response = self._get_posts(channel.channel_id, {'page': page, 'per_page': BACKFILL_PAGE_SIZE})
+        except Exception as e:
+            error=str(e)
+            LOGGER.error(MM_POLL_EXCEPTION.format(error=error))
+            return None
+        if response.status_code != HTTP_SUCCESS:
+            error=response.text
+            LOGGER.error(MM_POLL_ERROR.format(error=error))
+            return None
+        return response.json()
+
+    def _process_messages(self, messages: dict, channel_id: str, advance_cursor: bool = True):
+        """Обрабатывает полученные сообщения канала в порядке создания и сдвигает курсор.
+
+        Курсор сдвигается в памяти и в БД только после того, как пачка записана (в той же транзакции).
+        Возвращает число новых постов или None, если записать пачку не удалось.
+        """
+        LOGGER.debug(f"Начало обработки {len(messages.get('order', []))} сообщений")
+        channel = self.channels[channel_id]
+        batch = []
+        new_posts = 0
+        posts = sorted(
+            (messages['posts'][post_id] for post_id in messages.get('order', [])),
+            key=lambda post: (post.get('create_at', 0), post['id'])
+        )
+
+        with channel.lock:
+            # Новый курсор собираем отдельно и переносим в channel только после записи пачки
+            last_create_at, seen_post_ids = channel.last_create_at, set(channel.seen_post_ids)
+            for post in posts:
+                post_id = post['id']
+                create_at = post.get('create_at', 0)
+                # Игнорируем посты до курсора и уже виденные посты с тем же create_at
+                if create_at < last_create_at or (create_at == last_create_at and post_id in seen_post_ids):
+                    LOGGER.debug(f"Сообщение {post_id} пропущено (устаревшее)")
+                    continue
+
+                # Сдвигаем курсор
+                if create_at > last_create_at:
+                    last_create_at, seen_post_ids = create_at, set()
+                seen_post_ids.add(post_id)
+                new_posts += 1
+
+                # Игнорируем сообщения от бота
+                if post['user_id'] == self.config.bot_user_id or '@taxmon-manager-assista' not in post['message']:
+                    LOGGER.debug(f"Сообщение {post_id} пропущено (от бота или без упоминания)")
+                    continue
+
+                # Собираем сообщение в пачку для записи одной транзакцией
+                LOGGER.info(f"Обработка нового сообщения {post_id} от пользователя {post['user_id']}")
+                batch.append({
+                    'message': post['message'],
+                    'channel_id': channel_id,
+                    'post_id': post_id,
+                    'user_id': post['user_id'],
+                    # Сообщения одного треда обрабатываются по порядку одним обработчиком
+                    'root_id': post.get('root_id') or post_id,
+                    'create_at': create_at
+                })
+
+            if not new_posts:
+                return 0
+            cursors = {channel_id: (last_create_at, seen_post_ids)} if advance_cursor else None
+            new_hashes = self.processor.process_messages(batch, cursors)
+            if new_hashes is None:
+                # Курсор остается прежним: посты будут перечитаны следующим запросом
+                LOGGER.error(MM_BATCH_NOT_SAVED_ERROR.format(channel_id=channel_id, count=len(batch)))
+                return None
+            if batch:
+                LOGGER.info(f"Обработано {len(batch)} сообщений, новых: {len(new_hashes)}")
+            if advance_cursor:
+                channel.last_create_at, channel.seen_post_ids = last_create_at, seen_post_ids
+            channel.new_posts += new_posts
+        return new_posts
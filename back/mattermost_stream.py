@@ -0,0 +1,148 @@
+import asyncio
+import json
+from threading import Event
+
+import aiohttp
+
+from back.config import *
+from back.mattermost_poller import *
+
+from massage_varibles import *
+from varibles import *
+
+class MattermostEventStream:
+    """Получение новых сообщений Mattermost через WebSocket-события posted"""
+    def __init__(self, config: Config, poller: MattermostPoller, ws_url: str = None):
+        self.config = config
+        self.poller = poller
+        self.ws_url = ws_url or self._build_ws_url(config.mattermost_server_url)
+        # Состояние для возобновления соединения без потери событий
+        self.connection_id = None
+        self.sequence = 0
+        # Статистика потока событий
+        self.connects = 0
+        self.resumed_connects = 0
+        self.failed_connects = 0
+        self.events_received = 0
+        self.posts_received = 0
+        self.gap_fills = 0
+
+    @staticmethod
+    def _build_ws_url(server_url: str) -> str:
+        """Формирует адрес WebSocket API по адресу сервера Mattermost"""
+        if server_url.startswith('https://'):
+            server_url = 'wss://' + server_url[len('https://'):]
+        elif server_url.startswith('http://'):
+            server_url = 'ws://' + server_url[len('http://'):]
+        return f"{server_url.rstrip('/')}/api/v4/websocket"
+
+    def get_current_statistics(self):
+        """Возвращает текущую статистику потока событий"""
+        return {
+            'connects': self.connects,
+            'resumed_connects': self.resumed_connects,
+            'failed_connects': self.failed_connects,
+            'events_received': self.events_received,
+            'posts_received': self.posts_received,
+            'gap_fills': self.gap_fills,
+            'sequence': self.sequence
+        }
+
+    def run(self, stop_event: Event):
+        """Основной цикл получения событий (запускается в отдельном потоке)"""
+        LOGGER.info(f"Запуск получения событий Mattermost через WebSocket: {self.ws_url}")
+        asyncio.run(self._run(stop_event))
+        LOGGER.info(f"Получение событий Mattermost остановлено: {self.get_current_statistics()}")
+
+    async def _run(self, stop_event: Event):
+        # Сначала догоняем посты, написанные, пока бот был остановлен
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.poller.backfill)
+        except Exception as e:
+            LOGGER.error(MM_POLL_EXCEPTION.format(error=str(e)))
+        backoff = WS_RECONNECT_MIN
+        while not stop_event.is_set():
+            try:
+                await self._listen(stop_event)
+                backoff = WS_RECONNECT_MIN
+            except Exception as e:
+                self.failed_connects += 1
+                LOGGER.error(MM_WEBSOCKET_ERROR.format(error=str(e)))
+                # Пока соединения нет, не теряем сообщения: подстраховываемся since-запросом
+                await self._fill_gap()
+            if stop_event.is_set():
+                break
+            LOGGER.info(f"Переподключение к WebSocket через {backoff} с")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, WS_RECONNECT_MAX)
+
+    async def _listen(self, stop_event: Event):
+        """Подключается к WebSocket и обрабатывает события до разрыва соединения"""
+        params = {}
+        if self.connection_id:
+            # Просим сервер дослать события, пропущенные во время разрыва
+            params = {'connection_id': self.connection_id, 'sequence_number': self.sequence + 1}
+        headers = {'Authorization': f'Bearer {self.config.mattermost_bearer_token}'}
+
+        async with aiohttp.ClientSession(headers=headers) as session:
+            async with session.ws_connect(self.ws_url, params=params, heartbeat=WS_HEARTBEAT) as ws:
+                self.connects += 1
+                LOGGER.info("Подключено к WebSocket Mattermost")
+                await ws.send_json({
+                    'seq': 1,
+                    'action': 'authentication_challenge',
+                    'data': {'token': self.config.mattermost_bearer_token}
+                })
+
+                while not stop_event.is_set():
+                    try:
+                        message = await ws.receive(timeout=WS_RECEIVE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        continue
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        await self._handle_event(json.loads(message.data))
+                    elif message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED,
+                                          aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.ERROR):
+                        LOGGER.warning(f"Соединение WebSocket закрыто: {message.type}")
+                        break
+
+    async def _handle_event(self, event: dict):
+        """Обрабатывает одно событие WebSocket"""
+        if 'event' not in event:
+            # Ответ на наши запросы (например, authentication_challenge)
+            return
+        self.events_received += 1
+        if 'seq' in event:
+            self.sequence = event['seq']
+
+        if event['event'] == 'hello':
+            connection_id = event.get('data', {}).get('connection_id')
+            if connection_id and connection_id == self.connection_id:
+                self.resumed_connects += 1
+                LOGGER.info(f"Соединение WebSocket возобновлено: {connection_id}")
+            else:
+                # Новое соединение: события за время разрыва потеряны, добираем их since-запросом
+                self.connection_id = connection_id
+                await self._fill_gap()
+            return
+
+        if event['event'] != 'posted':
+            return
+        data = event.get('data', {})
+        channel_id = data.get('channel_id', event.get('broadcast', {}).get('channel_id'))
+        if channel_id not in self.poller.channels:
+            return
+        post = json.loads(data['post'])
+        self.posts_received += 1
+        LOGGER.debug(f"Получено событие posted: {post['id']}")
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.poller._process_messages, {'order': [post['id']], 'posts': {post['id']: post}}, channel_id
+        )
+
+    async def _fill_gap(self):
+        """Добирает пропущенные сообщения обычным since-запросом поллера"""
+        self.gap_fills += 1
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.poller.poll_once)
+        except Exception as e:
+            LOGGER.error(MM_POLL_EXCEPTION.format(error=str(e)))
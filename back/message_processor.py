@@ -1,13 +1,23 @@
-import requests
 import time
 from threading import Thread, Event, Lock
-from datetime import datetime
+from datetime import datetime, timedelta
 import telebot
 from queue import Queue
 from hashlib import md5
 import re
 
 from back.database import *
+from back.scheduler import *
+from back.pending_registry import *
+from back.cache import *
+from back.mattermost_client import *
+from back.user_cache import *
+from back.telegram_sender import *
+from back.duty_index import *
+from back.metrics import *
+from back.tracing import *
+from back.ingest_queue import *
+from back.assignment import *
 
 from back.config import *
 
@@ -20,14 +30,128 @@ class MessageProcessor:
         self.config = config
         self.db = db
         self.telegram_bot = telebot.TeleBot(config.telegram_bot_token)
-        self.message_queue = Queue(maxsize=MESSAGE_QUEUE_MAXSIZE)
-        self.processed_messages = set()
-        self.pending_responses = {}
+        # Все исходящие вызовы Telegram идут через очередь с ограничением скорости
+        self.telegram_sender = TelegramSender(self.telegram_bot)
+        self.mattermost = MattermostClient(config)
+        self.user_cache = UserProfileCache(db, self.mattermost)
+        # Очередь на пересылку хранится в БД: постановка не ждет доставки и переживает перезапуск
+        self.message_queue = IngestQueue(db)
+        # Индекс дедупликации по (channel_id, post_id)
+        self.processed_messages = LRUCache(PROCESSED_CACHE_SIZE, PROCESSED_CACHE_TTL)
+        self.pending_responses = PendingTaskRegistry()
         self.lock = Lock()
+        self.scheduler = TimerScheduler()
+        self.pending_fallback_loads = 0
+        self.write_behind = WriteBehindBuffer(db, on_flush=self._on_messages_stored) if WRITE_BEHIND_ENABLED else None
+        self.worker_stats = []
+        self.duty_index = OnDutyIndex(db)
+        self.tracer = MessageTracer(db)
+        self.assignment = AssignmentEngine(db)
+        self.duty_index.load()
+        self.assignment.load()
+        self._preload_processed()
         
         LOGGER.info("Инициализация MessageProcessor")
         # Инициализация Telegram бота
         self._setup_telegram_handlers()
+        # Восстанавливаем незакрытые задачи после перезапуска
+        self.restore_pending_tasks()
+        self.scheduler.schedule(PENDING_SWEEP_INTERVAL, self._sweep_pending, key='sweep')
+        self.scheduler.schedule(STAGE_FLUSH_INTERVAL, self._flush_stages, key='stage_flush')
+        # Отложенные до перезапуска сообщения выпускаются в свое время
+        next_release = self.db.get_next_deferred_release()
+        if next_release is not None:
+            self._schedule_deferred_flush(next_release)
+
+    def restore_pending_tasks(self):
+        """Загружает ожидающие задачи из БД и заново взводит их таймеры"""
+        started = time.time()
+        rows = self.db.get_pending_tasks()
+        armed_hashes = set()
+        timers_count = 0
+        
+        for row in rows:
+            telegram_message_id, message_data = self._pending_row_to_data(row)
+            message_hash = message_data['message_hash']
+            is_actual = message_data['is_actual']
+            reminder_number, next_reminder_at, escalate_at, is_responded = row[9:13]
+            self.pending_responses.add(telegram_message_id, message_data)
+            
+            # Таймеры нужны только неотвеченным задачам, по одному набору на задачу
+            if is_responded or message_hash in armed_hashes:
+                continue
+            if is_actual and next_reminder_at is not None:
+                self._arm_reminder(message_data, reminder_number, next_reminder_at)
+                armed_hashes.add(message_hash)
+                timers_count += 1
+            if escalate_at is not None:
+                self._arm_escalation(message_data, escalate_at)
+                armed_hashes.add(message_hash)
+                timers_count += 1
+        
+        LOGGER.info(
+            f"Восстановлено ожидающих задач: {len(rows)}, таймеров: {timers_count} "
+            f"за {time.time() - started:.3f} с"
+        )
+
+    def _pending_row_to_data(self, row):
+        """Преобразует строку pending_tasks в запись реестра"""
+        chat_id, telegram_message_id, message_hash, message_text, channel_id, post_id, user_id, timestamp, is_actual = row[:9]
+        return telegram_message_id, {
+            'message': message_text,
+            'channel_id': channel_id,
+            'post_id': post_id,
+            'user_id': user_id,
+            'message_hash': message_hash,
+            'timestamp': timestamp,
+            'chat_id': chat_id,
+            'is_actual': bool(is_actual)
+        }
+
+    def _get_pending_task(self, chat_id, telegram_message_id: int):
+        """Ищет задачу в реестре, при промахе - в базе данных"""
+        message_data = self.pending_responses.get(telegram_message_id)
+        if message_data is not None:
+            return message_data
+        row = self.db.get_pending_task(chat_id, telegram_message_id)
+        if row is None:
+            return None
+        # Задача была вытеснена из памяти - возвращаем ее в реестр
+        self.pending_fallback_loads += 1
+        telegram_message_id, message_data = self._pending_row_to_data(row)
+        LOGGER.debug(f"Задача {message_data['message_hash']} загружена из БД после вытеснения")
+        return self.pending_responses.add(telegram_message_id, message_data)
+
+    def _sweep_pending(self):
+        """Периодически вытесняет закрытые и устаревшие задачи из памяти и БД"""
+        try:
+            self.pending_responses.evict_expired()
+            self.processed_messages.purge_expired()
+            self.db.delete_pending_tasks_before(time.time() - PENDING_TASK_TTL)
+        finally:
+            self.scheduler.schedule(PENDING_SWEEP_INTERVAL, self._sweep_pending, key='sweep')
+
+    def _flush_stages(self):
+        """Периодически записывает накопленные отметки стадий сообщений"""
+        try:
+            self.tracer.flush()
+        finally:
+            self.scheduler.schedule(STAGE_FLUSH_INTERVAL, self._flush_stages, key='stage_flush')
+
+    def get_memory_statistics(self):
+        """Возвращает размеры и счетчики вытеснений структур в памяти"""
+        return {
+            'processed_messages': self.processed_messages.get_statistics(),
+            'pending_responses': self.pending_responses.get_statistics(),
+            'pending_fallback_loads': self.pending_fallback_loads,
+            'user_cache': self.user_cache.get_statistics(),
+            'telegram_sender': self.telegram_sender.get_statistics(),
+            'processing': self.get_processing_statistics(),
+            'duty_index': self.duty_index.get_statistics(),
+            'assignment': self.assignment.get_statistics(),
+            'database': self.db.get_lock_statistics(),
+            'timers': self.scheduler.get_statistics()
+        }
     
     def _setup_telegram_handlers(self):
         """Настройка обработчиков команд Telegram"""
@@ -37,9 +161,12 @@ class MessageProcessor:
         def handle_message(message):
             LOGGER.debug(f"Получено сообщение в Telegram: {message.text[:50]}... от пользователя {message.from_user.id}")
             
-            if message.reply_to_message and message.reply_to_message.message_id in self.pending_responses:
+            original_msg = None
+            if message.reply_to_message:
+                original_msg = self._get_pending_task(message.reply_to_message.chat.id, message.reply_to_message.message_id)
+            
+            if original_msg:
                 LOGGER.info(f"Обработка ответа на сообщение {message.reply_to_message.message_id}")
-                original_msg = self.pending_responses[message.reply_to_message.message_id]
                 self._send_to_mattermost(
                     original_msg['channel_id'],
                     f"Ответ от внедренца: {message.text}",
@@ -51,10 +178,17 @@ class MessageProcessor:
                     original_msg['message_hash'],
                     message.text,
                     str(message.from_user.id),
-                    time.time()
+                    time.time(),
+                    record_response=True
                 )
+                # Ответ закрывает задачу - нагрузка исполнителя уменьшается
+                for assigned_to in self.db.close_message_tasks(original_msg['message_hash']):
+                    self.assignment.refresh(assigned_to)
+                # На задачу ответили - ее можно вытеснить из памяти после closed_ttl
+                self.pending_responses.close(message.reply_to_message.message_id)
+                self.tracer.mark(original_msg['message_hash'], 'answered')
                 
-                self.telegram_bot.send_message(
+                self.telegram_sender.send_message(
                     message.chat.id,
                     RESPONSE_SENT_CONFIRMATION,
                     reply_to_message_id=message.message_id
@@ -71,7 +205,7 @@ class MessageProcessor:
                             callback_data=CALLBACK_INTRODUCE
                         ))
                         
-                    self.telegram_bot.send_message(
+                    self.telegram_sender.send_message(
                         message.chat.id,
                         WELCOME_MESSAGE,
                         parse_mode='HTML',
@@ -82,36 +216,43 @@ class MessageProcessor:
                 elif message.text==BOT_COMMAND_HELP or message.text==(BOT_COMMAND_HELP in message.text and '@taxmon-manager-assistant'in message.text):
                     LOGGER.info(f"Обработка команды /help от пользователя {message.from_user.id}")
                     help_text = HELP_MESSAGE
-                    self.telegram_bot.reply_to(message, help_text)
+                    self.telegram_sender.reply_to(message, help_text)
                     return
 
                 elif message.text == BOT_COMMAND_FAIR or (BOT_COMMAND_FAIR in message.text and '@taxmon-manager-assistant'in message.text):
                     LOGGER.info(f"Обработка команды /fair от пользователя {message.from_user.id}")
-                    random_user = self._get_random_user_by_position('Специалист по интеграции')
-                    if random_user:
-                        first_name=random_user[3]
-                        last_name=random_user[4]
-                        email=random_user[6]
-                        telegram=random_user[8]
+                    specialist = self.assignment.pick()
+                    if specialist:
                         user_info = SPECIALIST_INFO_TEMPLATE.format(
-                            first_name=first_name,
-                            last_name=last_name,
-                            email=email,
-                            telegram=telegram,
+                            first_name=specialist['first_name'],
+                            last_name=specialist['last_name'],
+                            email=specialist['email'],
+                            telegram=specialist['username_tg'],
+                            open_tasks=specialist['open_tasks']
                         )
                         # Отправка гифки
                         gif_url = "https://i.pinimg.com/originals/7d/a9/f0/7da9f09c8b61866d87a5c0db8e4957db.gif"
-                        self.telegram_bot.send_animation(message.chat.id, gif_url)
-                        self.telegram_bot.send_message(message.chat.id, user_info)
+                        self.telegram_sender.send_animation(message.chat.id, gif_url)
+                        self.telegram_sender.send_message(message.chat.id, user_info)
                         LOGGER.info(f"Информация о специалисте отправлена пользователю {message.from_user.id}")
                     else:
-                        self.telegram_bot.send_message(message.chat.id, NO_SPECIALISTS_ERROR)
+                        self.telegram_sender.send_message(message.chat.id, NO_SPECIALISTS_ERROR)
                         LOGGER.warning("Не найдены специалисты по интеграции для команды /fair")
                 
                 elif message.text==BOT_COMMAND_INFO or (BOT_COMMAND_INFO in message.text and '@taxmon-manager-assistant'in message.text):
                     LOGGER.info(f"Обработка команды /info от пользователя {message.from_user.id}")
                     info_text = INFO_MESSAGE
-                    self.telegram_bot.reply_to(message, info_text, parse_mode='Markdown')
+                    self.telegram_sender.reply_to(message, info_text, parse_mode='Markdown')
+                    return
+
+                elif message.text.split()[0].split('@')[0] == BOT_COMMAND_LATENCY:
+                    LOGGER.info(f"Обработка команды /latency от пользователя {message.from_user.id}")
+                    self.telegram_sender.reply_to(message, self._format_latency_report(message))
+                    return
+
+                elif message.text.split()[0].split('@')[0] == BOT_COMMAND_STATS:
+                    LOGGER.info(f"Обработка команды /stats от пользователя {message.from_user.id}")
+                    self.telegram_sender.reply_to(message, self._format_stats_report(message))
                     return
 
             # Обработчик текстовых сообщений
@@ -127,7 +268,7 @@ class MessageProcessor:
                     # Проверяем валидность email
                     if not _is_valid_email(email):
                         LOGGER.warning(f"Невалидный email от пользователя {message.from_user.id}: {email}")
-                        self.telegram_bot.send_message(message.chat.id, EMAIL_VALIDATION_ERROR)
+                        self.telegram_sender.send_message(message.chat.id, EMAIL_VALIDATION_ERROR)
                         return
                     
                     user_id = message.from_user.id
@@ -154,14 +295,18 @@ class MessageProcessor:
                             username_tg = username,
                             time_zone = time_zone
                         ):
-                            self.telegram_bot.send_message(
+                            self.user_cache.invalidate(existing_user_id)
+                            self.telegram_sender.send_message(
                                 message.chat.id,
                                 EMAIL_UPDATE_SUCCESS.format(email=email)
                             )
-                            self.telegram_bot.send_message(message.chat.id, TIMEZONE_PROMPT)
+                            self.telegram_sender.send_message(message.chat.id, TIMEZONE_PROMPT)
+                            self.duty_index.update_user(user_id, username, time_zone)
+                            # У специалиста появился Telegram ID - его задачи начинают учитываться в нагрузке
+                            self.assignment.load()
                             LOGGER.info(f"Email пользователя обновлен: {email}")
                         else:
-                            self.telegram_bot.send_message(message.chat.id, EMAIL_UPDATE_ERROR)
+                            self.telegram_sender.send_message(message.chat.id, EMAIL_UPDATE_ERROR)
                             LOGGER.error(f"Ошибка обновления email: {email}")
                     else:
                         LOGGER.info(f"Создание нового пользователя с email: {email}")
@@ -173,13 +318,14 @@ class MessageProcessor:
                             last_name=last_name,
                             email=email
                         ):
-                            self.telegram_bot.send_message(
+                            self.user_cache.invalidate(str(user_id))
+                            self.telegram_sender.send_message(
                                 message.chat.id,
                                 EMAIL_SAVE_SUCCESS.format(email=email)
                             )
                             LOGGER.info(f"Email сохранен для нового пользователя: {email}")
                         else:
-                            self.telegram_bot.send_message(message.chat.id, EMAIL_SAVE_ERROR)
+                            self.telegram_sender.send_message(message.chat.id, EMAIL_SAVE_ERROR)
                             LOGGER.error(f"Ошибка сохранения email: {email}")
                 elif message.reply_to_message.from_user.username == 'taxmon-manager-assistant' and message.reply_to_message.html_text==TIMEZONE_PROMPT:
                     LOGGER.info(f"Обработка часового пояса от пользователя {message.from_user.id}")
@@ -202,16 +348,18 @@ class MessageProcessor:
                             username_tg = existing_user[8],
                             time_zone = time_zone
                         ):
-                            self.telegram_bot.send_message(
+                            self.user_cache.invalidate(existing_user[1])
+                            self.telegram_sender.send_message(
                                 message.chat.id,
                                 TIMEZONE_SAVE_SUCCESS.format(time_zone=time_zone)
                             )
+                            self.duty_index.update_user(existing_user[7], existing_user[8], time_zone)
                             LOGGER.info(f"Часовой пояс сохранен для пользователя {user_id}: {time_zone}")
                         else:
-                            self.telegram_bot.send_message(message.chat.id, TIMEZONE_SAVE_ERROR)
+                            self.telegram_sender.send_message(message.chat.id, TIMEZONE_SAVE_ERROR)
                             LOGGER.error(f"Ошибка сохранения часового пояса для пользователя {user_id}")
                     else:
-                        self.telegram_bot.send_message(message.chat.id, USER_NOT_FOUND_ERROR)
+                        self.telegram_sender.send_message(message.chat.id, USER_NOT_FOUND_ERROR)
                         LOGGER.warning(f"Пользователь не найден при сохранении часового пояса: {user_id}")
 
 
@@ -219,39 +367,43 @@ class MessageProcessor:
         @self.telegram_bot.callback_query_handler(func=lambda call: True)
         def handle_callback_query(call):
             LOGGER.info(f"Обработка callback: {call.data} от пользователя {call.from_user.id}")
-            message_data = self.pending_responses.get(call.message.message_id)
+            message_data = None
+            if call.data == CALLBACK_TAKE_WORK:
+                message_data = self._get_pending_task(call.message.chat.id, call.message.message_id)
             if call.data == "introduce":
                 LOGGER.info(f"Пользователь {call.from_user.id} начал процесс знакомства")
-                self.telegram_bot.send_message(call.message.chat.id, EMAIL_PROMPT)
+                self.telegram_sender.send_message(call.message.chat.id, EMAIL_PROMPT)
             elif message_data and call.data == "take_work":
                 user_id = call.from_user.id
                 
-                # Определяем текущее состояние
-                current_state = message_data.get('is_actual', True)
+                # Определяем текущее состояние и атомарно переключаем его
+                current_state = self.pending_responses.toggle(call.message.message_id, 'is_actual')
                 
                 if current_state:
                     LOGGER.info(f"Пользователь {call.from_user.id} взял задачу в работу")
                     # Кнопка нажата впервые - ОСТАНАВЛИВАЕМ напоминания
                     user_name = f'{call.from_user.first_name} {call.from_user.last_name}'
                     button_text = TASK_TAKEN_CONFIRMATION.format(user_name=user_name)
-                    message_data['is_actual'] = False  # Напоминания ВЫКЛЮЧЕНЫ
+                    # Напоминания ВЫКЛЮЧЕНЫ (is_actual = False)
                     
                     # ОТМЕЧАЕМ В БД, ЧТО ОТВЕТ ПРОИЗОШЕЛ
                     self.db.update_message_response(
                         message_data['message_hash'],
-                        f"Задача взята в работу пользователем {user_name} (TG ID: {user_id})",
+                        TASK_TAKEN_RESPONSE_TEMPLATE.format(user_name=user_name, user_id=user_id),
                         str(user_id),
-                        time.time()
+                        time.time(),
+                        is_actual=False
                     )
                     
                     # Создаем задачу в базе данных
-                    db_message = self.db.get_message_by_hash(message_data['message_hash'])
-                    if db_message:
-                        self.db.create_task(db_message[0], str(user_id))
+                    message_state = self.db.get_message_state(message_data['message_hash'])
+                    if message_state:
+                        self.db.create_task(message_state[0], str(user_id))
+                        self.assignment.refresh(user_id)
                     
                     # Останавливаем напоминания
-                    if 'stop_reminder' in message_data:
-                        message_data['stop_reminder'].set()
+                    self._stop_reminders(message_data['message_hash'])
+                    self.tracer.mark(message_data['message_hash'], 'taken')
                     user_profile = self.db.get_user_info_tg(user_id)
                     if user_profile:
                         self._send_to_mattermost(
@@ -271,25 +423,20 @@ class MessageProcessor:
                     # Кнопка нажата повторно - ВКЛЮЧАЕМ напоминания снова
                     button_text = BUTTON_TAKE_WORK
                     
+                    # Напоминания ВКЛЮЧЕНЫ (is_actual = True)
+                    self.db.reset_message_response(message_data['message_hash'])
+                    # Возвращенная задача больше не считается в нагрузке взявшего ее исполнителя
+                    for assigned_to in self.db.close_message_tasks(message_data['message_hash'], TASK_STATUS_CANCELLED):
+                        self.assignment.refresh(assigned_to)
+
                     # Запускаем новые напоминания
-                    message_data['stop_reminder'] = Event()
-                    message_data['reminder_thread'] = Thread(
-                        target=self._send_periodic_reminders, 
-                        args=(message_data, message_data['stop_reminder']),
-                        daemon=True
-                    )
-                    message_data['reminder_thread'].start()
+                    self._start_reminders(message_data)
 
                     self._send_to_mattermost(
                         message_data['channel_id'],
                         f"Задача ищет нового исполнителя",
                         message_data['post_id']
                     )
-
-                    if 'stop_reminder' in message_data:
-                        message_data['stop_reminder'].set()  
-                    
-                    message_data['is_actual'] = True  # Напоминания ВКЛЮЧЕНЫ
                 
                 # Обновляем сообщение с новой кнопкой
                 self._update_message_with_new_button(call.message, message_data, button_text)
@@ -298,36 +445,117 @@ class MessageProcessor:
                 self.telegram_bot.answer_callback_query(call.id)
                 LOGGER.info(f"Callback обработан: {call.data}")
 
-    def _send_periodic_reminders(self, message_data: dict, stop_event: Event):
-        """Отправляет периодические напоминания об активной задаче"""
-        LOGGER.info(f"Запуск напоминаний для задачи {message_data['message_hash']}")
-        reminder_count = 0
+    def _format_latency_report(self, message) -> str:
+        """Формирует отчет /latency [часы]: перцентили задержек по стадиям (только чат руководителя)"""
+        if str(message.chat.id) != str(self.config.manager_chat_id):
+            return ADMIN_ONLY_ERROR
+        arguments = message.text.split()[1:]
+        hours = int(arguments[0]) if arguments and arguments[0].isdigit() else LATENCY_REPORT_DEFAULT_HOURS
+        report = self.tracer.get_latency_report(hours * 3600)
+        if not report:
+            return LATENCY_REPORT_EMPTY.format(hours=hours)
+        lines = [LATENCY_REPORT_HEADER.format(hours=hours)]
+        lines += [LATENCY_REPORT_LINE.format(title=title, **stats) for title, stats in report.items()]
+        return "\n".join(lines)
+
+    def _format_stats_report(self, message) -> str:
+        """Формирует отчет /stats [дни]: ответы и взятия в работу по специалистам (только чат руководителя)"""
+        if str(message.chat.id) != str(self.config.manager_chat_id):
+            return ADMIN_ONLY_ERROR
+        arguments = message.text.split()[1:]
+        days = int(arguments[0]) if arguments and arguments[0].isdigit() and int(arguments[0]) > 0 else STATS_DEFAULT_DAYS
+        since = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        totals, histogram = self.db.get_responder_stats(since)
+        if not totals:
+            return STATS_REPORT_EMPTY.format(days=days)
+
+        responders = {}
+        for responder_id, name, kind, count, _, _ in totals:
+            responder = responders.setdefault(responder_id, {'name': name, 'counts': {}, 'buckets': {}})
+            responder['counts'][kind] = count
+        for responder_id, kind, bucket, count in histogram:
+            responders[responder_id]['buckets'].setdefault(kind, {})[bucket] = count
+
+        def duration(buckets: dict, fraction: float) -> str:
+            if not buckets:
+                return "-"
+            bound = histogram_percentile(buckets, fraction)
+            return f"≤{bound // 60} мин" if bound is not None else f">{STATS_DURATION_BUCKETS[-1] // 3600} ч"
+
+        lines = [STATS_REPORT_HEADER.format(
+            days=days, since=since,
+            responses=sum(responder['counts'].get(STATS_KIND_RESPONSE, 0) for responder in responders.values()),
+            taken=sum(responder['counts'].get(STATS_KIND_TAKEN, 0) for responder in responders.values())
+        )]
+        for responder in sorted(responders.values(), key=lambda responder: -sum(responder['counts'].values())):
+            response_buckets = responder['buckets'].get(STATS_KIND_RESPONSE, {})
+            taken_buckets = responder['buckets'].get(STATS_KIND_TAKEN, {})
+            lines.append(STATS_REPORT_LINE.format(
+                name=responder['name'],
+                responses=responder['counts'].get(STATS_KIND_RESPONSE, 0),
+                response_median=duration(response_buckets, 0.5),
+                response_p90=duration(response_buckets, 0.9),
+                taken=responder['counts'].get(STATS_KIND_TAKEN, 0),
+                taken_median=duration(taken_buckets, 0.5)
+            ))
+        return "\n".join(lines)
 
-        while not stop_event.is_set() and reminder_count < MAX_REMINDERS:
-            # Ждем 7 минут перед отправкой напоминания
-            stop_event.wait(REMINDER_TIME * 60)  # 7 минут в секундах
+    def _start_reminders(self, message_data: dict, reminder_number: int = 1):
+        """Планирует периодические напоминания об активной задаче"""
+        if reminder_number == 1:
+            LOGGER.info(f"Запуск напоминаний для задачи {message_data['message_hash']}")
+        deadline = time.time() + REMINDER_TIME * 60  # 7 минут в секундах
+        self._arm_reminder(message_data, reminder_number, deadline)
+        self.db.set_pending_reminder(message_data['message_hash'], reminder_number, deadline)
+
+    def _arm_reminder(self, message_data: dict, reminder_number: int, deadline: float):
+        """Взводит таймер очередного напоминания, заменяя предыдущий"""
+        self._stop_reminders(message_data['message_hash'])
+        self.scheduler.schedule_at(
+            deadline,
+            self._send_periodic_reminder,
+            message_data,
+            reminder_number,
+            key=('reminder', message_data['message_hash'])
+        )
+
+    def _arm_escalation(self, message_data: dict, deadline: float):
+        """Взводит таймер проверки ответа и уведомления руководителя"""
+        self.scheduler.cancel_key(('escalation', message_data['message_hash']))
+        self.scheduler.schedule_at(
+            deadline,
+            self._check_response,
+            message_data,
+            key=('escalation', message_data['message_hash'])
+        )
+
+    def _stop_reminders(self, message_hash: str):
+        """Отменяет запланированные напоминания по задаче"""
+        if self.scheduler.cancel_key(('reminder', message_hash)):
+            LOGGER.info(f"Напоминания остановлены для задачи {message_hash}")
+
+    def _send_periodic_reminder(self, message_data: dict, reminder_number: int):
+        """Отправляет очередное напоминание и планирует следующее"""
+        # Проверяем, что задача все еще активна (напоминания ВКЛЮЧЕНЫ)
+        if not message_data.get('is_actual', True):
+            LOGGER.info(f"Задача больше не активна, остановка напоминаний: {message_data['message_hash']}")
+            return
             
-            if stop_event.is_set():
-                LOGGER.info(f"Напоминания остановлены для задачи {message_data['message_hash']}")
-                break
-                
-            # Проверяем, что задача все еще активна (напоминания ВКЛЮЧЕНЫ)
-            if not message_data.get('is_actual', True):
-                LOGGER.info(f"Задача больше не активна, остановка напоминаний: {message_data['message_hash']}")
-                break
-                
-            # Проверяем, был ли ответ на сообщение
-            db_message = self.db.get_message_by_hash(message_data['message_hash'])
-            if db_message and db_message[8]!=0:  # is_responded
-                LOGGER.info(f"Получен ответ на задачу, остановка напоминаний: {message_data['message_hash']}")
-                break
-                
-            # Отправляем напоминание
-            LOGGER.info(f"Отправка напоминания #{reminder_count + 1} для задачи {message_data['message_hash']}")
-            self._send_reminder_to_telegram(message_data, reminder_count + 1)
-            reminder_count += 1
-        
-        LOGGER.info(f"Завершены напоминания для задачи {message_data['message_hash']}, отправлено: {reminder_count}")
+        # Проверяем, был ли ответ на сообщение
+        message_state = self.db.get_message_state(message_data['message_hash'])
+        if message_state and message_state[2]:  # is_responded
+            LOGGER.info(f"Получен ответ на задачу, остановка напоминаний: {message_data['message_hash']}")
+            return
+            
+        # Отправляем напоминание
+        LOGGER.info(f"Отправка напоминания #{reminder_number} для задачи {message_data['message_hash']}")
+        self._send_reminder_to_telegram(message_data, reminder_number)
+
+        if reminder_number < MAX_REMINDERS:
+            self._start_reminders(message_data, reminder_number + 1)
+        else:
+            self.db.set_pending_reminder(message_data['message_hash'], reminder_number, None)
+            LOGGER.info(f"Завершены напоминания для задачи {message_data['message_hash']}, отправлено: {reminder_number}")
 
     def _update_message_with_new_button(self, message, message_data: dict, button_text: str):
         """Обновляет сообщение с новой кнопкой"""
@@ -351,7 +579,7 @@ class MessageProcessor:
         ))
         
         # Обновляем сообщение
-        self.telegram_bot.edit_message_text(
+        self.telegram_sender.edit_message_text(
             chat_id=message.chat.id,
             message_id=message.message_id,
             text=message.html_text,
@@ -370,38 +598,31 @@ class MessageProcessor:
             LOGGER.warning(f"Не найдено первое сообщение для напоминания #{reminder_number}")
             return
         
-        try:
-            # Просто отправляем текст напоминания как reply на первое сообщение
-            reminder_text = REMINDER_MESSAGE.format(reminder_number=reminder_number)
-            
-            self.telegram_bot.send_message(
-                self.config.telegram_chat_id,
-                reminder_text,
-                parse_mode='HTML',
-                reply_to_message_id=first_message_id,
-                disable_web_page_preview=True
-            )
-            LOGGER.info(f"Напоминание #{reminder_number} отправлено для задачи {message_data['message_hash']}")
-            
-        except Exception as e:
-            error = str(e)
-            LOGGER.error(TG_SEND_ERROR).format(error=error)
+        # Просто отправляем текст напоминания как reply на первое сообщение
+        reminder_text = REMINDER_MESSAGE.format(reminder_number=reminder_number)
+        
+        self.telegram_sender.send_message(
+            self.config.telegram_chat_id,
+            reminder_text,
+            parse_mode='HTML',
+            reply_to_message_id=first_message_id,
+            disable_web_page_preview=True
+        )
+        LOGGER.info(f"Напоминание #{reminder_number} поставлено в очередь для задачи {message_data['message_hash']}")
 
     def _find_first_message_id(self, message_hash: str) -> int:
         """Находит ID первого сообщения в Telegram по хешу задачи"""
-        for telegram_message_id, message_data in self.pending_responses.items():
-            if message_data.get('message_hash') == message_hash:
-                return telegram_message_id
-        return None
+        return self.pending_responses.first_message_id(message_hash)
 
     def _get_message_hash(self, message: str, channel_id: str, post_id: str) -> str:
         """Генерирует уникальный хеш для сообщения"""
         return md5(f"{message}-{channel_id}-{post_id}".encode()).hexdigest()
     
-    def _is_working_time(self) -> bool:
-        """Проверяет, находится ли текущее время в рабочих часах и рабочих днях"""
-        now_ekb = datetime.now(self.config.ekb_tz)
-        now_msk = datetime.now(self.config.msk_tz)
+    def _is_working_time(self, now: float = None) -> bool:
+        """Проверяет, находится ли текущее (или указанное) время в рабочих часах и рабочих днях"""
+        now = time.time() if now is None else now
+        now_ekb = datetime.fromtimestamp(now, self.config.ekb_tz)
+        now_msk = datetime.fromtimestamp(now, self.config.msk_tz)
         
         # Проверяем, является ли сегодня выходным днем (суббота или воскресенье)
         if now_ekb.weekday() >= 5:  # 5 - суббота, 6 - воскресенье
@@ -418,116 +639,157 @@ class MessageProcessor:
         
         LOGGER.debug(f"Проверка рабочего времени: ЕКБ {ekb_hour}ч, МСК {msk_hour}ч - {'рабочее' if is_working else 'нерабочее'}")
         return is_working
+
+    def _next_off_hours_at(self, now: float = None) -> float:
+        """Возвращает начало ближайшего нерабочего времени (границы WORK_TIME - целые часы)"""
+        now = time.time() if now is None else now
+        if not self._is_working_time(now):
+            return now
+        moment = now - now % 3600 + 3600
+        while self._is_working_time(moment):
+            moment += 3600
+        return moment
+
+    def _schedule_deferred_flush(self, deadline: float):
+        """Взводит единственный таймер выпуска отложенных сообщений"""
+        self.scheduler.cancel_key('deferred_flush')
+        self.scheduler.schedule_at(deadline, self._flush_deferred, key='deferred_flush')
+
+    def _flush_deferred(self):
+        """Выпускает отложенные сообщения в очередь порциями, не чаще DEFERRED_FLUSH_INTERVAL"""
+        now = time.time()
+        if self._is_working_time(now):
+            self._schedule_deferred_flush(self._next_off_hours_at(now))
+            return
+        released = self.db.release_deferred_messages(now, DEFERRED_FLUSH_BATCH, now)
+        if released is None:
+            # Транзакция откатилась: сообщения остались отложенными, повторим позже
+            self._schedule_deferred_flush(now + DEFERRED_FLUSH_INTERVAL)
+            return
+        if released:
+            for message_hash in released:
+                self.tracer.mark(message_hash, 'queued')
+            self.message_queue.notify_enqueued(len(released))
+            LOGGER.info(f"Выпущено отложенных сообщений: {len(released)}")
+
+        if len(released) == DEFERRED_FLUSH_BATCH:
+            # Остальное выпускаем следующей порцией, чтобы граница рабочего дня не стала всплеском
+            self._schedule_deferred_flush(now + DEFERRED_FLUSH_INTERVAL)
+            return
+        next_release = self.db.get_next_deferred_release()
+        if next_release is not None:
+            self._schedule_deferred_flush(max(next_release, now + DEFERRED_FLUSH_INTERVAL))
     
     def process_message(self, message: str, channel_id: str, post_id: str, user_id: str):
         """Обрабатывает входящее сообщение"""
         LOGGER.info(f"Обработка сообщения от пользователя {user_id}, post_id: {post_id}")
-        message_hash = self._get_message_hash(message, channel_id, post_id)
+        self.process_messages([{
+            'message': message,
+            'channel_id': channel_id,
+            'post_id': post_id,
+            'user_id': user_id
+        }])
+
+    def process_messages(self, posts: list, cursors: dict = None):
+        """Обрабатывает пачку входящих сообщений одной транзакцией записи.
+
+        cursors - курсоры поллинга каналов, которые сохраняются в той же транзакции.
+        Возвращает хеши новых сообщений или None, если записать пачку не удалось.
+        """
+        now = time.time()
+        candidates = {}
+        batch_keys = set()
+        for post in posts:
+            # Быстрая проверка по индексу обработанных постов: без хеширования текста и без обращения к БД
+            dedup_key = (post['channel_id'], post['post_id'])
+            if dedup_key in self.processed_messages or dedup_key in batch_keys:
+                LOGGER.debug(f"Сообщение уже в обработке: {post['post_id']}")
+                DEDUP_HITS.labels('cache').inc()
+                continue
+            batch_keys.add(dedup_key)
+            message_hash = self._get_message_hash(post['message'], post['channel_id'], post['post_id'])
+            candidates[message_hash] = {**post, 'message_hash': message_hash, 'timestamp': now}
         
-        # Проверяем, было ли сообщение уже обработано
-        db_message = self.db.get_message_by_hash(message_hash)
-        if db_message and db_message[7]:  # is_processed
-            LOGGER.debug(f"Сообщение уже обработано: {message_hash}")
-            return
+        if not candidates and not cursors:
+            return []
         
-        # Добавляем сообщение в базу данных
-        message_id = self.db.add_message(message_hash, message, channel_id, post_id, user_id, time.time())
+        if candidates and self._is_working_time(now):
+            # В рабочее время сообщения копятся в БД и выпускаются с началом нерабочего
+            release_at = self._next_off_hours_at(now)
+            for data in candidates.values():
+                data['release_at'] = release_at
         
-        with self.lock:
-            if message_hash in self.processed_messages:
-                LOGGER.debug(f"Сообщение уже в обработке: {message_hash}")
-                return
-            self.processed_messages.add(message_hash)
+        if self.write_behind is not None:
+            # Отложенная запись: дедупликация по кешу и чтению из БД, запись вместе с постановкой в очередь - позже
+            processed = self.db.get_processed_hashes(list(candidates))
+            new_hashes = [
+                message_hash for message_hash, data in candidates.items()
+                if message_hash not in processed
+                and self.processed_messages.add_if_absent((data['channel_id'], data['post_id']))
+            ]
+            self._remember_processed(candidates[message_hash] for message_hash in processed)
+            self.write_behind.add([candidates[message_hash] for message_hash in new_hashes], cursors)
+        else:
+            # При промахе кеша база данных решает, какие сообщения новые; запись и постановка в очередь -
+            # одна транзакция на пачку
+            new_hashes = self.db.store_messages(list(candidates.values()), now, cursors)
+            if new_hashes is None:
+                return None
+            self._remember_processed(candidates.values())
+            self._on_messages_stored(list(candidates.values()), new_hashes)
         
-        if self._is_working_time():
-            LOGGER.info(f"Сообщение отложено (рабочее время): {message_hash}")
+        skipped = len(candidates) - len(new_hashes)
+        if skipped:
+            LOGGER.debug(f"Пропущено уже обработанных сообщений: {skipped}")
+            DEDUP_HITS.labels('database').inc(skipped)
+        return new_hashes
+
+    def _on_messages_stored(self, messages: list, new_hashes: list):
+        """Продолжает конвейер для сообщений, уже записанных в БД вместе с постановкой в очередь"""
+        if not new_hashes:
             return
+        by_hash = {message['message_hash']: message for message in messages}
+        queued, deferred = [], []
+        for message_hash in new_hashes:
+            message = by_hash[message_hash]
+            if message.get('create_at'):
+                self.tracer.mark(message_hash, 'created', message['create_at'] / 1000)
+            self.tracer.mark(message_hash, 'seen', message['timestamp'])
+            (queued if message.get('release_at') is None else deferred).append(message)
         
-        LOGGER.info(f"Сообщение добавлено в очередь: {message_hash}")
-        self.message_queue.put({
-            'message': message,
-            'channel_id': channel_id,
-            'post_id': post_id,
-            'user_id': user_id,
-            'message_hash': message_hash,
-            'timestamp': time.time()
-        })
-    
-    def _get_random_user_by_position(self, position: str):
-        LOGGER.debug(f"Поиск случайного пользователя с позицией: {position}")
-        random_user=self.db.get_random_user_by_position(position)
-        return random_user
+        if deferred:
+            self._schedule_deferred_flush(min(message['release_at'] for message in deferred))
+            LOGGER.info(f"Сообщения отложены до нерабочего времени: {len(deferred)}")
+        if not queued:
+            return
+        # Профили новых авторов загружаем заранее одним запросом на пачку
+        self.user_cache.prefetch({message['user_id'] for message in queued})
+        for message in queued:
+            LOGGER.info(f"Сообщение добавлено в очередь: {message['message_hash']}")
+            self.tracer.mark(message['message_hash'], 'queued')
+        self.message_queue.notify_enqueued(len(queued))
+
+    def _remember_processed(self, messages):
+        """Отмечает посты как обработанные в индексе дедупликации"""
+        for message in messages:
+            self.processed_messages.put((message['channel_id'], message['post_id']))
+
+    def _preload_processed(self):
+        """Заполняет индекс дедупликации постами, обработанными за время жизни записей индекса"""
+        keys = self.db.get_recent_message_keys(time.time() - PROCESSED_CACHE_TTL, PROCESSED_CACHE_SIZE)
+        # Строки идут от новых к старым; вставляем в обратном порядке, чтобы первыми вытеснялись старые
+        for key in reversed(keys):
+            self.processed_messages.put(key)
+        LOGGER.info(f"Индекс дедупликации загружен: {len(keys)} постов")
     
     def _get_user_info(self, user_id: str) -> dict:
-        """Получает информацию о пользователе из Mattermost и сохраняет в БД"""
+        """Получает информацию о пользователе (кеш в памяти, БД, затем Mattermost)"""
         LOGGER.debug(f"Получение информации о пользователе: {user_id}")
-        # Сначала проверяем локальную базу данных
-        db_user = self.db.get_user_info(user_id)
-        if db_user:
-            LOGGER.debug(f"Пользователь найден в локальной БД: {user_id}")
-            return {
-                'username': db_user[2],
-                'first_name': db_user[3],
-                'last_name': db_user[4],
-                'position': db_user[5],
-                'email': db_user[6]
-            }
-        
-        # Если нет в базе, запрашиваем из Mattermost
-        LOGGER.info(f"Запрос информации о пользователе из Mattermost: {user_id}")
-        headers = {
-            'Authorization': f'Bearer {self.config.mattermost_bearer_token}',
-            'Content-Type': 'application/json'
-        }
-        try:
-            response = requests.get(
-                f"{self.config.mattermost_server_url}/api/v4/users/{user_id}",
-                headers=headers,
-                timeout=MASSAGETIMEOUT
-            )
-            if response.status_code == HTTP_SUCCESS:
-                user_data = response.json()
-                user_data_from_bd=self.db.get_user_email(user_data.get('email'))
-                if user_data_from_bd != None:
-                    LOGGER.info(f"Пользователь с email уже существует: {user_data.get('email')}")
-                    # Email уже существует - обновляем информацию о пользователе
-                    email, user_id, username, time_zone = user_data_from_bd[5:8]
-                    
-                    self.db.add_or_update_user(
-                        user_id=user_data.get('id'),
-                        username=user_data.get('username'),
-                        first_name=user_data.get('first_name'),
-                        last_name=user_data.get('last_name'),
-                        position=user_data.get('position'),
-                        email = email,
-                        id_tg = user_id,
-                        username_tg = username,
-                        time_zone = time_zone
-                    )
-                else:
-                    LOGGER.info(f"Создание нового пользователя в БД: {user_data.get('username')}")
-                # Сохраняем пользователя в базу данных
-                    self.db.add_or_update_user(
-                        user_id=user_id,
-                        username=user_data.get('username'),
-                        first_name=user_data.get('first_name'),
-                        last_name=user_data.get('last_name'),
-                        position=user_data.get('position'),
-                        email=user_data.get('email')
-                    )
-                return user_data
-        except Exception as e:
-            LOGGER.error(f"Ошибка получения информации о пользователе: {str(e)}")
-        
-        return {'username': user_id}  # Возвращаем ID если не удалось получить информацию
+        return self.user_cache.get(user_id)
 
     def _send_to_mattermost(self, channel_id: str, message: str, post_id: str = None):
         """Отправляет сообщение в Mattermost"""
         LOGGER.debug(f"Отправка сообщения в Mattermost, channel: {channel_id}")
-        headers = {
-            'Authorization': f'Bearer {self.config.mattermost_bearer_token}',
-            'Content-Type': 'application/json'
-        }
         payload = {
             "channel_id": channel_id,
             "message": message,
@@ -537,20 +799,15 @@ class MessageProcessor:
             payload["root_id"] = post_id
             
         try:
-            response = requests.post(
-                f"{self.config.mattermost_server_url}/api/v4/posts",
-                headers=headers,
-                json=payload,
-                timeout=USERTIMEOUT
-            )
+            response = self.mattermost.create_post(payload)
             if response.status_code == HTTP_CREATED:
                 LOGGER.info(f"Сообщение успешно отправлено в Mattermost")
             else:
                 error=response.text
-                LOGGER.error(MM_USER_INFO_ERROR).format(error=error)
+                LOGGER.error(MM_SEND_ERROR.format(error=error))
         except Exception as e:
             error=str(e)
-            LOGGER.error(MM_USER_INFO_ERROR).format(error=error)
+            LOGGER.error(MM_SEND_ERROR.format(error=error))
             
     def _format_mattermost_link(self, post_id: str) -> str:
         """Форматирует правильную ссылку на сообщение в Mattermost"""
@@ -583,31 +840,9 @@ class MessageProcessor:
         # Форматируем ссылку
         mm_link = self._format_mattermost_link(message_data['post_id'])
 
-        # Получаем всех пользователей с их часовыми поясами
-        users_in_time_zone = self.db.get_users_with_time_zone()
-        LOGGER.debug(f"Найдено пользователей с часовыми поясами: {len(users_in_time_zone)}")
-
-        # Список пользователей, которые могут получать сообщения
-        working_usernames  = []
-        
-        for user in users_in_time_zone:
-            user_id, username_tg, position, time_zone = user
-            if user_id is not None and time_zone is not None:
-                # Определяем временную зону
-                if time_zone.lower() == 'мск':
-                    current_time = datetime.now(self.config.msk_tz)
-                elif time_zone.lower() == 'екб':
-                    current_time = datetime.now(self.config.ekb_tz)
-                else:
-                    # Если временная зона не указана или неизвестна, пропускаем пользователя
-                    continue
-                
-                # Получаем текущий час
-                current_hour = current_time.hour
-                
-                # Проверяем рабочее время
-                if not (WORK_TIME['start'] <= current_hour < WORK_TIME['end']):
-                    working_usernames.append(username_tg)
+        # Пользователи, у которых сейчас нерабочее время (индекс дежурных по часовым поясам)
+        working_usernames = self.duty_index.get_on_duty_usernames()
+        LOGGER.debug(f"Найдено дежурных пользователей: {len(working_usernames)}")
 
         # Создаем текст сообщения
         profile_url=STAFF_PROFILE_URL_TEMPLATE.format(username=username)
@@ -641,51 +876,60 @@ class MessageProcessor:
                 callback_data=CALLBACK_TAKE_WORK
             ))
             
-            # Отправляем сообщение
-            sent_msg = self.telegram_bot.send_message(
+            # Отправляем сообщение; задачу регистрируем, когда Telegram вернет ID сообщения
+            future = self.telegram_sender.send_message(
                 self.config.telegram_chat_id,
                 message_text,
                 parse_mode='HTML',
                 reply_markup=markup,
                 disable_web_page_preview=True
             )
+            future.add_done_callback(lambda sent: self._on_task_sent(sent, message_data))
+            return future
             
+        except Exception as e:
+            error=str(e)
+            LOGGER.error(TG_SEND_ERROR.format(error=error))
+
+    def _on_task_sent(self, future, message_data: dict):
+        """Регистрирует отправленную в Telegram задачу и взводит ее таймеры"""
+        if future.exception() is not None:
+            return
+        sent_msg = future.result()
+        try:
             # Изначально задача активна - напоминания ВКЛЮЧЕНЫ
             message_data['is_actual'] = True
-            self.pending_responses[sent_msg.message_id] = {
+            message_data['chat_id'] = str(self.config.telegram_chat_id)
+            pending_data = self.pending_responses.add(sent_msg.message_id, {
                 **message_data
-            }
+            })
+            escalate_at = time.time() + RESPONSE_CHECK_TIMEOUT  # Ждем 1 час
+            self.db.add_pending_task(message_data['chat_id'], sent_msg.message_id, pending_data, escalate_at)
             
             LOGGER.info(f"Сообщение отправлено в Telegram, ID: {sent_msg.message_id}")
+            self.tracer.mark(message_data['message_hash'], 'sent')
             
             # ЗАПУСКАЕМ напоминания сразу при получении сообщения
-            message_data['stop_reminder'] = Event()
-            message_data['reminder_thread'] = Thread(
-                target=self._send_periodic_reminders, 
-                args=(message_data, message_data['stop_reminder']),
-                daemon=True
-            )
-            message_data['reminder_thread'].start()
+            self._start_reminders(pending_data)
             
-            Thread(target=self._check_response, args=(message_data,)).start()
+            self._arm_escalation(pending_data, escalate_at)
             
         except Exception as e:
             error=str(e)
-            LOGGER.error(TG_SEND_ERROR).format(error=error)
+            LOGGER.error(TG_SEND_ERROR.format(error=error))
 
     def _check_response(self, message_data: dict):
         """Проверяет, был ли ответ на сообщение"""
         LOGGER.info(f"Запуск проверки ответа для задачи {message_data['message_hash']}")
-        time.sleep(RESPONSE_CHECK_TIMEOUT)  # Ждем 1 час
+        self.db.clear_pending_escalation(message_data['message_hash'])
         
-        with self.lock:
-            if message_data['post_id'] not in [msg['post_id'] for msg in self.pending_responses.values()]:
-                LOGGER.debug(f"Задача больше не в ожидании ответа: {message_data['message_hash']}")
-                return
+        if not self.pending_responses.has_post(message_data['post_id']):
+            LOGGER.debug(f"Задача больше не в ожидании ответа: {message_data['message_hash']}")
+            return
         
         # Проверяем в базе данных, был ли ответ
-        db_message = self.db.get_message_by_hash(message_data['message_hash'])
-        if db_message and db_message[8]:  # is_responded
+        message_state = self.db.get_message_state(message_data['message_hash'])
+        if message_state and message_state[2]:  # is_responded
             LOGGER.info(f"Ответ получен для задачи {message_data['message_hash']}")
             return
         
@@ -735,40 +979,130 @@ class MessageProcessor:
             ))
             
             # Отправляем сообщение
-            sent_msg = self.telegram_bot.send_message(
+            future = self.telegram_sender.send_message(
                 self.config.manager_chat_id,
                 message_text,
                 parse_mode='HTML',
                 reply_markup=markup,
                 disable_web_page_preview=True
             )
-            message_data['is_actual'] = True
-            self.pending_responses[sent_msg.message_id] = {
+            future.add_done_callback(lambda sent: self._on_manager_notified(sent, message_data))
+            return future
+            
+        except Exception as e:
+            error=str(e)
+            LOGGER.error(TG_SEND_ERROR.format(error=error))
+
+    def _on_manager_notified(self, future, message_data: dict):
+        """Регистрирует уведомление руководителя как ожидающую задачу"""
+        if future.exception() is not None:
+            return
+        sent_msg = future.result()
+        try:
+            manager_data = self.pending_responses.add(sent_msg.message_id, {
                 **message_data,
-            }
+                'is_actual': True,
+                'chat_id': str(self.config.manager_chat_id)
+            })
+            self.db.add_pending_task(manager_data['chat_id'], sent_msg.message_id, manager_data)
             LOGGER.info(f"Уведомление руководителя отправлено: {sent_msg.message_id}")
             
         except Exception as e:
             error=str(e)
-            LOGGER.error(TG_SEND_ERROR).format(error=error)
+            LOGGER.error(TG_SEND_ERROR.format(error=error))
     
-    def start_processing(self, stop_event: Event):
-        """Запускает обработку сообщений"""
-        LOGGER.info("Запуск обработки сообщений из очереди")
-        processed_count = 0
-        
+    def start_processing(self, stop_event: Event, workers: int = PROCESSING_WORKERS):
+        """Запускает пул обработчиков очереди; сообщения одного поста/треда обрабатываются по порядку"""
+        LOGGER.info(f"Запуск обработки сообщений из очереди, обработчиков: {workers}")
+        self.worker_stats = [
+            {'processed': 0, 'failed': 0, 'busy_time': 0.0, 'started_at': time.time()} for _ in range(workers)
+        ]
+        worker_queues = [Queue(maxsize=PROCESSING_WORKER_QUEUE_SIZE) for _ in range(workers)]
+        threads = [
+            Thread(target=self._process_worker, args=(number, worker_queues[number]),
+                   name=f"processor-{number}", daemon=True)
+            for number in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Из БД забираем не больше, чем обработчики могут держать одновременно
+        capacity = workers * PROCESSING_WORKER_QUEUE_SIZE
         while not stop_event.is_set():
+            free = capacity - self.message_queue.in_flight_count()
+            if free <= 0:
+                # Обработчики заняты (например, Telegram сдерживает отправку) - ждем подтверждений, а не опрашиваем БД
+                self.message_queue.wait_capacity(capacity, INGEST_IDLE_WAIT)
+                continue
+            batch = self.message_queue.claim(min(INGEST_CLAIM_BATCH, free))
+            if not batch:
+                self.message_queue.wait(INGEST_IDLE_WAIT)
+                continue
+            for message_data in batch:
+                # Тред всегда попадает к одному обработчику, поэтому порядок внутри треда сохраняется
+                ordering_key = message_data.get('root_id') or message_data['post_id']
+                worker_queues[hash(ordering_key) % workers].put(message_data)
+
+        # Обработчики дорабатывают уже полученные сообщения и завершаются
+        for worker_queue in worker_queues:
+            worker_queue.put(None)
+        for thread in threads:
+            thread.join()
+        LOGGER.info(f"Завершена обработка сообщений: {self.get_processing_statistics()}")
+
+    def _process_worker(self, number: int, worker_queue: Queue):
+        """Обработчик очереди: отправляет сообщения в Telegram по одному"""
+        stats = self.worker_stats[number]
+        while True:
+            message_data = worker_queue.get()
+            if message_data is None:
+                break
+            started = time.perf_counter()
+            message_hash = message_data['message_hash']
+            self.tracer.mark(message_hash, 'dequeued')
             try:
-                message_data = self.message_queue.get(timeout=1)
-                self._send_to_telegram(message_data)
-                self.message_queue.task_done()
-                processed_count += 1
-                
+                future = self._send_to_telegram(message_data)
+                # Сообщение снимается с очереди, когда Telegram завершил отправку (или она не нужна)
+                if future is None:
+                    self.message_queue.ack(message_hash)
+                else:
+                    future.add_done_callback(lambda sent, message_hash=message_hash: self._on_ingest_sent(sent, message_hash))
+                stats['processed'] += 1
+
                 # Периодически логируем статистику обработки
-                if processed_count % 100 == 0:
-                    LOGGER.info(f"Обработано сообщений из очереди: {processed_count}")
-                    
+                if stats['processed'] % 100 == 0:
+                    LOGGER.info(f"Обработчик {number}: обработано сообщений из очереди: {stats['processed']}")
             except Exception as e:
-                continue
-        
-        LOGGER.info(f"Завершена обработка сообщений. Всего обработано: {processed_count}")
\ No newline at end of file
+                stats['failed'] += 1
+                LOGGER.error(PROCESSING_ERROR.format(message_hash=message_hash, error=str(e)))
+                # Повторная попытка - после таймаута видимости
+                self.message_queue.release(message_hash)
+            finally:
+                stats['busy_time'] += time.perf_counter() - started
+
+    def _on_ingest_sent(self, sent, message_hash: str):
+        """Снимает сообщение с очереди после успешной отправки; при ошибке оставляет для повторной доставки"""
+        error = sent.exception()
+        if error is None:
+            self.message_queue.ack(message_hash)
+            return
+        LOGGER.error(PROCESSING_ERROR.format(message_hash=message_hash, error=str(error)))
+        # Повторная попытка - после таймаута видимости
+        self.message_queue.release(message_hash)
+
+    def get_processing_statistics(self):
+        """Возвращает пропускную способность и ошибки каждого обработчика очереди"""
+        now = time.time()
+        return {
+            'queue_size': self.message_queue.qsize(),
+            'ingest_queue': self.message_queue.get_statistics(),
+            'workers': [
+                {
+                    'processed': stats['processed'],
+                    'failed': stats['failed'],
+                    'busy_time': stats['busy_time'],
+                    'per_minute': stats['processed'] / (now - stats['started_at']) * 60
+                }
+                for stats in self.worker_stats
+            ]
+        }
\ No newline at end of file
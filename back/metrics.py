@@ -0,0 +1,58 @@
+import threading
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from back.logger import *
+
+from massage_varibles import *
+from varibles import *
+
+# Задержки горячих путей
+POLL_LATENCY = Histogram(
+    'botmm_poll_duration_seconds', 'Длительность since-поллинга канала Mattermost', ['channel'],
+    buckets=METRICS_LATENCY_BUCKETS
+)
+MATTERMOST_LATENCY = Histogram(
+    'botmm_mattermost_request_duration_seconds', 'Задержка запросов к API Mattermost', ['endpoint'],
+    buckets=METRICS_LATENCY_BUCKETS
+)
+TELEGRAM_LATENCY = Histogram(
+    'botmm_telegram_request_duration_seconds', 'Задержка вызовов API Telegram', ['method'],
+    buckets=METRICS_LATENCY_BUCKETS
+)
+DB_LOCK_WAIT = Histogram(
+    'botmm_db_lock_wait_seconds', 'Ожидание блокировки записи SQLite',
+    buckets=METRICS_LOCK_WAIT_BUCKETS
+)
+
+# Счетчики событий
+DEDUP_HITS = Counter(
+    'botmm_dedup_hits_total', 'Повторно полученные сообщения, отсеянные дедупликацией', ['source']
+)
+TELEGRAM_DROPPED = Counter(
+    'botmm_telegram_dropped_total', 'Вызовы Telegram, завершившиеся ошибкой', ['reason']
+)
+
+# Текущее состояние (значения снимаются при каждом опросе /metrics)
+QUEUE_DEPTH = Gauge('botmm_message_queue_depth', 'Сообщения в очереди на пересылку в Telegram')
+QUEUE_AGE = Gauge('botmm_message_queue_oldest_age_seconds', 'Возраст самого старого сообщения в очереди на пересылку')
+TELEGRAM_QUEUE_DEPTH = Gauge('botmm_telegram_queue_depth', 'Вызовы в исходящей очереди Telegram')
+PENDING_TASKS = Gauge('botmm_pending_tasks', 'Задачи, ожидающие ответа, в памяти')
+TIMERS = Gauge('botmm_timers', 'Запланированные таймеры напоминаний и эскалаций')
+THREADS = Gauge('botmm_threads', 'Живые потоки процесса')
+THREADS.set_function(threading.active_count)
+
+def register_processor(processor):
+    """Привязывает gauge-метрики к структурам обработчика сообщений"""
+    QUEUE_DEPTH.set_function(processor.message_queue.qsize)
+    QUEUE_AGE.set_function(processor.message_queue.oldest_age)
+    TELEGRAM_QUEUE_DEPTH.set_function(processor.telegram_sender.pending_count)
+    PENDING_TASKS.set_function(processor.pending_responses.size)
+    TIMERS.set_function(processor.scheduler.pending_count)
+
+def start_metrics_server(port: int, processor=None):
+    """Запускает HTTP-сервер /metrics в фоновом потоке"""
+    if processor is not None:
+        register_processor(processor)
+    start_http_server(port)
+    LOGGER.info(f"Метрики Prometheus доступны на порту {port}: /metrics")
@@ -0,0 +1,272 @@
+import sqlite3
+
+from back.logger import *
+
+from massage_varibles import *
+from varibles import *
+
+def _duration_bucket_sql(duration: str) -> str:
+    """CASE-выражение номера корзины STATS_DURATION_BUCKETS для длительности в секундах"""
+    cases = ' '.join(f"WHEN {duration} <= {bound} THEN {index}" for index, bound in enumerate(STATS_DURATION_BUCKETS))
+    return f"CASE {cases} ELSE {len(STATS_DURATION_BUCKETS)} END"
+
+_RESPONSE_DURATION = "MAX(response_time - timestamp, 0)"
+_TAKEN_DURATION = "MAX(strftime('%s', t.taken_at) - m.timestamp, 0)"
+# Ответы по истории; строки со взятием в работу (без ответа в треде) не учитываются
+_RESPONSE_ROWS = f"""
+        FROM messages
+        WHERE is_responded = 1 AND response_time IS NOT NULL AND responder_id IS NOT NULL
+          AND response_text NOT LIKE '{TASK_TAKEN_RESPONSE_PREFIX}%'
+"""
+
+# Упорядоченный список миграций: (версия, описание, SQL-выражения).
+# Версия применяется к PRAGMA user_version; уже примененные миграции пропускаются.
+# Первые миграции используют IF NOT EXISTS, чтобы существующие messages.db
+# (созданные до появления миграций, user_version = 0) обновлялись на месте.
+MIGRATIONS = [
+    (1, "Базовые таблицы messages, users, tasks", [
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_hash TEXT UNIQUE NOT NULL,
+            message_text TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            post_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            is_processed INTEGER DEFAULT 0,
+            is_responded INTEGER DEFAULT 0,
+            response_text TEXT,
+            response_time REAL,
+            responder_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            position TEXT,
+            email TEXT,
+            id_tg TEXT,
+            username_tg TEXT,
+            time_zone TEXT,
+            last_seen TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER NOT NULL,
+            assigned_to TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            taken_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            FOREIGN KEY (message_id) REFERENCES messages (id)
+        )
+        """
+    ]),
+    (2, "Таблица ожидающих ответа задач (сообщений в Telegram с кнопками)", [
+        """
+        CREATE TABLE IF NOT EXISTS pending_tasks (
+            chat_id TEXT NOT NULL,
+            telegram_message_id INTEGER NOT NULL,
+            message_hash TEXT NOT NULL,
+            message_text TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            post_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            is_actual INTEGER DEFAULT 1,
+            task_id INTEGER,
+            reminder_number INTEGER,
+            next_reminder_at REAL,
+            escalate_at REAL,
+            PRIMARY KEY (chat_id, telegram_message_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_pending_tasks_message_hash ON pending_tasks (message_hash)"
+    ]),
+    (3, "Индексы для поиска пользователей, сообщений и задач", [
+        "CREATE INDEX IF NOT EXISTS idx_users_id_tg ON users (id_tg)",
+        "CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)",
+        "CREATE INDEX IF NOT EXISTS idx_users_position ON users (position)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_message_id ON tasks (message_id)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_is_responded ON messages (is_responded)"
+    ]),
+    (4, "Курсоры поллинга каналов Mattermost", [
+        """
+        CREATE TABLE IF NOT EXISTS poll_cursors (
+            channel_id TEXT PRIMARY KEY,
+            last_create_at INTEGER NOT NULL,
+            seen_post_ids TEXT NOT NULL DEFAULT '',
+            updated_at REAL
+        )
+        """
+    ]),
+    (5, "Очередь сообщений, отложенных до нерабочего времени", [
+        """
+        CREATE TABLE IF NOT EXISTS deferred_messages (
+            message_hash TEXT PRIMARY KEY,
+            message_text TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            post_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            root_id TEXT,
+            timestamp REAL NOT NULL,
+            release_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_deferred_messages_release_at ON deferred_messages (release_at, timestamp)"
+    ]),
+    (6, "Отметки времени стадий обработки сообщений", [
+        """
+        CREATE TABLE IF NOT EXISTS message_stages (
+            message_id INTEGER PRIMARY KEY,
+            created_at REAL,
+            seen_at REAL,
+            queued_at REAL,
+            dequeued_at REAL,
+            sent_at REAL,
+            taken_at REAL,
+            answered_at REAL,
+            FOREIGN KEY (message_id) REFERENCES messages (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_message_stages_seen_at ON message_stages (seen_at)"
+    ]),
+    (7, "Индекс сообщений по времени для чтения истории", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp, id)"
+    ]),
+    (8, "Долговечная очередь сообщений на пересылку в Telegram", [
+        """
+        CREATE TABLE IF NOT EXISTS ingest_queue (
+            message_hash TEXT PRIMARY KEY,
+            message_text TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            post_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            root_id TEXT,
+            create_at INTEGER,
+            timestamp REAL NOT NULL,
+            enqueued_at REAL NOT NULL,
+            available_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    ]),
+    (9, "Агрегаты ответов и взятий в работу по дням и ответственным (с заполнением по истории)", [
+        """
+        CREATE TABLE IF NOT EXISTS responder_stats (
+            day TEXT NOT NULL,
+            responder_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            total_seconds REAL NOT NULL DEFAULT 0,
+            max_seconds REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, responder_id, kind)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS responder_stats_histogram (
+            day TEXT NOT NULL,
+            responder_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, responder_id, kind, bucket)
+        )
+        """,
+        f"""
+        INSERT INTO responder_stats (day, responder_id, kind, count, total_seconds, max_seconds)
+        SELECT date(response_time, 'unixepoch', 'localtime'), responder_id, '{STATS_KIND_RESPONSE}',
+               COUNT(*), SUM({_RESPONSE_DURATION}), MAX({_RESPONSE_DURATION})
+        {_RESPONSE_ROWS}
+        GROUP BY 1, 2
+        """,
+        f"""
+        INSERT INTO responder_stats_histogram (day, responder_id, kind, bucket, count)
+        SELECT date(response_time, 'unixepoch', 'localtime'), responder_id, '{STATS_KIND_RESPONSE}',
+               {_duration_bucket_sql(_RESPONSE_DURATION)}, COUNT(*)
+        {_RESPONSE_ROWS}
+        GROUP BY 1, 2, 4
+        """,
+        f"""
+        INSERT INTO responder_stats (day, responder_id, kind, count, total_seconds, max_seconds)
+        SELECT date(t.taken_at, 'localtime'), t.assigned_to, '{STATS_KIND_TAKEN}',
+               COUNT(*), SUM({_TAKEN_DURATION}), MAX({_TAKEN_DURATION})
+        FROM tasks t JOIN messages m ON m.id = t.message_id
+        WHERE t.taken_at IS NOT NULL
+        GROUP BY 1, 2
+        """,
+        f"""
+        INSERT INTO responder_stats_histogram (day, responder_id, kind, bucket, count)
+        SELECT date(t.taken_at, 'localtime'), t.assigned_to, '{STATS_KIND_TAKEN}',
+               {_duration_bucket_sql(_TAKEN_DURATION)}, COUNT(*)
+        FROM tasks t JOIN messages m ON m.id = t.message_id
+        WHERE t.taken_at IS NOT NULL
+        GROUP BY 1, 2, 4
+        """
+    ]),
+    (10, "Индекс задач по исполнителю и статусу для подсчета нагрузки", [
+        "CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to_status ON tasks (assigned_to, status)"
+    ]),
+    (11, "Закрытие исторических задач, которые до этого никогда не закрывались", [
+        # Повторное взятие после возврата создавало новую задачу - прежние считаем отмененными
+        f"""
+        UPDATE tasks SET status = '{TASK_STATUS_CANCELLED}'
+        WHERE status = '{TASK_STATUS_PENDING}'
+          AND EXISTS (SELECT 1 FROM tasks n WHERE n.message_id = tasks.message_id AND n.id > tasks.id)
+        """,
+        # Завершенными считаем только задачи по сообщениям с настоящим ответом, временем этого ответа
+        f"""
+        UPDATE tasks SET status = '{TASK_STATUS_COMPLETED}',
+            completed_at = COALESCE(completed_at, (
+                SELECT datetime(m.response_time, 'unixepoch') FROM messages m WHERE m.id = tasks.message_id
+            ))
+        WHERE status = '{TASK_STATUS_PENDING}'
+          AND message_id IN (
+              SELECT id FROM messages
+              WHERE is_responded = 1 AND response_time IS NOT NULL
+                AND COALESCE(response_text, '') NOT LIKE '{TASK_TAKEN_RESPONSE_PREFIX}%'
+          )
+        """,
+        # Без ответа и без свежего взятия задача просто устарела - время завершения не выдумываем
+        f"""
+        UPDATE tasks SET status = '{TASK_STATUS_EXPIRED}'
+        WHERE status = '{TASK_STATUS_PENDING}'
+          AND (taken_at IS NULL OR taken_at < datetime('now', '-{ASSIGNMENT_OPEN_TASK_TTL} seconds'))
+        """
+    ]),
+]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Возвращает текущую версию схемы из PRAGMA user_version"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(conn: sqlite3.Connection, migrations: list = None) -> int:
+    """Применяет недостающие миграции по порядку, каждую в своей транзакции"""
+    migrations = MIGRATIONS if migrations is None else migrations
+    current = get_schema_version(conn)
+
+    for version, description, statements in migrations:
+        if version <= current:
+            continue
+        LOGGER.info(f"Применение миграции {version}: {description}")
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            LOGGER.error(DB_MIGRATION_ERROR.format(version=version, error=str(e)))
+            raise
+        current = version
+
+    return current
@@ -0,0 +1,213 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from back.logger import *
+
+from massage_varibles import *
+from varibles import *
+
+class PendingTaskRegistry:
+    """Потокобезопасный реестр ожидающих задач с индексами по сообщению, хешу, посту и чату"""
+    def __init__(self, shards: int = PENDING_REGISTRY_SHARDS, max_size: int = PENDING_REGISTRY_MAX_SIZE,
+                 ttl: float = PENDING_TASK_TTL, closed_ttl: float = PENDING_CLOSED_TTL):
+        # Основное хранилище разбито на шарды по ID сообщения в Telegram
+        self._shards = [({}, Lock()) for _ in range(shards)]
+        # Вторичные индексы: ключ -> упорядоченный набор ID сообщений в Telegram
+        self._by_hash = {}
+        self._by_post = {}
+        self._by_chat = {}
+        self._index_lock = Lock()
+        self._size = 0
+        # Очереди для вытеснения: время добавления и время закрытия задачи
+        self._added = OrderedDict()
+        self._closed = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.closed_ttl = closed_ttl
+        # Статистика вытеснений
+        self.size_evictions = 0
+        self.ttl_evictions = 0
+        self.closed_evictions = 0
+
+    def _shard(self, telegram_message_id: int):
+        return self._shards[hash(telegram_message_id) % len(self._shards)]
+
+    def add(self, telegram_message_id: int, message_data: dict) -> dict:
+        """Добавляет задачу в реестр и возвращает сохраненную запись"""
+        entries, lock = self._shard(telegram_message_id)
+        with lock:
+            previous = entries.get(telegram_message_id)
+            entries[telegram_message_id] = message_data
+            with self._index_lock:
+                if previous is not None:
+                    self._unindex(telegram_message_id, previous)
+                else:
+                    self._size += 1
+                self._index(telegram_message_id, message_data)
+                self._added[telegram_message_id] = time.time()
+                self._added.move_to_end(telegram_message_id)
+                self._mark_closed_locked(telegram_message_id, not message_data.get('is_actual', True))
+        LOGGER.debug(f"Задача {message_data.get('message_hash')} добавлена в реестр, ID: {telegram_message_id}")
+        self._enforce_size()
+        return message_data
+
+    def get(self, telegram_message_id: int, default=None):
+        """Возвращает запись задачи по ID сообщения в Telegram"""
+        entries, lock = self._shard(telegram_message_id)
+        with lock:
+            return entries.get(telegram_message_id, default)
+
+    def __contains__(self, telegram_message_id) -> bool:
+        entries, lock = self._shard(telegram_message_id)
+        with lock:
+            return telegram_message_id in entries
+
+    def __len__(self) -> int:
+        return self._size
+
+    def size(self) -> int:
+        """Возвращает количество задач в реестре"""
+        return self._size
+
+    def update(self, telegram_message_id: int, **fields):
+        """Атомарно обновляет поля записи задачи"""
+        entries, lock = self._shard(telegram_message_id)
+        with lock:
+            message_data = entries.get(telegram_message_id)
+            if message_data is not None:
+                message_data.update(fields)
+            return message_data
+
+    def toggle(self, telegram_message_id: int, field: str, default: bool = True):
+        """Атомарно инвертирует булево поле записи и возвращает его прежнее значение"""
+        entries, lock = self._shard(telegram_message_id)
+        with lock:
+            message_data = entries.get(telegram_message_id)
+            if message_data is None:
+                return None
+            previous = message_data.get(field, default)
+            message_data[field] = not previous
+            if field == 'is_actual':
+                with self._index_lock:
+                    self._mark_closed_locked(telegram_message_id, previous)
+            return previous
+
+    def close(self, telegram_message_id: int):
+        """Отмечает задачу закрытой: она будет вытеснена после closed_ttl"""
+        entries, lock = self._shard(telegram_message_id)
+        with lock:
+            if telegram_message_id in entries:
+                with self._index_lock:
+                    self._mark_closed_locked(telegram_message_id, True)
+
+    def remove(self, telegram_message_id: int):
+        """Удаляет задачу из реестра"""
+        entries, lock = self._shard(telegram_message_id)
+        with lock:
+            message_data = entries.pop(telegram_message_id, None)
+            if message_data is not None:
+                with self._index_lock:
+                    self._unindex(telegram_message_id, message_data)
+                    self._added.pop(telegram_message_id, None)
+                    self._closed.pop(telegram_message_id, None)
+                    self._size -= 1
+            return message_data
+
+    def evict_expired(self) -> int:
+        """Вытесняет закрытые задачи старше closed_ttl и любые задачи старше ttl"""
+        now = time.time()
+        victims = {}
+        with self._index_lock:
+            for telegram_message_id, closed_at in self._closed.items():
+                if closed_at > now - self.closed_ttl:
+                    break
+                victims[telegram_message_id] = 'closed'
+            for telegram_message_id, added_at in self._added.items():
+                if added_at > now - self.ttl:
+                    break
+                victims.setdefault(telegram_message_id, 'ttl')
+        for telegram_message_id, reason in victims.items():
+            if self.remove(telegram_message_id) is None:
+                continue
+            if reason == 'closed':
+                self.closed_evictions += 1
+            else:
+                self.ttl_evictions += 1
+        if victims:
+            LOGGER.info(f"Вытеснено задач из реестра: {len(victims)}, осталось: {self._size}")
+        return len(victims)
+
+    def _enforce_size(self):
+        """Вытесняет самые старые задачи при превышении max_size"""
+        while self._size > self.max_size:
+            with self._index_lock:
+                if not self._added:
+                    return
+                # В первую очередь вытесняем закрытые задачи
+                victim = next(iter(self._closed or self._added))
+            if self.remove(victim) is not None:
+                self.size_evictions += 1
+
+    def first_message_id(self, message_hash: str):
+        """Возвращает ID первого сообщения в Telegram по хешу задачи"""
+        with self._index_lock:
+            ids = self._by_hash.get(message_hash)
+            return next(iter(ids)) if ids else None
+
+    def get_by_hash(self, message_hash: str) -> list:
+        """Возвращает ID всех сообщений в Telegram по хешу задачи"""
+        with self._index_lock:
+            return list(self._by_hash.get(message_hash, ()))
+
+    def get_by_chat(self, chat_id) -> list:
+        """Возвращает ID всех ожидающих сообщений в указанном чате"""
+        with self._index_lock:
+            return list(self._by_chat.get(str(chat_id), ()))
+
+    def has_post(self, post_id: str) -> bool:
+        """Проверяет, ожидает ли ответа задача по посту Mattermost"""
+        with self._index_lock:
+            return post_id in self._by_post
+
+    def get_statistics(self):
+        """Возвращает размеры реестра и его индексов"""
+        with self._index_lock:
+            return {
+                'tasks': self._size,
+                'hashes': len(self._by_hash),
+                'posts': len(self._by_post),
+                'chats': len(self._by_chat),
+                'closed': len(self._closed),
+                'max_size': self.max_size,
+                'size_evictions': self.size_evictions,
+                'ttl_evictions': self.ttl_evictions,
+                'closed_evictions': self.closed_evictions
+            }
+
+    def _mark_closed_locked(self, telegram_message_id: int, closed: bool):
+        if closed:
+            if telegram_message_id not in self._closed:
+                self._closed[telegram_message_id] = time.time()
+        else:
+            self._closed.pop(telegram_message_id, None)
+
+    def _index(self, telegram_message_id: int, message_data: dict):
+        for index, key in self._index_keys(message_data):
+            index.setdefault(key, {})[telegram_message_id] = None
+
+    def _unindex(self, telegram_message_id: int, message_data: dict):
+        for index, key in self._index_keys(message_data):
+            ids = index.get(key)
+            if ids is not None:
+                ids.pop(telegram_message_id, None)
+                if not ids:
+                    del index[key]
+
+    def _index_keys(self, message_data: dict):
+        keys = [
+            (self._by_hash, message_data.get('message_hash')),
+            (self._by_post, message_data.get('post_id')),
+            (self._by_chat, message_data.get('chat_id'))
+        ]
+        return [(index, key) for index, key in keys if key is not None]
@@ -0,0 +1,165 @@
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timezone
+from threading import Event
+
+from back.database import *
+
+from massage_varibles import *
+from varibles import *
+
+class MessageArchive:
+    """Архив старых сообщений: JSON Lines в gzip, по файлу на день (UTC) времени сообщения.
+
+    Каждая строка - сообщение со столбцами таблицы messages и списком его задач в 'tasks'.
+    Файлы дописываются новыми gzip-блоками, поэтому читаются целиком и через zcat/jq.
+    """
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def partition_path(self, day: str) -> str:
+        return os.path.join(self.directory, f"messages-{day}.jsonl.gz")
+
+    @staticmethod
+    def partition_day(timestamp: float) -> str:
+        return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+    def write(self, records: list) -> int:
+        """Дописывает записи в файлы их дней и сбрасывает на диск до возврата"""
+        partitions = {}
+        for record in records:
+            partitions.setdefault(self.partition_day(record['timestamp']), []).append(record)
+        for day, day_records in partitions.items():
+            data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in day_records)
+            with open(self.partition_path(day), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+                    archive.write(data.encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+        return len(records)
+
+    def iter_messages(self, since: float = None, until: float = None, channel_id: str = None):
+        """Выдает заархивированные сообщения за период (по файлам дней, без повторов)"""
+        first_day = self.partition_day(since) if since is not None else None
+        last_day = self.partition_day(until) if until is not None else None
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith('messages-') and name.endswith('.jsonl.gz')):
+                continue
+            day = name[len('messages-'):-len('.jsonl.gz')]
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+            # После сбоя между записью архива и удалением из БД пачка могла попасть в архив дважды
+            seen_ids = set()
+            with gzip.open(os.path.join(self.directory, name), 'rt', encoding='utf-8') as archive:
+                for line in archive:
+                    record = json.loads(line)
+                    if record['id'] in seen_ids:
+                        continue
+                    seen_ids.add(record['id'])
+                    if since is not None and record['timestamp'] < since:
+                        continue
+                    if until is not None and record['timestamp'] >= until:
+                        continue
+                    if channel_id is not None and record['channel_id'] != channel_id:
+                        continue
+                    yield record
+
+    def get_statistics(self):
+        """Возвращает число файлов архива и их суммарный размер"""
+        files = [name for name in os.listdir(self.directory) if name.endswith('.jsonl.gz')]
+        return {
+            'files': len(files),
+            'size_bytes': sum(os.path.getsize(os.path.join(self.directory, name)) for name in files)
+        }
+
+class RetentionJob:
+    """Фоновое хранение истории: перенос старых сообщений в архив и постепенное сжатие файла БД"""
+    def __init__(self, db: Database, archive: MessageArchive, retention_days: int = RETENTION_DAYS):
+        self.db = db
+        self.archive = archive
+        self.retention = retention_days * 24 * 3600
+        # Статистика
+        self.runs = 0
+        self.archived = 0
+        self.vacuum_pages = 0
+        self.last_run_at = None
+        self._conversion_logged = False
+
+    def run(self, stop_event: Event):
+        """Запускает проход раз в RETENTION_INTERVAL, пока не установлен stop_event"""
+        LOGGER.info(f"Запуск хранения истории: горизонт {self.retention / 86400:.0f} дн., архив {self.archive.directory}")
+        while not stop_event.is_set():
+            try:
+                self.run_once(stop_event)
+            except Exception as e:
+                error=str(e)
+                LOGGER.error(RETENTION_ERROR.format(error=error))
+            stop_event.wait(RETENTION_INTERVAL)
+
+    def run_once(self, stop_event: Event = None, time_budget: float = RETENTION_TIME_BUDGET) -> int:
+        """Архивирует сообщения старше горизонта пачками и освобождает место, укладываясь в time_budget"""
+        stop_event = stop_event or Event()
+        deadline = time.time() + time_budget
+        horizon = time.time() - self.retention
+        archived = 0
+        while time.time() < deadline and not stop_event.is_set():
+            rows = self.db.get_expired_messages(horizon, RETENTION_BATCH_SIZE)
+            if not rows:
+                break
+            archived += self._archive_batch(rows)
+            # Пауза между пачками отдает блокировку записи горячему пути
+            stop_event.wait(RETENTION_BATCH_PAUSE)
+
+        freed = self._vacuum(deadline, stop_event)
+        self.runs += 1
+        self.archived += archived
+        self.last_run_at = time.time()
+        if archived or freed:
+            LOGGER.info(f"Хранение истории: заархивировано сообщений {archived}, освобождено страниц {freed}")
+        return archived
+
+    def _archive_batch(self, rows: list) -> int:
+        """Записывает пачку в архив и только после этого удаляет ее из БД"""
+        records = {row[0]: dict(zip(ARCHIVE_MESSAGE_COLUMNS, row), tasks=[]) for row in rows}
+        for task in self.db.get_tasks_by_message_ids(list(records)):
+            records[task[1]]['tasks'].append(dict(zip(ARCHIVE_TASK_COLUMNS, task)))
+        self.archive.write(list(records.values()))
+        return self.db.delete_archived_messages(list(records))
+
+    def _vacuum(self, deadline: float, stop_event: Event) -> int:
+        """Возвращает свободные страницы файловой системе небольшими шагами"""
+        state = self.db.get_vacuum_state()
+        if state is None or not state['freelist_count']:
+            return 0
+        if state['auto_vacuum'] != DB_AUTO_VACUUM_INCREMENTAL:
+            # Старая база: полный VACUUM надолго занял бы запись, переводим только при запуске с DB_CONVERT_AUTO_VACUUM
+            if not self._conversion_logged:
+                LOGGER.warning(
+                    f"База без auto_vacuum = INCREMENTAL, свободных страниц {state['freelist_count']}: "
+                    f"место вернется после перезапуска с DB_CONVERT_AUTO_VACUUM=true"
+                )
+                self._conversion_logged = True
+            return 0
+        freed = 0
+        while time.time() < deadline and not stop_event.is_set():
+            step = self.db.incremental_vacuum(VACUUM_STEP_PAGES)
+            if not step:
+                break
+            freed += step
+            stop_event.wait(RETENTION_BATCH_PAUSE)
+        self.vacuum_pages += freed
+        return freed
+
+    def get_statistics(self):
+        """Возвращает счетчики архивации, размер базы и архива"""
+        return {
+            'runs': self.runs,
+            'archived': self.archived,
+            'vacuum_pages': self.vacuum_pages,
+            'last_run_at': self.last_run_at,
+            'database': self.db.get_vacuum_state(),
+            'archive': self.archive.get_statistics()
+        }
@@ -0,0 +1,156 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Event
+
+from back.logger import *
+
+from massage_varibles import *
+from varibles import *
+
+class TimerScheduler:
+    """Единый планировщик отложенных задач (напоминания, эскалации) на одном потоке"""
+    def __init__(self, workers: int = SCHEDULER_WORKERS):
+        self._heap = []
+        self._timers = {}
+        self._keys = {}
+        self._counter = itertools.count(1)
+        self._condition = Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="timer")
+        self._stale_entries = 0
+        # Статистика таймеров
+        self.scheduled_count = 0
+        self.fired_count = 0
+        self.cancelled_count = 0
+        self.failed_count = 0
+
+    def schedule(self, delay: float, callback, *args, key=None) -> int:
+        """Планирует вызов callback через delay секунд"""
+        return self.schedule_at(time.time() + delay, callback, *args, key=key)
+
+    def schedule_at(self, deadline: float, callback, *args, key=None) -> int:
+        """Планирует вызов callback на момент deadline (unix time)"""
+        with self._condition:
+            timer_id = next(self._counter)
+            entry = [deadline, timer_id, callback, args, key]
+            heapq.heappush(self._heap, entry)
+            self._timers[timer_id] = entry
+            if key is not None:
+                self._keys.setdefault(key, set()).add(timer_id)
+            self.scheduled_count += 1
+            # Будим поток, если новый таймер стал ближайшим
+            if self._heap[0] is entry:
+                self._condition.notify()
+        LOGGER.debug(f"Таймер {timer_id} запланирован на {deadline:.0f}, ключ: {key}")
+        return timer_id
+
+    def cancel(self, timer_id: int) -> bool:
+        """Отменяет таймер по его идентификатору"""
+        with self._condition:
+            return self._cancel_locked(timer_id)
+
+    def cancel_key(self, key) -> int:
+        """Отменяет все таймеры с указанным ключом"""
+        with self._condition:
+            timer_ids = list(self._keys.get(key, ()))
+            for timer_id in timer_ids:
+                self._cancel_locked(timer_id)
+        if timer_ids:
+            LOGGER.debug(f"Отменено таймеров по ключу {key}: {len(timer_ids)}")
+        return len(timer_ids)
+
+    def _cancel_locked(self, timer_id: int) -> bool:
+        """Помечает запись таймера отмененной (удаляется из кучи лениво)"""
+        entry = self._timers.pop(timer_id, None)
+        if entry is None:
+            return False
+        self._forget_key(entry)
+        entry[2] = None
+        self.cancelled_count += 1
+        self._stale_entries += 1
+        # Периодически сжимаем кучу, чтобы отмененные записи не копились
+        if self._stale_entries > SCHEDULER_COMPACT_THRESHOLD and self._stale_entries * 2 > len(self._heap):
+            self._heap = [item for item in self._heap if item[2] is not None]
+            heapq.heapify(self._heap)
+            self._stale_entries = 0
+        return True
+
+    def _forget_key(self, entry):
+        key = entry[4]
+        if key is None:
+            return
+        timer_ids = self._keys.get(key)
+        if timer_ids is not None:
+            timer_ids.discard(entry[1])
+            if not timer_ids:
+                del self._keys[key]
+
+    def pending_count(self, key=None) -> int:
+        """Возвращает количество ожидающих таймеров (всего или по ключу)"""
+        with self._condition:
+            if key is None:
+                return len(self._timers)
+            return len(self._keys.get(key, ()))
+
+    def get_statistics(self):
+        """Возвращает текущую статистику планировщика"""
+        with self._condition:
+            keys_by_kind = {}
+            for key, timer_ids in self._keys.items():
+                kind = key[0] if isinstance(key, tuple) else key
+                keys_by_kind[kind] = keys_by_kind.get(kind, 0) + len(timer_ids)
+            return {
+                'pending': len(self._timers),
+                'pending_by_kind': keys_by_kind,
+                'scheduled': self.scheduled_count,
+                'fired': self.fired_count,
+                'cancelled': self.cancelled_count,
+                'failed': self.failed_count
+            }
+
+    def run(self, stop_event: Event):
+        """Основной цикл планировщика"""
+        LOGGER.info("Запуск планировщика таймеров")
+        while not stop_event.is_set():
+            with self._condition:
+                due = self._pop_due_locked()
+                if due is None:
+                    timeout = SCHEDULER_IDLE_WAIT
+                    if self._heap:
+                        timeout = min(max(self._heap[0][0] - time.time(), 0), SCHEDULER_IDLE_WAIT)
+                    self._condition.wait(timeout)
+                    continue
+            self._executor.submit(self._fire, due)
+        self._executor.shutdown(wait=False)
+        LOGGER.info(f"Планировщик таймеров остановлен, ожидающих таймеров: {self.pending_count()}")
+
+    def _pop_due_locked(self):
+        """Извлекает из кучи первый наступивший таймер"""
+        while self._heap:
+            entry = self._heap[0]
+            if entry[2] is None:
+                heapq.heappop(self._heap)
+                self._stale_entries -= 1
+                continue
+            if entry[0] > time.time():
+                return None
+            heapq.heappop(self._heap)
+            del self._timers[entry[1]]
+            self._forget_key(entry)
+            return entry
+        return None
+
+    def _fire(self, entry):
+        """Выполняет callback таймера"""
+        _, timer_id, callback, args, key = entry
+        # Таймеры выполняются в пуле потоков - счетчики меняем под блокировкой планировщика
+        try:
+            callback(*args)
+        except Exception as e:
+            LOGGER.error(SCHEDULER_CALLBACK_ERROR.format(error=str(e)))
+            with self._condition:
+                self.failed_count += 1
+            return
+        with self._condition:
+            self.fired_count += 1
@@ -0,0 +1,203 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Event
+
+from telebot.apihelper import ApiTelegramException
+
+from back.logger import *
+from back.metrics import *
+
+from massage_varibles import *
+from varibles import *
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity про запас"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет доступен один токен"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+class TelegramSender:
+    """Исходящая очередь Telegram с ограничением скорости по чатам и глобально.
+
+    Вызовы к одному чату выполняются строго по порядку (не больше одного одновременно),
+    ответ 429 откладывает чат на retry_after секунд и повторяет вызов.
+    Методы возвращают Future с результатом вызова telebot.
+    """
+    def __init__(self, bot, workers: int = TG_SENDER_WORKERS, global_rate: float = TG_GLOBAL_RATE,
+                 chat_rate: float = TG_CHAT_RATE, group_rate: float = TG_GROUP_RATE):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self._global_bucket = TokenBucket(global_rate, TG_GLOBAL_BURST)
+        self._chat_buckets = {}
+        # Очередь вызовов по чатам и куча готовности чатов: (ready_at, seq, chat_id)
+        self._queues = {}
+        self._ready = []
+        self._scheduled = set()
+        self._busy = set()
+        self._blocked_until = {}
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tg-send")
+        # Статистика отправки
+        self.submitted_count = 0
+        self.sent_count = 0
+        self.retry_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        self.max_queue_delay = 0.0
+
+    def send_message(self, chat_id, text: str, **kwargs) -> Future:
+        return self.submit('send_message', chat_id, text, **kwargs)
+
+    def send_animation(self, chat_id, animation, **kwargs) -> Future:
+        return self.submit('send_animation', chat_id, animation, **kwargs)
+
+    def edit_message_text(self, chat_id, message_id: int, text: str, **kwargs) -> Future:
+        return self.submit('edit_message_text', chat_id, text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+    def reply_to(self, message, text: str, **kwargs) -> Future:
+        return self.submit('send_message', message.chat.id, text, reply_to_message_id=message.message_id, **kwargs)
+
+    def submit(self, method: str, chat_id, *args, **kwargs) -> Future:
+        """Ставит вызов метода бота в очередь чата и возвращает Future с результатом"""
+        future = Future()
+        chat_key = str(chat_id)
+        # edit_message_text принимает chat_id именованным аргументом
+        call_args = args if 'chat_id' in kwargs else (chat_id, *args)
+        with self._condition:
+            self._queues.setdefault(chat_key, deque()).append(
+                [method, call_args, kwargs, future, time.monotonic(), 0]
+            )
+            self.submitted_count += 1
+            self._schedule_locked(chat_key, time.monotonic())
+        return future
+
+    def run(self, stop_event: Event):
+        """Цикл диспетчера: выдает вызовы исполнителям в пределах лимитов"""
+        LOGGER.info("Запуск исходящей очереди Telegram")
+        while not stop_event.is_set():
+            with self._condition:
+                now = time.monotonic()
+                if not self._ready or self._ready[0][0] > now:
+                    timeout = self._ready[0][0] - now if self._ready else SCHEDULER_IDLE_WAIT
+                    self._condition.wait(min(timeout, SCHEDULER_IDLE_WAIT))
+                    continue
+                _, _, chat_key = heapq.heappop(self._ready)
+                self._scheduled.discard(chat_key)
+                if chat_key in self._busy or not self._queues.get(chat_key):
+                    continue
+                wait = max(
+                    self._blocked_until.get(chat_key, 0) - now,
+                    self._chat_bucket(chat_key).wait_time(now),
+                    self._global_bucket.wait_time(now)
+                )
+                if wait > 0:
+                    self._schedule_locked(chat_key, now + wait)
+                    continue
+                self._chat_bucket(chat_key).consume(now)
+                self._global_bucket.consume(now)
+                item = self._queues[chat_key].popleft()
+                self._busy.add(chat_key)
+                self.max_queue_delay = max(self.max_queue_delay, now - item[4])
+            self._executor.submit(self._execute, chat_key, item)
+        LOGGER.info(f"Исходящая очередь Telegram остановлена: {self.get_statistics()}")
+
+    def _execute(self, chat_key: str, item: list):
+        method, args, kwargs, future, _, attempts = item
+        retry_after = None
+        try:
+            with TELEGRAM_LATENCY.labels(method).time():
+                result = getattr(self.bot, method)(*args, **kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == TG_TOO_MANY_REQUESTS and attempts < TG_SEND_MAX_RETRIES:
+                retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+            else:
+                self._fail(future, e)
+        except Exception as e:
+            self._fail(future, e)
+        else:
+            future.set_result(result)
+
+        with self._condition:
+            if future.done() and future.exception() is None:
+                self.sent_count += 1
+            self._busy.discard(chat_key)
+            now = time.monotonic()
+            if retry_after is not None:
+                # Повторяем тот же вызов первым, остальные вызовы чата ждут за ним
+                LOGGER.warning(f"Telegram ограничил чат {chat_key}, повтор через {retry_after} с")
+                self.retry_count += 1
+                item[5] = attempts + 1
+                self._queues[chat_key].appendleft(item)
+                self._blocked_until[chat_key] = now + retry_after
+            elif not self._queues.get(chat_key):
+                self._queues.pop(chat_key, None)
+                self._blocked_until.pop(chat_key, None)
+                return
+            self._schedule_locked(chat_key, now)
+
+    def _fail(self, future: Future, error: Exception):
+        with self._condition:
+            self.failed_count += 1
+            if isinstance(error, ApiTelegramException) and error.error_code == TG_TOO_MANY_REQUESTS:
+                self.dropped_count += 1
+                TELEGRAM_DROPPED.labels('rate_limited').inc()
+            else:
+                TELEGRAM_DROPPED.labels('error').inc()
+        LOGGER.error(TG_SEND_ERROR.format(error=str(error)))
+        future.set_exception(error)
+
+    def _schedule_locked(self, chat_key: str, ready_at: float):
+        if chat_key in self._scheduled or chat_key in self._busy:
+            return
+        self._scheduled.add(chat_key)
+        heapq.heappush(self._ready, (ready_at, next(self._counter), chat_key))
+        self._condition.notify()
+
+    def _chat_bucket(self, chat_key: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_key)
+        if bucket is None:
+            # Отрицательные ID - группы: у них отдельный поминутный лимит
+            if chat_key.startswith('-'):
+                bucket = TokenBucket(self.group_rate, TG_GROUP_BURST)
+            else:
+                bucket = TokenBucket(self.chat_rate, TG_CHAT_BURST)
+            self._chat_buckets[chat_key] = bucket
+        return bucket
+
+    def pending_count(self) -> int:
+        """Количество вызовов, ожидающих отправки"""
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def get_statistics(self):
+        """Возвращает статистику исходящей очереди"""
+        return {
+            'pending': self.pending_count(),
+            'chats': len(self._queues),
+            'submitted': self.submitted_count,
+            'sent': self.sent_count,
+            'retried': self.retry_count,
+            'failed': self.failed_count,
+            'dropped': self.dropped_count,
+            'max_queue_delay': self.max_queue_delay
+        }
@@ -0,0 +1,81 @@
+import math
+import time
+from threading import Lock
+
+from back.database import *
+
+from massage_varibles import *
+from varibles import *
+
+# Отрезки пути сообщения: (начальная стадия, конечная стадия, подпись в отчете)
+LATENCY_SEGMENTS = [
+    ('created', 'seen', 'Mattermost → поллинг'),
+    ('seen', 'queued', 'поллинг → очередь'),
+    ('queued', 'dequeued', 'ожидание в очереди'),
+    ('dequeued', 'sent', 'отправка в Telegram'),
+    ('created', 'sent', 'Mattermost → Telegram'),
+    ('sent', 'taken', 'до взятия в работу'),
+    ('sent', 'answered', 'до ответа')
+]
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Перцентиль по рангу для отсортированного списка"""
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[max(rank - 1, 0)]
+
+def histogram_percentile(bucket_counts: dict, fraction: float, bounds: tuple = STATS_DURATION_BUCKETS):
+    """Перцентиль по гистограмме {номер корзины: количество}: верхняя граница корзины
+    (None - за последней границей)"""
+    total = sum(bucket_counts.values())
+    if not total:
+        return None
+    rank = max(math.ceil(fraction * total), 1)
+    seen = 0
+    for bucket in sorted(bucket_counts):
+        seen += bucket_counts[bucket]
+        if seen >= rank:
+            return bounds[bucket] if bucket < len(bounds) else None
+    return None
+
+class MessageTracer:
+    """Отметки времени стадий обработки сообщений; пишутся в БД пачками"""
+    def __init__(self, db: Database):
+        self.db = db
+        self._records = []
+        self._lock = Lock()
+        self.marked = 0
+        self.flushed = 0
+
+    def mark(self, message_hash: str, stage: str, timestamp: float = None):
+        """Отмечает момент прохождения стадии; повторная отметка стадии не перезаписывает первую"""
+        with self._lock:
+            self._records.append((message_hash, stage, time.time() if timestamp is None else timestamp))
+            self.marked += 1
+
+    def flush(self) -> int:
+        """Записывает накопленные отметки одной транзакцией"""
+        with self._lock:
+            records, self._records = self._records, []
+        if records and self.db.record_message_stages(records):
+            self.flushed += len(records)
+        return len(records)
+
+    def get_latency_report(self, window: float) -> dict:
+        """Возвращает p50/p95/p99 (в секундах) по отрезкам для сообщений за последние window секунд"""
+        self.flush()
+        rows = self.db.get_message_stages(time.time() - window)
+        report = {}
+        for start, end, title in LATENCY_SEGMENTS:
+            start_index, end_index = MESSAGE_STAGES.index(start), MESSAGE_STAGES.index(end)
+            durations = sorted(
+                row[end_index] - row[start_index]
+                for row in rows if row[start_index] is not None and row[end_index] is not None
+            )
+            if durations:
+                report[title] = {
+                    'count': len(durations),
+                    'p50': percentile(durations, 0.50),
+                    'p95': percentile(durations, 0.95),
+                    'p99': percentile(durations, 0.99)
+                }
+        return report
@@ -0,0 +1,158 @@
+from threading import Lock
+
+from back.cache import *
+from back.database import *
+from back.mattermost_client import *
+
+from massage_varibles import *
+from varibles import *
+
+class UserProfileCache:
+    """Двухуровневый кеш профилей Mattermost: LRU в памяти поверх таблицы users"""
+    def __init__(self, db: Database, client: MattermostClient, max_size: int = USER_CACHE_SIZE,
+                 ttl: float = USER_CACHE_TTL, negative_ttl: float = USER_NEGATIVE_CACHE_TTL):
+        self.db = db
+        self.client = client
+        self.profiles = LRUCache(max_size, ttl)
+        # Отрицательный кеш: пользователи, которых нет в Mattermost
+        self.unknown = LRUCache(max_size, negative_ttl)
+        self._stats_lock = Lock()
+        # Статистика уровней кеша
+        self.db_hits = 0
+        self.api_requests = 0
+        self.bulk_requests = 0
+        self.bulk_users = 0
+
+    def get(self, user_id: str) -> dict:
+        """Возвращает профиль пользователя: память -> БД -> Mattermost"""
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            return profile
+        if user_id in self.unknown:
+            return {'username': user_id}
+
+        db_user = self.db.get_user_info(user_id)
+        if db_user:
+            LOGGER.debug(f"Пользователь найден в локальной БД: {user_id}")
+            self._count('db_hits')
+            return self._remember(user_id, self._row_to_profile(db_user))
+
+        LOGGER.info(f"Запрос информации о пользователе из Mattermost: {user_id}")
+        self._count('api_requests')
+        try:
+            response = self.client.get_user(user_id)
+            if response.status_code == HTTP_SUCCESS:
+                return self._store(response.json())
+            if response.status_code == HTTP_NOT_FOUND:
+                self.unknown.put(user_id)
+            LOGGER.error(MM_USER_INFO_ERROR.format(error=response.text))
+        except Exception as e:
+            LOGGER.error(MM_USER_INFO_ERROR.format(error=str(e)))
+        # Возвращаем ID, если не удалось получить информацию
+        return {'username': user_id}
+
+    def prefetch(self, user_ids) -> int:
+        """Загружает профили новых авторов пачки: одним запросом к БД и одним к /users/ids"""
+        missing = [user_id for user_id in set(user_ids)
+                   if self.profiles.get(user_id) is None and user_id not in self.unknown]
+        if not missing:
+            return 0
+
+        db_users = self.db.get_users_info(missing)
+        for user_id, row in db_users.items():
+            self._count('db_hits')
+            self._remember(user_id, self._row_to_profile(row))
+        missing = [user_id for user_id in missing if user_id not in db_users]
+        if not missing:
+            return 0
+
+        LOGGER.info(f"Пакетный запрос профилей из Mattermost: {len(missing)}")
+        self._count('bulk_requests')
+        try:
+            response = self.client.get_users_by_ids(missing)
+            if response.status_code != HTTP_SUCCESS:
+                LOGGER.error(MM_USER_INFO_ERROR.format(error=response.text))
+                return 0
+            users = response.json()
+        except Exception as e:
+            LOGGER.error(MM_USER_INFO_ERROR.format(error=str(e)))
+            return 0
+
+        for user_data in users:
+            self._store(user_data)
+        self._count('bulk_users', len(users))
+        # Пользователи, которых сервер не вернул, не существуют (или удалены)
+        found = {user_data.get('id') for user_data in users}
+        for user_id in missing:
+            if user_id not in found:
+                self.unknown.put(user_id)
+        return len(users)
+
+    def invalidate(self, user_id: str):
+        """Сбрасывает профиль пользователя в памяти после изменения в БД"""
+        self.profiles.pop(user_id)
+        self.unknown.pop(user_id)
+
+    def get_statistics(self):
+        """Возвращает статистику попаданий по уровням кеша"""
+        memory = self.profiles.get_statistics()
+        lookups = memory['hits'] + memory['misses']
+        return {
+            'memory': memory,
+            'negative': self.unknown.get_statistics(),
+            'db_hits': self.db_hits,
+            'db_hit_rate': (self.db_hits / lookups) * 100 if lookups > 0 else 0,
+            'api_requests': self.api_requests,
+            'bulk_requests': self.bulk_requests,
+            'bulk_users': self.bulk_users
+        }
+
+    def _store(self, user_data: dict) -> dict:
+        """Сохраняет профиль из Mattermost в БД и в память"""
+        user_id = user_data.get('id')
+        user_data_from_bd = self.db.get_user_email(user_data.get('email'))
+        if user_data_from_bd is not None:
+            LOGGER.info(f"Пользователь с email уже существует: {user_data.get('email')}")
+            # Email уже существует - дополняем профиль данными регистрации в Telegram
+            email, id_tg, username_tg, time_zone = user_data_from_bd[6:10]
+            self.db.add_or_update_user(
+                user_id=user_id,
+                username=user_data.get('username'),
+                first_name=user_data.get('first_name'),
+                last_name=user_data.get('last_name'),
+                position=user_data.get('position'),
+                email=email,
+                id_tg=id_tg,
+                username_tg=username_tg,
+                time_zone=time_zone
+            )
+        else:
+            LOGGER.info(f"Создание нового пользователя в БД: {user_data.get('username')}")
+            self.db.add_or_update_user(
+                user_id=user_id,
+                username=user_data.get('username'),
+                first_name=user_data.get('first_name'),
+                last_name=user_data.get('last_name'),
+                position=user_data.get('position'),
+                email=user_data.get('email')
+            )
+        return self._remember(user_id, user_data)
+
+    def _remember(self, user_id: str, profile: dict) -> dict:
+        self.profiles.put(user_id, profile)
+        self.unknown.pop(user_id)
+        return profile
+
+    def _count(self, counter: str, value: int = 1):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    @staticmethod
+    def _row_to_profile(row) -> dict:
+        return {
+            'username': row[2],
+            'first_name': row[3],
+            'last_name': row[4],
+            'position': row[5],
+            'email': row[6]
+        }
@@ -0,0 +1,105 @@
+"""Бенчмарк поиска в messages.db: стоимость запросов при росте таблиц.
+
+Запуск из корня репозитория:
+    python -m benchmarks.db_lookups --sizes 1000 10000 100000 --lookups 2000
+
+Для сравнения с версией без индексов:
+    python -m benchmarks.db_lookups --drop-indexes
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from back.database import *
+
+INDEXES = [
+    'idx_users_id_tg',
+    'idx_users_email',
+    'idx_users_position',
+    'idx_tasks_message_id',
+    'idx_tasks_assigned_to_status',
+    'idx_messages_is_responded'
+]
+
+def fill_database(db: Database, size: int):
+    """Заполняет таблицы users, messages и tasks синтетическими данными"""
+    positions = ['Специалист по интеграции', POSITION, 'Аналитик', 'Разработчик']
+    with db._writer() as conn:
+        conn.executemany("""
+            INSERT INTO users (user_id, username, first_name, last_name, position, email, id_tg, username_tg, time_zone)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (f"mm{i}", f"user{i}", "Имя", "Фамилия", positions[i % len(positions)],
+             f"user{i}@skbkontur.ru", str(100000 + i), f"tg{i}", 'мск' if i % 2 else 'екб')
+            for i in range(size)
+        ])
+        conn.executemany("""
+            INSERT INTO messages (message_hash, message_text, channel_id, post_id, user_id, timestamp, is_responded)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (f"hash{i}", "текст сообщения", "channel", f"post{i}", f"mm{i}", time.time(), int(i % 10 != 0))
+            for i in range(size)
+        ])
+        conn.executemany("""
+            INSERT INTO tasks (message_id, assigned_to, status) VALUES (?, ?, 'pending')
+        """, [(i + 1, str(100000 + i)) for i in range(size)])
+        conn.commit()
+
+def measure(func, args_list) -> float:
+    """Возвращает среднее время вызова в микросекундах"""
+    started = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return (time.perf_counter() - started) / len(args_list) * 1e6
+
+def run(size: int, lookups: int, drop_indexes: bool) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = Database(path)
+    try:
+        fill_database(db, size)
+        if drop_indexes:
+            with db._writer() as conn:
+                for index in INDEXES:
+                    conn.execute(f"DROP INDEX IF EXISTS {index}")
+                conn.commit()
+        ids = [random.randrange(size) for _ in range(lookups)]
+
+        def tasks_by_message(message_id):
+            with db._reader() as conn:
+                return conn.execute("SELECT * FROM tasks WHERE message_id = ?", (message_id,)).fetchall()
+
+        def unanswered_count():
+            with db._reader() as conn:
+                return conn.execute("SELECT COUNT(*) FROM messages WHERE is_responded = 0").fetchone()
+
+        return {
+            'get_user_info_tg': measure(db.get_user_info_tg, [(str(100000 + i),) for i in ids]),
+            'get_user_by_email': measure(db.get_user_by_email, [(f"user{i}@skbkontur.ru",) for i in ids]),
+            'get_user_email': measure(db.get_user_email, [(f"user{i}@skbkontur.ru",) for i in ids]),
+            'tasks.message_id': measure(tasks_by_message, [(i + 1,) for i in ids]),
+            'messages.is_responded': measure(unanswered_count, [()] * max(lookups // 20, 1)),
+            'get_assignment_candidates': measure(
+                db.get_assignment_candidates, [(FAIR_POSITION,)] * max(lookups // 20, 1)
+            ),
+            'get_open_task_state': measure(db.get_open_task_state, [(str(100000 + i),) for i in ids])
+        }
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--drop-indexes', action='store_true', help="удалить индексы перед замером")
+    args = parser.parse_args()
+
+    results = {size: run(size, args.lookups, args.drop_indexes) for size in args.sizes}
+    queries = list(next(iter(results.values())).keys())
+    print(f"{'запрос (мкс/вызов)':<30}" + "".join(f"{size:>12}" for size in args.sizes))
+    for query in queries:
+        print(f"{query:<30}" + "".join(f"{results[size][query]:>12.1f}" for size in args.sizes))
+
+if __name__ == '__main__':
+    main()
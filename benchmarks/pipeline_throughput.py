@@ -0,0 +1,316 @@
+"""Сквозной бенчмарк конвейера: поллинг Mattermost → очередь → обработчики → Telegram.
+
+Поднимает локальные фейковые серверы Mattermost и Telegram Bot API, подает пачки
+постов с упоминанием бота и замеряет пропускную способность, заполнение очередей
+и задержку от получения поста поллером до доставки сообщения в Telegram.
+
+Запуск из корня репозитория:
+    python -m benchmarks.pipeline_throughput --bursts 20 --burst-size 50 --output before.json
+
+По умолчанию лимиты Telegram сняты, чтобы мерить собственную пропускную способность бота;
+с --respect-limits отправка идет с боевыми ограничениями скорости. Результаты двух прогонов
+сравниваются по JSON-файлам.
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote_plus
+
+from telebot import apihelper
+
+from back.database import *
+from back.config import *
+from back.message_processor import *
+from back.mattermost_poller import *
+from back.tracing import percentile
+
+BOT_MENTION = '@taxmon-manager-assistant'
+BENCH_USER_ID = 'benchuser'
+# Маркер поста в тексте: по нему фейковый Telegram сопоставляет доставку с постом
+POST_ID_PATTERN = re.compile(r'b\d{25}')
+UNLIMITED_RATE = 1e9
+SAMPLE_INTERVAL = 0.005
+
+class FakeMattermost:
+    """Минимальный REST API Mattermost: посты каналов, профили пользователей, создание постов"""
+    def __init__(self):
+        self.posts = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def add_posts(self, channel_id: str, count: int) -> list:
+        """Публикует count постов с упоминанием бота и возвращает их ID"""
+        create_at = int(time.time() * 1000)
+        with self.lock:
+            post_ids = []
+            for _ in range(count):
+                post_id = f"b{len(self.posts):025d}"
+                self.posts[post_id] = {
+                    'id': post_id, 'channel_id': channel_id, 'user_id': BENCH_USER_ID, 'root_id': '',
+                    'create_at': create_at, 'message': f"{BOT_MENTION} вопрос {post_id}"
+                }
+                post_ids.append(post_id)
+            return post_ids
+
+    def channel_posts(self, channel_id: str, query: dict) -> dict:
+        with self.lock:
+            posts = sorted(
+                (post for post in self.posts.values() if post['channel_id'] == channel_id),
+                key=lambda post: -post['create_at']
+            )
+        if 'since' in query:
+            posts = [post for post in posts if post['create_at'] >= int(query['since'][0])]
+        else:
+            page, per_page = int(query.get('page', [0])[0]), int(query.get('per_page', [60])[0])
+            posts = posts[page * per_page:(page + 1) * per_page]
+        return {'order': [post['id'] for post in posts], 'posts': {post['id']: post for post in posts}}
+
+    @staticmethod
+    def profile(user_id: str) -> dict:
+        return {
+            'id': user_id, 'username': f"user_{user_id}", 'first_name': 'Имя', 'last_name': 'Фамилия',
+            'position': 'Аналитик', 'email': f"{user_id}@skbkontur.ru"
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if '/channels/' in url.path:
+                    channel_id = url.path.split('/channels/')[1].split('/')[0]
+                    self._reply(HTTP_SUCCESS, fake.channel_posts(channel_id, parse_qs(url.query)))
+                elif '/users/' in url.path:
+                    self._reply(HTTP_SUCCESS, fake.profile(url.path.rsplit('/', 1)[1]))
+                else:
+                    self._reply(HTTP_NOT_FOUND, {})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.endswith('/users/ids'):
+                    self._reply(HTTP_SUCCESS, [fake.profile(user_id) for user_id in json.loads(body)])
+                else:
+                    self._reply(HTTP_CREATED, {'id': 'reply'})
+
+        return Handler
+
+class FakeTelegram:
+    """Bot API Telegram: принимает любые методы и фиксирует время доставки каждого поста"""
+    def __init__(self):
+        self.delivered = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.api_url = f"http://127.0.0.1:{self.server.server_port}/bot{{0}}/{{1}}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                received = time.time()
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+                raw = unquote_plus(self.path + body.decode(errors='ignore'))
+                with fake.lock:
+                    fake.calls += 1
+                    message_id = fake.calls
+                    for post_id in POST_ID_PATTERN.findall(raw):
+                        fake.delivered.setdefault(post_id, received)
+                data = json.dumps({'ok': True, 'result': {
+                    'message_id': message_id, 'date': int(received),
+                    'chat': {'id': -100, 'type': 'group'}, 'text': ''
+                }}).encode()
+                self.send_response(HTTP_SUCCESS)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
+
+class QueueSampler:
+    """Периодически снимает глубину очередей обработчика"""
+    def __init__(self, processor: MessageProcessor):
+        self.processor = processor
+        self.samples = []
+
+    def run(self, stop_event: threading.Event):
+        while not stop_event.is_set():
+            message_queue = self.processor.message_queue
+            self.samples.append((message_queue.qsize(), message_queue.oldest_age(), self.processor.telegram_sender.pending_count()))
+            time.sleep(SAMPLE_INTERVAL)
+
+    def summary(self) -> dict:
+        high_watermark = self.processor.message_queue.high_watermark
+        queue_sizes = [queue_size for queue_size, _, _ in self.samples] or [0]
+        queue_ages = [queue_age for _, queue_age, _ in self.samples] or [0]
+        telegram_sizes = [telegram_size for _, _, telegram_size in self.samples] or [0]
+        return {
+            'samples': len(self.samples),
+            'message_queue_max': max(queue_sizes),
+            'message_queue_mean': sum(queue_sizes) / len(queue_sizes),
+            'message_queue_high_watermark': high_watermark,
+            'message_queue_saturated_share': sum(size >= high_watermark for size in queue_sizes) / len(queue_sizes),
+            'message_queue_max_age': max(queue_ages),
+            'telegram_queue_max': max(telegram_sizes),
+            'telegram_queue_mean': sum(telegram_sizes) / len(telegram_sizes)
+        }
+
+def build_processor(mattermost: FakeMattermost, telegram: FakeTelegram, channels: list, db_path: str):
+    """Собирает обработчик так же, как main.py, но поверх фейковых серверов"""
+    os.environ.update({
+        'MATTERMOST_SERVER_URL': mattermost.url,
+        'MATTERMOST_CHANNEL_IDS': ','.join(channels),
+        'MATTERMOST_BEARER_TOKEN': 'bench',
+        'MATTERMOST_BOT_USER_ID': 'benchbot',
+        'MATTERMOST_INGEST_MODE': INGEST_MODE_POLL,
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_CHAT_ID': '-100',
+        'MANAGER_CHAT_ID': '-200'
+    })
+    apihelper.API_URL = telegram.api_url
+    config = Config()
+    db = Database(db_path)
+    processor = MessageProcessor(config, db)
+    # Бенчмарк проверяет путь пересылки, а не откладывание до нерабочего времени
+    processor._is_working_time = lambda now=None: False
+    return config, db, processor
+
+def build_pipeline(mattermost: FakeMattermost, telegram: FakeTelegram, channels: list, db_path: str):
+    """Собирает обработчик и поллер поверх фейковых серверов"""
+    config, db, processor = build_processor(mattermost, telegram, channels, db_path)
+    return db, processor, MattermostPoller(config, processor)
+
+def run(args) -> dict:
+    mattermost, telegram = FakeMattermost(), FakeTelegram()
+    for server in (mattermost.server, telegram.server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    channels = [f"benchchannel{number:014d}" for number in range(args.channels)]
+    db, processor, poller = build_pipeline(mattermost, telegram, channels, os.path.join(tempfile.mkdtemp(), "bench.db"))
+    if not args.respect_limits:
+        processor.telegram_sender = TelegramSender(
+            processor.telegram_bot, global_rate=UNLIMITED_RATE, chat_rate=UNLIMITED_RATE, group_rate=UNLIMITED_RATE
+        )
+
+    # Момент, когда пост попал в _process_messages поллера: начало отсчета задержки
+    ingested = {}
+    process_messages = poller._process_messages
+
+    def timed_process_messages(messages: dict, channel_id: str, **kwargs):
+        now = time.time()
+        for post_id in messages.get('order', []):
+            ingested.setdefault(post_id, now)
+        return process_messages(messages, channel_id, **kwargs)
+    poller._process_messages = timed_process_messages
+
+    stop_event = threading.Event()
+    sampler = QueueSampler(processor)
+    threads = [
+        threading.Thread(target=processor.scheduler.run, args=(stop_event,), daemon=True),
+        threading.Thread(target=processor.telegram_sender.run, args=(stop_event,), daemon=True),
+        threading.Thread(target=processor.start_processing, args=(stop_event, args.workers), daemon=True),
+        threading.Thread(target=sampler.run, args=(stop_event,), daemon=True)
+    ]
+    if processor.write_behind is not None:
+        threads.append(threading.Thread(target=processor.write_behind.run, args=(stop_event,), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    expected = set()
+    started = time.time()
+    for burst in range(args.bursts):
+        for channel_id in channels:
+            expected.update(mattermost.add_posts(channel_id, args.burst_size))
+        poller.poll_once()
+        time.sleep(args.pause)
+    deadline = time.time() + args.timeout
+    while time.time() < deadline:
+        with telegram.lock:
+            if expected <= telegram.delivered.keys():
+                break
+        time.sleep(0.01)
+
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    processor.tracer.flush()
+    processing = processor.get_processing_statistics()
+    db.close()
+    for server in (mattermost.server, telegram.server):
+        server.shutdown()
+
+    with telegram.lock:
+        delivered = {post_id: at for post_id, at in telegram.delivered.items() if post_id in expected}
+    latencies = sorted(delivered[post_id] - ingested[post_id] for post_id in delivered if post_id in ingested)
+    finished = max(delivered.values()) if delivered else time.time()
+    return {
+        'parameters': {
+            'bursts': args.bursts, 'burst_size': args.burst_size, 'pause': args.pause,
+            'channels': args.channels, 'workers': args.workers, 'respect_limits': args.respect_limits
+        },
+        'posts': len(expected),
+        'delivered': len(delivered),
+        'duration': finished - started,
+        'throughput_per_second': len(delivered) / (finished - started) if delivered else 0,
+        'latency_seconds': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1]
+        } if latencies else {},
+        'queues': sampler.summary(),
+        'telegram_calls': telegram.calls,
+        'processing': processing,
+        'telegram_sender': processor.telegram_sender.get_statistics(),
+        'mattermost_client': processor.mattermost.get_statistics()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bursts', type=int, default=20)
+    parser.add_argument('--burst-size', type=int, default=50, help="постов в пачке на канал")
+    parser.add_argument('--pause', type=float, default=0.2, help="пауза между пачками, с")
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=PROCESSING_WORKERS)
+    parser.add_argument('--timeout', type=float, default=120, help="сколько ждать доставки после последней пачки, с")
+    parser.add_argument('--respect-limits', action='store_true', help="отправлять с боевыми лимитами Telegram")
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"доставлено {result['delivered']} из {result['posts']} за {result['duration']:.2f} с, "
+          f"{result['throughput_per_second']:.1f} сообщ./с")
+    for name, value in result['latency_seconds'].items():
+        print(f"  задержка {name}: {value * 1000:.1f} мс")
+    print(f"  очередь: максимум {result['queues']['message_queue_max']}/{result['queues']['message_queue_high_watermark']}, "
+          f"доля заполненности {result['queues']['message_queue_saturated_share']:.1%}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(result, output, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
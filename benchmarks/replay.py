@@ -0,0 +1,199 @@
+"""Воспроизведение истории messages.db через конвейер с ускорением в N раз.
+
+Сообщения из таблицы messages исходной базы читаются по времени и подаются в
+MessageProcessor.process_messages с теми же интервалами, сжатыми в --speed раз.
+Mattermost и Telegram заменены локальными фейковыми серверами, обработчик пишет
+во временную базу, исходная не изменяется (кроме применения миграций схемы).
+За прогон снимаются загрузка CPU, память процесса, отставание от расписания
+и задержки стадий из трассировки сообщений.
+
+Запуск из корня репозитория на копии боевой базы:
+    python -m benchmarks.replay --source messages-copy.db --since 2026-09-12T18:00 --until 2026-09-13T09:00 \\
+        --speed 60 --output peak-night.json
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.pipeline_throughput import *
+
+RESOURCE_SAMPLE_INTERVAL = 0.5
+DRAIN_POLL_INTERVAL = 0.05
+
+class ResourceSampler:
+    """Периодически снимает загрузку CPU и резидентную память процесса"""
+    def __init__(self, interval: float = RESOURCE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = []
+
+    @staticmethod
+    def rss_bytes() -> int:
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            # Вне Linux доступен только пик памяти
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def run(self, stop_event: threading.Event):
+        last_wall, last_cpu = time.time(), time.process_time()
+        while not stop_event.wait(self.interval):
+            wall, cpu = time.time(), time.process_time()
+            self.samples.append((wall, (cpu - last_cpu) / (wall - last_wall) * 100, self.rss_bytes()))
+            last_wall, last_cpu = wall, cpu
+
+    def summary(self) -> dict:
+        cpu = [sample[1] for sample in self.samples] or [0]
+        rss = [sample[2] for sample in self.samples] or [self.rss_bytes()]
+        return {
+            'cpu_percent_mean': sum(cpu) / len(cpu),
+            'cpu_percent_max': max(cpu),
+            'cpu_seconds': time.process_time(),
+            'rss_mb_mean': sum(rss) / len(rss) / 2 ** 20,
+            'rss_mb_max': max(rss) / 2 ** 20,
+            'timeline': [
+                {'at': round(wall, 3), 'cpu_percent': round(cpu_percent, 1), 'rss_mb': round(rss_bytes / 2 ** 20, 1)}
+                for wall, cpu_percent, rss_bytes in self.samples
+            ]
+        }
+
+def parse_time(value: str) -> float:
+    """Принимает UNIX-время или дату в ISO-формате (локальное время)"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def replay(source: Database, processor: MessageProcessor, speed: float, since: float, until: float) -> dict:
+    """Подает сообщения в обработчик по расписанию исходных отметок времени, сжатому в speed раз"""
+    replayed, batches, max_lag = 0, 0, 0.0
+    batch = []
+    origin = started = None
+    for _, message_text, channel_id, post_id, user_id, timestamp in source.iter_messages(since, until):
+        if origin is None:
+            origin, started = timestamp, time.time()
+        due = started + (timestamp - origin) / speed
+        now = time.time()
+        if due > now:
+            # Все, что к этому моменту уже наступило, уходит одной пачкой, как из одного поллинга
+            if batch:
+                processor.process_messages(batch)
+                batches += 1
+                batch = []
+            time.sleep(max(due - time.time(), 0))
+        else:
+            max_lag = max(max_lag, now - due)
+        batch.append({
+            'message': message_text,
+            'channel_id': channel_id,
+            'post_id': post_id,
+            'user_id': user_id,
+            'root_id': post_id,
+            'create_at': int(due * 1000)
+        })
+        replayed += 1
+    if batch:
+        processor.process_messages(batch)
+        batches += 1
+    return {
+        'messages': replayed,
+        'batches': batches,
+        'source_span_seconds': timestamp - origin if replayed else 0,
+        'replay_seconds': time.time() - started if replayed else 0,
+        'max_lag_seconds': max_lag
+    }
+
+def wait_drained(processor: MessageProcessor, timeout: float) -> bool:
+    """Ждет, пока очередь обработчика и исходящая очередь Telegram опустеют"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if processor.db.get_ingest_queue_state()[0] == 0 and processor.telegram_sender.pending_count() == 0:
+            return True
+        time.sleep(DRAIN_POLL_INTERVAL)
+    return False
+
+def run(args) -> dict:
+    mattermost, telegram = FakeMattermost(), FakeTelegram()
+    for server in (mattermost.server, telegram.server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    source = Database(args.source)
+    channels = list(dict.fromkeys(row[2] for row in source.iter_messages(args.since, args.until))) or ['replay']
+    _, db, processor = build_processor(mattermost, telegram, channels, os.path.join(tempfile.mkdtemp(), "replay.db"))
+    if not args.respect_limits:
+        processor.telegram_sender = TelegramSender(
+            processor.telegram_bot, global_rate=UNLIMITED_RATE, chat_rate=UNLIMITED_RATE, group_rate=UNLIMITED_RATE
+        )
+
+    stop_event = threading.Event()
+    sampler = ResourceSampler(args.sample_interval)
+    threads = [
+        threading.Thread(target=processor.scheduler.run, args=(stop_event,), daemon=True),
+        threading.Thread(target=processor.telegram_sender.run, args=(stop_event,), daemon=True),
+        threading.Thread(target=processor.start_processing, args=(stop_event, args.workers), daemon=True),
+        threading.Thread(target=sampler.run, args=(stop_event,), daemon=True)
+    ]
+    if processor.write_behind is not None:
+        threads.append(threading.Thread(target=processor.write_behind.run, args=(stop_event,), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    started = time.time()
+    result = replay(source, processor, args.speed, args.since, args.until)
+    drained = wait_drained(processor, args.timeout)
+    result['drained'] = drained
+    result['total_seconds'] = time.time() - started
+    result['latency'] = processor.tracer.get_latency_report(result['total_seconds'] + 60)
+    result['processing'] = processor.get_processing_statistics()
+
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    source.close()
+    db.close()
+    for server in (mattermost.server, telegram.server):
+        server.shutdown()
+
+    result.update({
+        'parameters': {
+            'source': args.source, 'since': args.since, 'until': args.until, 'speed': args.speed,
+            'workers': args.workers, 'respect_limits': args.respect_limits
+        },
+        'telegram_calls': telegram.calls,
+        'resources': sampler.summary(),
+        'telegram_sender': processor.telegram_sender.get_statistics()
+    })
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default="messages.db", help="база с историей сообщений (лучше копия)")
+    parser.add_argument('--since', type=parse_time, help="начало окна: UNIX-время или ISO-дата")
+    parser.add_argument('--until', type=parse_time, help="конец окна (не включая)")
+    parser.add_argument('--speed', type=float, default=60, help="ускорение относительно исходного времени")
+    parser.add_argument('--workers', type=int, default=PROCESSING_WORKERS)
+    parser.add_argument('--timeout', type=float, default=300, help="сколько ждать дообработки очередей, с")
+    parser.add_argument('--sample-interval', type=float, default=RESOURCE_SAMPLE_INTERVAL)
+    parser.add_argument('--respect-limits', action='store_true', help="отправлять с боевыми лимитами Telegram")
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"воспроизведено {result['messages']} сообщений ({result['source_span_seconds']:.0f} с истории) "
+          f"за {result['replay_seconds']:.1f} с, макс. отставание {result['max_lag_seconds']:.2f} с, "
+          f"очереди {'опустели' if result['drained'] else 'НЕ опустели'}")
+    print(f"  CPU: в среднем {result['resources']['cpu_percent_mean']:.0f}%, пик {result['resources']['cpu_percent_max']:.0f}%; "
+          f"память: пик {result['resources']['rss_mb_max']:.1f} МБ")
+    for title, values in result['latency'].items():
+        print(f"  {title}: p50 {values['p50'] * 1000:.1f} мс, p95 {values['p95'] * 1000:.1f} мс, "
+              f"p99 {values['p99'] * 1000:.1f} мс")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(result, output, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Проверка режима WebSocket: доставка постов при разрывах соединения.
+
+Поднимает фейковые Mattermost (REST и WebSocket /api/v4/websocket) и Telegram, запускает
+MattermostEventStream и публикует пачки постов событиями posted. После каждой пачки
+сервер рвет соединение; следующая пачка публикуется, пока бот переподключается.
+Обычно сессия сохраняется, и сервер досылает пропущенные события по connection_id и
+sequence_number; каждые --expire-every разрывов сессия теряется, и пропущенное должен
+добрать since-запрос поллера. В конце проверяется, что доставлен каждый пост.
+
+Запуск из корня репозитория:
+    python -m benchmarks.websocket_stream --bursts 10 --burst-size 20 --expire-every 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from aiohttp import web
+
+from benchmarks.pipeline_throughput import *
+from back.mattermost_stream import *
+
+# Сколько событий сессии сервер хранит для досылки после переподключения
+SESSION_EVENTS_LIMIT = 1000
+
+class FakeMattermostWebSocket:
+    """WebSocket API Mattermost: hello, события posted, возобновление сессии по connection_id"""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        # connection_id -> {'next_seq', 'events'}
+        self.sessions = {}
+        self.connection_id = None
+        self.socket = None
+        # Статистика сервера
+        self.connects = 0
+        self.resumes = 0
+        self.replayed = 0
+        self.published = 0
+        self.lost = 0
+        app = web.Application()
+        app.router.add_get('/api/v4/websocket', self._handle)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        port = self.runner.addresses[0][1]
+        self.ws_url = f"ws://127.0.0.1:{port}/api/v4/websocket"
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def shutdown(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def publish(self, posts: list):
+        """Публикует посты событиями posted текущей сессии (из любого потока)"""
+        asyncio.run_coroutine_threadsafe(self._publish(posts), self.loop).result(timeout=5)
+
+    def drop(self, expire: bool = False):
+        """Рвет соединение; при expire сервер забывает сессию и не сможет дослать события"""
+        asyncio.run_coroutine_threadsafe(self._drop(expire), self.loop).result(timeout=5)
+
+    def is_connected(self) -> bool:
+        return self.socket is not None and not self.socket.closed
+
+    async def _handle(self, request):
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        self.connects += 1
+        connection_id = request.query.get('connection_id')
+        session = self.sessions.get(connection_id)
+        if session is not None:
+            # Возобновление: досылаем события начиная с sequence_number, затем hello с тем же connection_id
+            self.resumes += 1
+            sequence_number = int(request.query.get('sequence_number', 0))
+            missed = [event for event in session['events'] if event['seq'] >= sequence_number]
+            for event in missed:
+                await socket.send_json(event)
+            self.replayed += len(missed)
+        else:
+            connection_id = uuid.uuid4().hex
+            session = self.sessions[connection_id] = {'next_seq': 0, 'events': []}
+        self.connection_id, self.socket = connection_id, socket
+        await socket.send_json(self._event(session, 'hello', {'connection_id': connection_id}))
+
+        async for message in socket:
+            if message.type == web.WSMsgType.TEXT:
+                request_data = json.loads(message.data)
+                await socket.send_json({'status': 'OK', 'seq_reply': request_data.get('seq')})
+        return socket
+
+    @staticmethod
+    def _event(session: dict, name: str, data: dict, broadcast: dict = None) -> dict:
+        event = {'event': name, 'data': data, 'broadcast': broadcast or {}, 'seq': session['next_seq']}
+        session['next_seq'] += 1
+        session['events'] = (session['events'] + [event])[-SESSION_EVENTS_LIMIT:]
+        return event
+
+    async def _publish(self, posts: list):
+        session = self.sessions.get(self.connection_id)
+        for post in posts:
+            self.published += 1
+            if session is None:
+                # Сессии нет: событие не дойдет, пост найдется только since-запросом
+                self.lost += 1
+                continue
+            event = self._event(
+                session, 'posted', {'post': json.dumps(post), 'channel_id': post['channel_id']},
+                {'channel_id': post['channel_id']}
+            )
+            if self.is_connected():
+                await self.socket.send_json(event)
+
+    async def _drop(self, expire: bool):
+        if expire:
+            self.sessions.pop(self.connection_id, None)
+        if self.socket is not None:
+            await self.socket.close()
+
+def wait_until(condition, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def run(args) -> dict:
+    mattermost, telegram, websocket = FakeMattermost(), FakeTelegram(), FakeMattermostWebSocket()
+    for target in (mattermost.server.serve_forever, telegram.server.serve_forever, websocket.serve_forever):
+        threading.Thread(target=target, daemon=True).start()
+    channels = [f"wschannel{number:019d}" for number in range(args.channels)]
+    db, processor, poller = build_pipeline(mattermost, telegram, channels, os.path.join(tempfile.mkdtemp(), "ws.db"))
+    processor.telegram_sender = TelegramSender(
+        processor.telegram_bot, global_rate=UNLIMITED_RATE, chat_rate=UNLIMITED_RATE, group_rate=UNLIMITED_RATE
+    )
+    stream = MattermostEventStream(poller.config, poller, ws_url=websocket.ws_url)
+
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=processor.scheduler.run, args=(stop_event,), daemon=True),
+        threading.Thread(target=processor.telegram_sender.run, args=(stop_event,), daemon=True),
+        threading.Thread(target=processor.start_processing, args=(stop_event,), daemon=True),
+        threading.Thread(target=stream.run, args=(stop_event,), daemon=True)
+    ]
+    if processor.write_behind is not None:
+        threads.append(threading.Thread(target=processor.write_behind.run, args=(stop_event,), daemon=True))
+    for thread in threads:
+        thread.start()
+    wait_until(websocket.is_connected, args.timeout)
+
+    expected = set()
+    started = time.time()
+    for burst in range(args.bursts):
+        posts = []
+        for channel_id in channels:
+            post_ids = mattermost.add_posts(channel_id, args.burst_size)
+            posts.extend(mattermost.posts[post_id] for post_id in post_ids)
+            expected.update(post_ids)
+        # Пачка уходит, пока бот переподключается после прошлого разрыва
+        websocket.publish(posts)
+        wait_until(websocket.is_connected, args.timeout)
+        time.sleep(args.pause)
+        expire = args.expire_every > 0 and (burst + 1) % args.expire_every == 0
+        websocket.drop(expire)
+
+    delivered = wait_until(lambda: expected <= telegram.delivered.keys(), args.timeout)
+    result = {
+        'parameters': {
+            'bursts': args.bursts, 'burst_size': args.burst_size, 'channels': args.channels,
+            'expire_every': args.expire_every
+        },
+        'posts': len(expected),
+        'delivered': len(expected & telegram.delivered.keys()),
+        'all_delivered': delivered,
+        'duration': time.time() - started,
+        'server': {
+            'connects': websocket.connects, 'resumes': websocket.resumes, 'replayed': websocket.replayed,
+            'published': websocket.published, 'lost': websocket.lost
+        },
+        'stream': stream.get_current_statistics(),
+        'poller': poller.get_current_statistics()
+    }
+
+    stop_event.set()
+    websocket.drop()
+    for thread in threads:
+        thread.join(timeout=1)
+    db.close()
+    websocket.shutdown()
+    for server in (mattermost.server, telegram.server):
+        server.shutdown()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bursts', type=int, default=10)
+    parser.add_argument('--burst-size', type=int, default=20, help="постов в пачке на канал")
+    parser.add_argument('--channels', type=int, default=1)
+    parser.add_argument('--pause', type=float, default=0.2, help="пауза перед разрывом после пачки, с")
+    parser.add_argument('--expire-every', type=int, default=3, help="каждый N-й разрыв теряет сессию (0 - никогда)")
+    parser.add_argument('--timeout', type=float, default=60, help="сколько ждать подключения и доставки, с")
+    parser.add_argument('--output', help="файл для результатов в JSON")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"доставлено {result['delivered']} из {result['posts']} за {result['duration']:.2f} с")
+    print(f"  сервер: подключений {result['server']['connects']}, возобновлений {result['server']['resumes']}, "
+          f"дослано событий {result['server']['replayed']}, потеряно событий {result['server']['lost']}")
+    print(f"  бот: возобновлено {result['stream']['resumed_connects']}, добор since-запросом {result['stream']['gap_fills']}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(result, output, ensure_ascii=False, indent=2)
+    if not result['all_delivered']:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
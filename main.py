@@ -7,8 +7,11 @@ from varibles import *
 from back.database import *
 from back.logger import *
 from back.mattermost_poller import *
+from back.mattermost_stream import *
 from back.message_processor import *
 from back.config import *
+from back.metrics import *
+from back.retention import *
 
 def main():
     """Основная функция запуска"""
@@ -17,14 +20,38 @@ def main():
     try:
         config = Config()
         db = Database()
+        if config.convert_auto_vacuum:
+            # До запуска обработчиков: перестроение держит запись и не должно задерживать доставку
+            LOGGER.info("Перевод базы в auto_vacuum = INCREMENTAL")
+            if not db.enable_incremental_vacuum():
+                LOGGER.warning("База не переведена в auto_vacuum = INCREMENTAL, сжатие файла недоступно")
         processor = MessageProcessor(config, db)
+        start_metrics_server(config.metrics_port, processor)
+        
+        # Запускаем планировщик напоминаний и эскалаций
+        Thread(target=processor.scheduler.run, args=(stop_event,), daemon=True).start()
+        
+        # Запускаем исходящую очередь Telegram
+        Thread(target=processor.telegram_sender.run, args=(stop_event,), daemon=True).start()
+        
+        # Запускаем буфер отложенной записи, если он включен
+        if processor.write_behind is not None:
+            Thread(target=processor.write_behind.run, args=(stop_event,), daemon=True).start()
+        
+        # Запускаем перенос старой истории в архив и сжатие файла БД
+        retention = RetentionJob(db, MessageArchive(config.archive_dir), config.retention_days)
+        Thread(target=retention.run, args=(stop_event,), daemon=True).start()
         
         # Запускаем обработчик сообщений
         Thread(target=processor.start_processing, args=(stop_event,), daemon=True).start()
         
-        # Запускаем поллинг Mattermost
+        # Запускаем получение сообщений Mattermost: WebSocket-события или поллинг
         poller = MattermostPoller(config, processor)
-        Thread(target=poller.poll, args=(stop_event,), daemon=True).start()
+        if config.mattermost_ingest_mode == INGEST_MODE_WEBSOCKET:
+            stream = MattermostEventStream(config, poller)
+            Thread(target=stream.run, args=(stop_event,), daemon=True).start()
+        else:
+            Thread(target=poller.poll, args=(stop_event,), daemon=True).start()
         
         # Запускаем Telegram бота
         Thread(target=processor.telegram_bot.infinity_polling, daemon=True).start()
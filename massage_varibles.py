@@ -3,6 +3,8 @@ BOT_COMMAND_START = "/start"
 BOT_COMMAND_HELP = "/help"
 BOT_COMMAND_INFO = "/info"
 BOT_COMMAND_FAIR = "/yarmarka"
+BOT_COMMAND_LATENCY = "/latency"
+BOT_COMMAND_STATS = "/stats"
 
 # Приветственные сообщения
 WELCOME_MESSAGE = "Добро пожаловать! Я бот Валера.\nЯ помогу вам держать контакт между телеграмом и маттермостом."
@@ -67,16 +69,31 @@ ATTENTION_PREFIX = "Внимание: "
 # Ответы и подтверждения
 RESPONSE_SENT_CONFIRMATION = "Ваш ответ отправлен в Mattermost!"
 TASK_TAKEN_CONFIRMATION = "Задача взята в работу, исполнитель {user_name}"
+TASK_TAKEN_RESPONSE_PREFIX = "Задача взята в работу"
+TASK_TAKEN_RESPONSE_TEMPLATE = TASK_TAKEN_RESPONSE_PREFIX + " пользователем {user_name} (TG ID: {user_id})"
 TASK_GIVEN_AWAY_CONFIRMATION = "Задача вновь ищет исполнителя"
 
 # Информация о пользователях
 SPECIALIST_INFO_TEMPLATE = (
-    "Случайный специалист по внедрению:\n"
+    "Наименее загруженный специалист по внедрению:\n"
     "Имя: {first_name}\n"
     "Фамилия: {last_name}\n"
     "Email: {email}\n"
-    "Telegram: {telegram}"
+    "Telegram: {telegram}\n"
+    "Задач в работе: {open_tasks}"
 )
 NO_SPECIALISTS_ERROR = "❌ Нет специалистов по внедрению."
 
 FAIR_GIF_URL = "https://i.pinimg.com/originals/7d/a9/f0/7da9f09c8b61866d87a5c0db8e4957db.gif"
+
+# Отчет о задержках (/latency)
+LATENCY_REPORT_HEADER = "⏱ Задержки обработки сообщений за {hours} ч (p50 / p95 / p99, с):"
+LATENCY_REPORT_LINE = "{title}: {p50:.1f} / {p95:.1f} / {p99:.1f} (n={count})"
+LATENCY_REPORT_EMPTY = "Нет данных о сообщениях за {hours} ч."
+ADMIN_ONLY_ERROR = "❌ Команда доступна только в чате руководителя."
+
+# Статистика ответов (/stats)
+STATS_REPORT_HEADER = "📊 Статистика за {days} дн. (с {since}): ответов {responses}, взято в работу {taken}"
+STATS_REPORT_LINE = ("{name}: ответов {responses} (медиана {response_median}, p90 {response_p90}), "
+                     "взято {taken} (медиана {taken_median})")
+STATS_REPORT_EMPTY = "Нет ответов за {days} дн."
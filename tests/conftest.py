@@ -0,0 +1,25 @@
+import pytest
+
+from back.database import *
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "messages.db"))
+    yield database
+    database.close()
+
+@pytest.fixture
+def make_message():
+    def make(number: int, **fields) -> dict:
+        message = {
+            'message': f"Сообщение {number}",
+            'channel_id': 'c' * 26,
+            'post_id': f"post{number}",
+            'user_id': 'u' * 26,
+            'root_id': None,
+            'message_hash': f"hash{number}",
+            'timestamp': 1700000000.0 + number
+        }
+        message.update(fields)
+        return message
+    return make
@@ -0,0 +1,28 @@
+import time
+
+from back.cache import *
+
+def test_expired_entries_purged_after_recent_use_reorders_them():
+    cache = LRUCache(max_size=10, ttl=0.2)
+    cache.put('old')
+    time.sleep(0.1)
+    cache.put('new')
+    # Чтение переносит старую запись в конец LRU-порядка, но срок ее жизни не продлевает
+    assert cache.get('old') is True
+    time.sleep(0.15)
+
+    assert cache.purge_expired() == 1
+    assert 'old' not in cache
+    assert 'new' in cache
+
+def test_size_eviction_keeps_recently_used_entry():
+    cache = LRUCache(max_size=2, ttl=60)
+    cache.put('first')
+    cache.put('second')
+    assert not cache.add_if_absent('first')
+    cache.put('third')
+
+    assert 'first' in cache
+    assert 'second' not in cache
+    assert cache.purge_expired() == 0
+    assert len(cache) == 2
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from back.ingest_queue import *
+
+def test_claim_is_exclusive(db, make_message):
+    queues = [IngestQueue(db) for _ in range(4)]
+    queues[0].put_many([make_message(number) for number in range(200)])
+    claimed = [[] for _ in queues]
+
+    def drain(index):
+        while True:
+            messages = queues[index].claim(7)
+            if not messages:
+                return
+            claimed[index].extend(message['message_hash'] for message in messages)
+
+    threads = [threading.Thread(target=drain, args=(index,)) for index in range(len(queues))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    hashes = [message_hash for batch in claimed for message_hash in batch]
+    assert len(hashes) == len(set(hashes)) == 200
+
+def test_claimed_message_is_hidden_until_visibility_timeout(db, make_message):
+    queue = IngestQueue(db, visibility_timeout=0.2)
+    queue.put(make_message(1))
+    first = queue.claim(10)
+    assert [message['attempts'] for message in first] == [1]
+
+    queue.release('hash1')
+    assert queue.claim(10) == []
+    time.sleep(0.3)
+    second = queue.claim(10)
+    assert [message['message_hash'] for message in second] == ['hash1']
+    assert second[0]['attempts'] == 2
+    assert queue.get_statistics()['redelivered'] == 1
+
+def test_in_flight_message_is_not_redelivered_to_same_process(db, make_message):
+    queue = IngestQueue(db, visibility_timeout=0)
+    queue.put(make_message(1))
+    assert len(queue.claim(10)) == 1
+    assert queue.claim(10) == []
+
+def test_message_dropped_after_max_attempts(db, make_message):
+    queue = IngestQueue(db, visibility_timeout=0, max_attempts=2)
+    queue.put(make_message(1))
+    for attempt in (1, 2):
+        messages = queue.claim(10)
+        assert [message['attempts'] for message in messages] == [attempt]
+        queue.release('hash1')
+
+    assert queue.claim(10) == []
+    statistics = queue.get_statistics()
+    assert statistics['dropped'] == 1
+    assert db.get_ingest_queue_state() == (0, None)
+
+def test_unacked_messages_released_on_startup(db, make_message):
+    queue = IngestQueue(db, visibility_timeout=3600)
+    queue.put_many([make_message(1), make_message(2)])
+    assert len(queue.claim(10)) == 2
+
+    # Новый процесс не ждет visibility_timeout: забранное прежним процессом доступно сразу
+    restarted = IngestQueue(db, visibility_timeout=3600)
+    messages = restarted.claim(10)
+    assert [message['message_hash'] for message in messages] == ['hash1', 'hash2']
+    assert all(message['attempts'] == 2 for message in messages)
+
+def test_ack_deletes_claimed_message(db, make_message):
+    queue = IngestQueue(db, visibility_timeout=0)
+    queue.put_many([make_message(1), make_message(2)])
+    claimed = queue.claim(10)
+    queue.ack(claimed[0]['message_hash'])
+
+    assert db.get_ingest_queue_state()[0] == 1
+    assert queue.in_flight_count() == 1
+    queue.release(claimed[1]['message_hash'])
+    assert [message['message_hash'] for message in queue.claim(10)] == ['hash2']
+    restarted = IngestQueue(db)
+    assert [message['message_hash'] for message in restarted.claim(10)] == ['hash2']
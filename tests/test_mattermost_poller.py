@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+import back.mattermost_poller as mattermost_poller
+from benchmarks.pipeline_throughput import *
+
+CHANNEL_ID = 'c' * 26
+
+@pytest.fixture
+def pipeline(tmp_path):
+    mattermost, telegram = FakeMattermost(), FakeTelegram()
+    for server in (mattermost.server, telegram.server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    db, processor, poller = build_pipeline(mattermost, telegram, [CHANNEL_ID], str(tmp_path / "messages.db"))
+    yield mattermost, db, poller
+    db.close()
+    for server in (mattermost.server, telegram.server):
+        server.shutdown()
+
+def test_cursor_kept_when_batch_not_stored(pipeline, monkeypatch):
+    mattermost, db, poller = pipeline
+    channel = poller.channels[CHANNEL_ID]
+    start = channel.last_create_at
+    mattermost.add_posts(CHANNEL_ID, 3)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(db, 'store_messages', lambda *args, **kwargs: None)
+        poller.poll_once()
+    assert channel.last_create_at == start
+    assert db.get_poll_cursor(CHANNEL_ID) is None
+
+    # Следующий цикл забирает те же посты и сдвигает курсор вместе с ними
+    poller.poll_once()
+    assert channel.last_create_at > start
+    assert db.get_poll_cursor(CHANNEL_ID)[0] == channel.last_create_at
+    assert db.get_ingest_queue_state()[0] == 3
+
+def test_truncated_backfill_resumes_from_oldest_page(pipeline, monkeypatch):
+    mattermost, db, poller = pipeline
+    monkeypatch.setattr(mattermost_poller, 'BACKFILL_MAX_PAGES', 2)
+    monkeypatch.setattr(mattermost_poller, 'BACKFILL_PAGE_SIZE', 5)
+    monkeypatch.setattr(mattermost_poller, 'BACKFILL_CONCURRENCY', 1)
+    monkeypatch.setattr(mattermost_poller, 'MATTERMOST_SINCE_LIMIT', 10)
+    channel = poller.channels[CHANNEL_ID]
+    mattermost.add_posts(CHANNEL_ID, 1)
+    poller.poll_once()
+    start = channel.last_create_at
+
+    for _ in range(30):
+        mattermost.add_posts(CHANNEL_ID, 1)
+        time.sleep(0.002)
+    poller.poll_once()
+    # За цикл прочитаны только две страницы: курсор стоит, следующий цикл продолжит с третьей
+    assert channel.last_create_at == start
+    assert db.get_poll_cursor(CHANNEL_ID)[0] == start
+    assert channel.backfill_page == 2
+
+    for _ in range(10):
+        if not channel.backfill_page:
+            break
+        poller.poll_once()
+    newest = max(post['create_at'] for post in mattermost.posts.values())
+    assert channel.backfill_page == 0
+    assert channel.last_create_at == newest
+    assert db.get_poll_cursor(CHANNEL_ID)[0] == newest
+    assert db.get_ingest_queue_state()[0] == 31
@@ -0,0 +1,32 @@
+import threading
+
+from back.scheduler import *
+
+def test_counters_exact_under_concurrent_callbacks():
+    scheduler = TimerScheduler(workers=8)
+    done = threading.Semaphore(0)
+    total = 2000
+
+    def callback(number):
+        done.release()
+        if number % 4 == 0:
+            raise ValueError(number)
+
+    for number in range(total):
+        scheduler.schedule(0, callback, number)
+    stop_event = threading.Event()
+    runner = threading.Thread(target=scheduler.run, args=(stop_event,), daemon=True)
+    runner.start()
+    for _ in range(total):
+        assert done.acquire(timeout=10)
+
+    # Счетчик увеличивается после возврата callback - ждем, пока все таймеры будут учтены
+    for _ in range(500):
+        statistics = scheduler.get_statistics()
+        if statistics['fired'] + statistics['failed'] == total:
+            break
+        threading.Event().wait(0.01)
+    stop_event.set()
+    runner.join(timeout=5)
+    assert statistics['fired'] == total * 3 // 4
+    assert statistics['failed'] == total // 4
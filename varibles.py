@@ -1,7 +1,14 @@
 MATTERMOSTTIMEOUT = 20
 MASSAGETIMEOUT = 10
 USERTIMEOUT = 15
-MESSAGE_QUEUE_MAXSIZE = 100
+INGEST_QUEUE_HIGH_WATERMARK = 500
+INGEST_QUEUE_MAX_AGE = 300
+INGEST_VISIBILITY_TIMEOUT = 600
+INGEST_MAX_ATTEMPTS = 5
+INGEST_CLAIM_BATCH = 50
+INGEST_IDLE_WAIT = 1
+INGEST_STATE_TTL = 1
+INGEST_BACKPRESSURE_MAX_DELAY = 60
 RESPONSE_CHECK_TIMEOUT = 3600
 POLLING_INTERVAL = 10
 ERROR_RETRY_INTERVAL = 15
@@ -12,8 +19,101 @@ MM_DIRECT_MESSAGE_URL_TEMPLATE = "https://chat.skbkontur.ru/kontur/messages/@{us
 STAFF_PROFILE_URL_TEMPLATE = "https://staff.skbkontur.ru/profile/{username}"
 HTTP_SUCCESS = 200
 HTTP_CREATED = 201
+HTTP_NOT_FOUND = 404
 MAX_REMINDERS = 3 
 REMINDER_TIME = 7
+SCHEDULER_WORKERS = 2
+SCHEDULER_IDLE_WAIT = 1
+SCHEDULER_COMPACT_THRESHOLD = 1000
+PENDING_REGISTRY_SHARDS = 16
+PENDING_REGISTRY_MAX_SIZE = 10000
+PENDING_TASK_TTL = 3 * 24 * 3600
+PENDING_CLOSED_TTL = 24 * 3600
+PENDING_SWEEP_INTERVAL = 600
+PROCESSED_CACHE_SIZE = 10000
+PROCESSED_CACHE_TTL = 7 * 24 * 3600
+DB_JOURNAL_MODE = 'WAL'
+DB_SYNCHRONOUS = 'NORMAL'
+DB_CACHE_SIZE = -2000
+DB_MMAP_SIZE = 16 * 1024 * 1024
+DB_BUSY_TIMEOUT = 5000
+DB_MAX_VARIABLES = 500
+DB_AUTO_VACUUM_INCREMENTAL = 2
+WRITE_BEHIND_ENABLED = False
+WRITE_BEHIND_MAX_SIZE = 200
+WRITE_BEHIND_MAX_DELAY = 2
+INGEST_MODE_POLL = 'poll'
+INGEST_MODE_WEBSOCKET = 'websocket'
+WS_HEARTBEAT = 30
+WS_RECEIVE_TIMEOUT = 60
+WS_RECONNECT_MIN = 1
+WS_RECONNECT_MAX = 60
+MATTERMOST_SINCE_LIMIT = 1000
+BACKFILL_PAGE_SIZE = 200
+BACKFILL_CONCURRENCY = 4
+BACKFILL_MAX_PAGES = 50
+BACKFILL_TIME_BUDGET = 60
+MATTERMOST_MAX_CONCURRENCY = 8
+CHANNEL_IDLE_MAX_INTERVAL = 60
+MATTERMOST_POOL_SIZE = 16
+MATTERMOST_ENDPOINT_TIMEOUTS = {
+    'channel_posts': MATTERMOSTTIMEOUT,
+    'user': MASSAGETIMEOUT,
+    'users_by_ids': MASSAGETIMEOUT,
+    'create_post': USERTIMEOUT
+}
+USER_CACHE_SIZE = 5000
+USER_CACHE_TTL = 3600
+USER_NEGATIVE_CACHE_TTL = 600
+TG_SENDER_WORKERS = 4
+TG_GLOBAL_RATE = 30
+TG_GLOBAL_BURST = 30
+TG_CHAT_RATE = 1
+TG_CHAT_BURST = 3
+TG_GROUP_RATE = 20 / 60
+TG_GROUP_BURST = 5
+TG_TOO_MANY_REQUESTS = 429
+TG_SEND_MAX_RETRIES = 5
+PROCESSING_WORKERS = 4
+PROCESSING_WORKER_QUEUE_SIZE = 50
+DEFERRED_FLUSH_BATCH = 10
+DEFERRED_FLUSH_INTERVAL = 30
+METRICS_PORT = 8000
+MESSAGE_STAGES = ('created', 'seen', 'queued', 'dequeued', 'sent', 'taken', 'answered')
+STAGE_FLUSH_INTERVAL = 5
+LATENCY_REPORT_DEFAULT_HOURS = 24
+REPLAY_BATCH_SIZE = 500
+RETENTION_DAYS = 90
+RETENTION_INTERVAL = 3600
+RETENTION_BATCH_SIZE = 500
+RETENTION_BATCH_PAUSE = 0.2
+RETENTION_TIME_BUDGET = 60
+VACUUM_STEP_PAGES = 256
+# Полный VACUUM при переводе в INCREMENTAL пишет копию базы и журнал: нужно около двух размеров файла
+VACUUM_FREE_SPACE_FACTOR = 2
+# Верхние границы (в секундах) корзин гистограммы времени ответа/взятия; последняя корзина - все, что дольше
+STATS_DURATION_BUCKETS = (60, 300, 600, 1800, 3600, 7200, 14400, 43200, 86400)
+STATS_DEFAULT_DAYS = 7
+STATS_KIND_RESPONSE = 'response'
+STATS_KIND_TAKEN = 'taken'
+FAIR_POSITION = 'Специалист по интеграции'
+ASSIGNMENT_RELOAD_INTERVAL = 600
+ASSIGNMENT_HEAP_SLACK = 64
+# Задача без ответа дольше срока жизни ожидающей задачи в нагрузке не учитывается
+ASSIGNMENT_OPEN_TASK_TTL = PENDING_TASK_TTL
+TASK_STATUS_PENDING = 'pending'
+TASK_STATUS_COMPLETED = 'completed'
+TASK_STATUS_CANCELLED = 'cancelled'
+# Историческая задача, которую так и не закрыли ответом; completed_at не заполняется
+TASK_STATUS_EXPIRED = 'expired'
+ARCHIVE_DIR = 'archive'
+ARCHIVE_MESSAGE_COLUMNS = ('id', 'message_hash', 'message_text', 'channel_id', 'post_id', 'user_id', 'timestamp',
+                           'is_processed', 'is_responded', 'response_text', 'response_time', 'responder_id',
+                           'created_at')
+ARCHIVE_TASK_COLUMNS = ('id', 'message_id', 'assigned_to', 'status', 'taken_at', 'completed_at')
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+METRICS_LOCK_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+TIMEZONE_ALIASES = {'мск': 'Europe/Moscow', 'екб': 'Asia/Yekaterinburg'}
 
 WORK_TIME = {'start': 9, 'end': 16}
 
@@ -26,20 +126,41 @@ DB_UPDATE_RESPONSE_ERROR = "Error updating message response: {error}"
 DB_USER_UPDATE_ERROR = "Error adding/updating user: {error}"
 DB_GET_USER_ERROR = "Error getting user info: {error}"
 DB_GET_USERS_TZ_ERROR = "Error fetching users with time zone: {error}"
-DB_RANDOM_USER_ERROR = "Error getting random user by position: {error}"
 DB_CREATE_TASK_ERROR = "Error creating task: {error}"
 DB_UPDATE_TASK_ERROR = "Error updating task status: {error}"
 DB_GET_USER_EMAIL_ERROR = "Error getting user by email: {error}"
+DB_PENDING_TASK_ERROR = "Error saving pending task: {error}"
+DB_MIGRATION_ERROR = "Error applying migration {version}: {error}"
+DB_POLL_CURSOR_ERROR = "Error saving poll cursor: {error}"
+DB_DEFERRED_ERROR = "Error accessing deferred messages: {error}"
+DB_MESSAGE_STAGES_ERROR = "Error accessing message stages: {error}"
+DB_INGEST_QUEUE_ERROR = "Error accessing ingest queue: {error}"
+DB_RETENTION_ERROR = "Error archiving old messages: {error}"
+DB_VACUUM_SPACE_ERROR = "Not enough free space to convert database to incremental auto_vacuum: need {required} bytes, free {free} bytes in {path}"
+DB_STATS_ERROR = "Error accessing responder stats: {error}"
+DB_ASSIGNMENT_ERROR = "Error loading assignment candidates: {error}"
 
 # Ошибки Mattermost
 MM_POLL_ERROR = "Mattermost poll error: {error}"
 MM_POLL_EXCEPTION = "Mattermost poll exception: {error}"
+MM_BATCH_NOT_SAVED_ERROR = "Posts of channel {channel_id} were not saved ({count} mentions), cursor kept"
 MM_SEND_ERROR = "Mattermost send error: {error}"
 MM_USER_INFO_ERROR = "Ошибка получения информации о пользователе: {error}"
+MM_WEBSOCKET_ERROR = "Mattermost websocket error: {error}"
 
 # Ошибки Telegram
 TG_SEND_ERROR = "Ошибка отправки в Telegram: {error}"
 
+# Ошибки планировщика
+SCHEDULER_CALLBACK_ERROR = "Ошибка выполнения таймера: {error}"
+
+# Ошибки обработки очереди
+PROCESSING_ERROR = "Ошибка обработки сообщения {message_hash}: {error}"
+INGEST_DROPPED_ERROR = "Сообщение {message_hash} снято с очереди после {attempts} попыток"
+
+# Ошибки хранения истории
+RETENTION_ERROR = "Ошибка архивации истории сообщений: {error}"
+
 # Общие ошибки
 WEBHOOK_SERVER_ERROR = "Webhook server error: {error}"
 FATAL_ERROR = "Fatal error: {error}"